@@ -0,0 +1,155 @@
+import asyncio
+import math
+import os
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 64))  # requests being worked on at once
+DEGRADE_AT = int(os.environ.get('ADMISSION_DEGRADE_AT', 32))  # in-flight count above which new requests get the cheap tier
+MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', 128))  # requests queued for a slot before new ones are shed
+QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 2.0))  # seconds a request may wait for a slot
+
+FULL = 'full'
+DEGRADED = 'degraded'
+
+
+class Overloaded(Exception):
+    """A request was shed: no slot was free and the queue was full or its deadline passed."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        # Called with the controller's lock held, possibly from another thread than the waiter's
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class AdmissionController:
+    """
+    Bounded admission in front of the route ranking pipeline.
+
+    Up to `degrade_at` concurrent requests get the full tier. Beyond that, and up to
+    `max_in_flight`, requests are admitted to the degraded tier, which the caller serves
+    with a cheaper pipeline. Past the in-flight limit, requests wait in a FIFO queue of at
+    most `max_waiting` for up to `queue_timeout` seconds and then run degraded. Requests
+    that find the queue full or time out in it are shed with Overloaded, so callers can
+    answer 503 at once instead of piling up.
+    """
+
+    def __init__(self, max_in_flight=MAX_IN_FLIGHT, degrade_at=DEGRADE_AT, max_waiting=MAX_WAITING,
+                 queue_timeout=QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.degrade_at = min(degrade_at, max_in_flight)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = {FULL: 0, DEGRADED: 0}
+        self.shed = 0
+
+    @property
+    def retry_after(self):
+        return max(1, math.ceil(self.queue_timeout))
+
+    def _enter(self, loop=None):
+        """Take a free slot and return its tier, or queue a waiter. Called with the lock held."""
+        if self.in_flight < self.max_in_flight and not self.waiters:
+            self.in_flight += 1
+            tier = FULL if self.in_flight <= self.degrade_at else DEGRADED
+            self.admitted[tier] += 1
+            return tier, None
+        if len(self.waiters) >= self.max_waiting:
+            self.shed += 1
+            raise Overloaded("Service overloaded, retry shortly", self.retry_after)
+        waiter = _Waiter(loop)
+        self.waiters.append(waiter)
+        return None, waiter
+
+    def _abandon(self, waiter):
+        """Settle a waiter that stopped waiting: True if it was granted a slot meanwhile."""
+        with self.lock:
+            if waiter.granted:
+                self.admitted[DEGRADED] += 1
+                return True
+            self.waiters.remove(waiter)
+            self.shed += 1
+            return False
+
+    def _release(self):
+        with self.lock:
+            if self.waiters:
+                # The slot passes straight to the oldest waiter, so in_flight stays the same
+                self.waiters.popleft().grant()
+            else:
+                self.in_flight -= 1
+
+    @contextmanager
+    def admit(self):
+        """
+        Hold a slot for the duration of a request on a worker thread.
+
+        Returns:
+        str: the tier to serve, FULL or DEGRADED
+
+        Raises:
+        Overloaded: if the request is shed
+        """
+        with self.lock:
+            tier, waiter = self._enter()
+        if waiter is not None:
+            if waiter.event.wait(self.queue_timeout):
+                with self.lock:
+                    self.admitted[DEGRADED] += 1
+            elif not self._abandon(waiter):
+                raise Overloaded("Timed out waiting for capacity, retry shortly", self.retry_after)
+            tier = DEGRADED
+        try:
+            yield tier
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def admit_async(self):
+        """admit() for coroutines: waiting for a slot does not block the event loop."""
+        with self.lock:
+            tier, waiter = self._enter(asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+                with self.lock:
+                    self.admitted[DEGRADED] += 1
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise Overloaded("Timed out waiting for capacity, retry shortly", self.retry_after)
+            except asyncio.CancelledError:
+                # The client went away; hand back a slot granted in the meantime
+                if self._abandon(waiter):
+                    self._release()
+                raise
+            tier = DEGRADED
+        try:
+            yield tier
+        finally:
+            self._release()
+
+    def stats(self):
+        with self.lock:
+            return {'in_flight': self.in_flight, 'waiting': len(self.waiters), 'admitted_full': self.admitted[FULL],
+                    'admitted_degraded': self.admitted[DEGRADED], 'shed': self.shed}
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+
+from admission import DEGRADED, FULL, Overloaded
+from model import HEALTH_ENDPOINTS, crime_file, model, not_ready_body, warmup
+from osrm_client import OSRM_TIMEOUT, run_plan_async
+from route_cache import route_request_key
+from warmup import RETRY_AFTER
+
+# Scoring is CPU-bound, so the pool matches the cores; network waits never hold a thread.
+# Run several processes for more throughput: uvicorn asgi_app:app --workers <cores>
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', os.cpu_count() or 1))
+OSRM_MAX_CONNECTIONS = 200
+
+executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='scoring')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.osrm = httpx.AsyncClient(limits=httpx.Limits(max_connections=OSRM_MAX_CONNECTIONS),
+                                       timeout=OSRM_TIMEOUT)
+    yield
+    await app.state.osrm.aclose()
+
+
+class ReadinessGate:
+    """Answers 503 to everything but the health checks until the warm-up has finished."""
+
+    def __init__(self, app):
+        self.app = app
+        self.health_paths = {f'/{endpoint}' for endpoint in HEALTH_ENDPOINTS}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and not warmup.ready and scope['path'] not in self.health_paths:
+            response = JSONResponse(not_ready_body(), status_code=503, headers={'Retry-After': str(RETRY_AFTER)})
+            await response(scope, receive, send)
+            return
+        await self.app(scope, receive, send)
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ReadinessGate)
+app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+def score_routes(routes, time_category, degraded=False):
+    """Rank routes and serialize the response body on a pool thread; None if none could be scored."""
+    ranked_routes = model.evaluate_routes(routes, time_category, degraded)
+    if not ranked_routes:
+        return None
+    return json.dumps(model.serialize(ranked_routes))
+
+
+@app.get('/healthz')
+async def healthz():
+    # Alive unless the warm-up failed, which no amount of waiting fixes
+    if warmup.failed:
+        return JSONResponse({'status': 'failed', 'warmup': warmup.status()}, status_code=503)
+    return JSONResponse({'status': 'alive'})
+
+
+@app.get('/readyz')
+async def readyz():
+    if not warmup.ready:
+        return JSONResponse(not_ready_body(), status_code=503, headers={'Retry-After': str(RETRY_AFTER)})
+    return JSONResponse({'status': 'ready', 'warmup': warmup.status()})
+
+
+@app.post('/evaluate_routes')
+async def evaluate_routes(request: Request):
+    try:
+        data = await request.json()
+        source = data.get('source')
+        destination = data.get('destination')
+        time_category = data.get('time_category')
+
+        if not source or not destination:
+            return JSONResponse({'error': 'Source and destination required'}, status_code=400)
+
+        logging.info("Received request: source=%s, destination=%s, time_category=%s", source, destination, time_category)
+        loop = asyncio.get_running_loop()
+
+        async def rank():
+            try:
+                async with model.admission.admit_async() as tier:
+                    degraded = tier == DEGRADED
+                    try:
+                        routes = await run_plan_async(model.route_plan(source, destination, degraded),
+                                                      request.app.state.osrm, executor)
+                    except Exception as e:
+                        logging.error("Error fetching routes: %s", e)
+                        routes = None
+                    if not routes:
+                        return {'error': 'Could not fetch routes'}, 500, tier
+
+                    body = await loop.run_in_executor(executor, score_routes, routes, time_category, degraded)
+                    if body is None:
+                        return {'error': 'No valid routes evaluated'}, 500, tier
+                    return body, 200, tier
+            except Overloaded as e:
+                return {'error': str(e), 'retry_after': e.retry_after}, 503, None
+
+        key = route_request_key(source, destination, time_category, model.dataset_version)
+        body, status, tier = await model.result_cache.get_or_compute_async(
+            key, rank, cacheable=lambda result: result[1] == 200 and result[2] == FULL)
+        if status == 503:
+            return JSONResponse(body, status_code=503, headers={'Retry-After': str(body['retry_after'])})
+        if status != 200:
+            return JSONResponse(body, status_code=status)
+        return Response(body, media_type='application/json', headers={'X-Service-Tier': tier})
+    except Exception as e:
+        logging.error("Error in evaluate_routes: %s", e)
+        return JSONResponse({'error': f'Internal server error: {str(e)}'}, status_code=500)
+
+
+@app.post('/load_crime_data')
+async def load_crime_data(request: Request):
+    try:
+        data = await request.json()
+        file_path = data.get('file_path', crime_file)
+        await asyncio.get_running_loop().run_in_executor(executor, model.load_crime_data, file_path)
+        return JSONResponse({'message': 'Crime data loaded successfully'})
+    except Exception as e:
+        logging.error("Error loading crime data: %s", e)
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+@app.get('/model_performance')
+async def get_model_performance():
+    if not model.model_performance:
+        return JSONResponse({'error': 'Model performance metrics not available. Model might not be trained yet.'},
+                            status_code=404)
+    return JSONResponse(model.serialize(model.model_performance))
+
+
+@app.post('/navigation/start')
+async def navigation_start(request: Request):
+    try:
+        data = await request.json()
+        session = await asyncio.get_running_loop().run_in_executor(
+            executor, model.navigator.start, data.get('time_category'), data.get('route_id'), data.get('route_coords'))
+        return JSONResponse(model.serialize(session))
+    except KeyError as e:
+        return JSONResponse({'error': str(e.args[0])}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logging.error("Error starting navigation: %s", e)
+        return JSONResponse({'error': f'Internal server error: {str(e)}'}, status_code=500)
+
+
+@app.post('/navigation/update')
+async def navigation_update(request: Request):
+    try:
+        data = await request.json()
+        if not data.get('session_id') or not data.get('location'):
+            return JSONResponse({'error': 'session_id and location required'}, status_code=400)
+        report = await asyncio.get_running_loop().run_in_executor(
+            executor, model.navigator.update, data['session_id'], data['location'])
+        return JSONResponse(model.serialize(report))
+    except KeyError as e:
+        return JSONResponse({'error': str(e.args[0])}, status_code=404)
+    except Exception as e:
+        logging.error("Error updating navigation: %s", e)
+        return JSONResponse({'error': f'Internal server error: {str(e)}'}, status_code=500)
+
+
+@app.post('/navigation/end')
+async def navigation_end(request: Request):
+    data = await request.json()
+    if not model.navigator.end(data.get('session_id')):
+        return JSONResponse({'error': 'Unknown session'}, status_code=404)
+    return JSONResponse({'message': 'Navigation session ended'})
+
+
+@app.get('/tiles/{z:int}/{x:int}/{y:int}.{fmt}')
+async def heatmap_tile(z: int, x: int, y: int, fmt: str, min_severity: int = 1, time_category: str = None):
+    try:
+        # Rendering may load shards and build their grids, so it runs on the pool like scoring
+        tile = await asyncio.get_running_loop().run_in_executor(
+            executor, model.heatmap_tiles.tile, z, x, y, fmt, min_severity, time_category)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logging.error("Error rendering tile %s/%s/%s: %s", z, x, y, e)
+        return JSONResponse({'error': f'Internal server error: {str(e)}'}, status_code=500)
+
+    headers = {'Cache-Control': 'public, max-age=3600'}
+    if fmt == 'png':
+        return Response(tile, media_type='image/png', headers=headers)
+    return JSONResponse(model.serialize(tile), headers=headers)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # log_config=None leaves uvicorn's own loggers on the queue set up by log_pipeline
+    uvicorn.run(app, host='0.0.0.0', port=8000, log_config=None)
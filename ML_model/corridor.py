@@ -0,0 +1,249 @@
+from itertools import chain
+
+import numpy as np
+
+SIMPLIFY_FRACTION = 0.25  # Douglas-Peucker tolerance as a fraction of the query radius
+SPACING_FRACTION = 1.0  # probe spacing along the simplified route as a fraction of the radius
+MAX_DISTANCE_CELLS = 1000000  # bounds the point x segment matrix built per chunk
+
+
+def _project(points, starts, ends):
+    """Distance from every point to every segment and the position t in [0, 1] of the closest point on it."""
+    seg = ends - starts
+    seg_len2 = np.einsum('ij,ij->i', seg, seg)
+    rel = points[:, None, :] - starts[None, :, :]
+    t = np.einsum('pij,ij->pi', rel, seg) / np.where(seg_len2 > 0, seg_len2, 1)
+    t = np.clip(t, 0, 1)
+    nearest = starts[None, :, :] + t[:, :, None] * seg[None, :, :]
+    return np.linalg.norm(points[:, None, :] - nearest, axis=2), t
+
+
+def _segment_distances(points, starts, ends):
+    """Distance from every point to every segment, shape (len(points), len(starts))."""
+    return _project(points, starts, ends)[0]
+
+
+def _paired_segment_distances(points, starts, ends):
+    """Distance from each point to the segment in the same row, shape (len(points),)."""
+    seg = ends - starts
+    seg_len2 = np.einsum('ij,ij->i', seg, seg)
+    t = np.einsum('ij,ij->i', points - starts, seg) / np.where(seg_len2 > 0, seg_len2, 1)
+    nearest = starts + np.clip(t, 0, 1)[:, None] * seg
+    return np.linalg.norm(points - nearest, axis=1)
+
+
+def polyline_distances(points, coords):
+    """
+    Exact distance from each point to the nearest segment of a polyline.
+
+    Parameters:
+    points (ndarray): (P, 2) query points
+    coords (array-like): (N, 2) polyline vertices
+
+    Returns:
+    ndarray: (P,) distances, in the same units as the inputs
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(coords) == 1:
+        return np.linalg.norm(points - coords[0], axis=1)
+    starts, ends = coords[:-1], coords[1:]
+    chunk = max(1, MAX_DISTANCE_CELLS // len(starts))
+    return np.concatenate([
+        _segment_distances(points[i:i + chunk], starts, ends).min(axis=1)
+        for i in range(0, len(points), chunk)
+    ]) if len(points) else np.array([])
+
+
+def polyline_nearest(points, coords):
+    """
+    Closest segment of a polyline for each point.
+
+    Parameters:
+    points (ndarray): (P, 2) query points
+    coords (array-like): (N, 2) polyline vertices, N >= 2
+
+    Returns:
+    tuple: (distances (P,), segment indices (P,), positions t in [0, 1] along those segments (P,))
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    starts, ends = coords[:-1], coords[1:]
+    chunk = max(1, MAX_DISTANCE_CELLS // len(starts))
+    distances, segments, positions = [], [], []
+    for i in range(0, len(points), chunk):
+        dist, t = _project(points[i:i + chunk], starts, ends)
+        best = np.argmin(dist, axis=1)
+        rows = np.arange(len(best))
+        distances.append(dist[rows, best])
+        segments.append(best)
+        positions.append(t[rows, best])
+    if not distances:
+        return np.array([]), np.array([], dtype=np.int64), np.array([])
+    return np.concatenate(distances), np.concatenate(segments), np.concatenate(positions)
+
+
+def simplify(coords, tolerance):
+    """
+    Douglas-Peucker simplification of a polyline.
+
+    Parameters:
+    coords (array-like): (N, 2) polyline vertices
+    tolerance (float): maximum distance between the original and simplified line
+
+    Returns:
+    ndarray: (M, 2) retained vertices, always including both endpoints
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    return coords[_simplify_mask(coords, tolerance)]
+
+
+def _simplify_mask(coords, tolerance):
+    """Which vertices Douglas-Peucker simplification keeps."""
+    if len(coords) < 3:
+        return np.ones(len(coords), dtype=bool)
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        inner = coords[first + 1:last]
+        dist = _segment_distances(inner, coords[first:first + 1], coords[last:last + 1])[:, 0]
+        split = int(np.argmax(dist))
+        if dist[split] > tolerance:
+            split += first + 1
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def resample(coords, spacing):
+    """
+    Points at a fixed spacing along a polyline, endpoints and vertices included.
+
+    Parameters:
+    coords (array-like): (N, 2) polyline vertices
+    spacing (float): maximum gap between consecutive returned points
+
+    Returns:
+    ndarray: (M, 2) points along the polyline
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    return _resample(coords, spacing)[0]
+
+
+def _resample(coords, spacing):
+    """resample() and the segment each returned point lies on."""
+    if len(coords) < 2:
+        return coords, np.zeros(len(coords), dtype=np.int64)
+    seg = np.diff(coords, axis=0)
+    seg_len = np.linalg.norm(seg, axis=1)
+    steps = np.maximum(np.ceil(seg_len / spacing).astype(int), 1)
+    seg_idx = np.repeat(np.arange(len(seg)), steps)
+    t = (np.arange(len(seg_idx)) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[seg_idx]
+    points = coords[seg_idx] + t[:, None] * seg[seg_idx]
+    return np.vstack([points, coords[-1:]]), np.r_[seg_idx, len(seg) - 1]
+
+
+def corridor_probes(coords, radius):
+    """
+    Probe points covering the corridor of a route, and the radius each probe must search.
+
+    The route is simplified to a tolerance below the radius and resampled at a spacing
+    tied to it, so any point within `radius` of the original route lies within the
+    returned probe radius of some probe on the simplified segment that stands in for the
+    part of the route the point is close to. A probe at a vertex of the simplified route
+    stands in for the segments on both sides of it.
+
+    Returns:
+    tuple: (probes (M, 2), probe_radius, (spans, kept)): the simplified segment of each
+    probe (M,), and the original vertex index of each simplified vertex, so that span s
+    covers the original vertices kept[s] to kept[s + 1]
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    tolerance = radius * SIMPLIFY_FRACTION
+    spacing = radius * SPACING_FRACTION
+    if len(coords) * spacing < np.linalg.norm(np.diff(coords, axis=0), axis=1).sum():
+        # Fewer vertices than probes: dropping some would barely thin the probes out
+        kept = np.arange(len(coords))
+    else:
+        kept = np.flatnonzero(_simplify_mask(coords, tolerance))
+    probes, spans = _resample(coords[kept], spacing)
+    return probes, radius + tolerance + spacing / 2, (spans, kept)
+
+
+def query_corridor(tree, coords, radius, probes=None):
+    """
+    Indices of the tree's points lying within `radius` of a route polyline.
+
+    Candidates come from a few ball queries around the corridor probes and are then
+    kept only if their exact point-to-segment distance to the route is within radius.
+    Each candidate is measured only against the stretch of route behind the probes
+    that found it, so the work stays proportional to the candidates, not to candidates
+    times route segments.
+
+    Parameters:
+    tree (cKDTree): index over the points to search
+    coords (array-like): (N, 2) route vertices
+    radius (float): corridor half-width, in the tree's units
+    probes (tuple, optional): corridor_probes(coords, radius), when querying several trees
+
+    Returns:
+    ndarray: sorted unique indices into the tree's data
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    if len(coords) == 0 or tree.n == 0:
+        return np.array([], dtype=np.int64)
+    probes, probe_radius, (spans, kept) = probes if probes is not None else corridor_probes(coords, radius)
+    hits = tree.query_ball_point(probes, probe_radius, return_sorted=False)
+    counts = np.fromiter(map(len, hits), dtype=np.int64, count=len(hits))
+    candidates = np.fromiter(chain.from_iterable(hits), dtype=np.int64, count=counts.sum())
+    if len(kept) < 2:
+        candidates = np.unique(candidates)
+        return candidates[polyline_distances(tree.data[candidates], coords) <= radius]
+
+    # A probe starting a span after the first also ends the previous one
+    n_spans = len(kept) - 1
+    vertex = np.r_[False, spans[1:] != spans[:-1]]
+    hit_spans = np.repeat(spans, counts)
+    shared = np.repeat(vertex, counts)
+    pairs = np.unique(np.r_[candidates * n_spans + hit_spans, candidates[shared] * n_spans + hit_spans[shared] - 1])
+    candidates, pair_spans = np.divmod(pairs, n_spans)
+
+    # Every (candidate, original segment of its span) row, in chunks of bounded size
+    first, n_segments = kept[pair_spans], np.diff(kept)[pair_spans]
+    ends = np.cumsum(n_segments)
+    near = np.zeros(len(pairs), dtype=bool)
+    lo = 0
+    while lo < len(pairs):
+        hi = max(lo + 1, int(np.searchsorted(ends, ends[lo] - n_segments[lo] + MAX_DISTANCE_CELLS, side='right')))
+        counts = n_segments[lo:hi]
+        offsets = np.r_[0, np.cumsum(counts)[:-1]]
+        owner = np.repeat(np.arange(hi - lo), counts)
+        segment = first[lo:hi][owner] + np.arange(len(owner)) - offsets[owner]
+        distances = _paired_segment_distances(tree.data[candidates[lo:hi]][owner], coords[segment], coords[segment + 1])
+        near[lo:hi] = np.minimum.reduceat(distances, offsets) <= radius
+        lo = hi
+    return np.unique(candidates[near])
+
+
+def segments_near(points, starts, ends, radius):
+    """
+    Every (point, segment) pair with the point within radius of the segment.
+
+    Returns:
+    tuple: (point indices (K,), segment indices (K,))
+    """
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(points) == 0 or len(starts) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    chunk = max(1, MAX_DISTANCE_CELLS // len(starts))
+    point_idx, segment_idx = [], []
+    for i in range(0, len(points), chunk):
+        rows, cols = np.nonzero(_segment_distances(points[i:i + chunk], starts, ends) <= radius)
+        point_idx.append(rows + i)
+        segment_idx.append(cols)
+    return np.concatenate(point_idx), np.concatenate(segment_idx)
@@ -0,0 +1,480 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import KDTree
+from sklearn.cluster import DBSCAN
+
+from corridor import corridor_probes, query_corridor
+from crime_table import CrimeTable, memory_report
+from heatmap_tiles import HeatmapGrid, HeatmapOverview, time_category_codes
+from hotspots import cluster_stats, grid_dbscan
+
+REQUIRED_COLUMNS = ['Latitude', 'Longitude', 'Severity', 'CrimeID', 'CrimeCategory']
+CATEGORICAL_COLUMNS = ['CrimeCategory', 'CrimeType', 'CrimeDate', 'CrimeTime']
+HOTSPOT_EPS = 0.001
+HOTSPOT_MIN_SAMPLES = 5
+HOTSPOT_HORIZON = 0.05  # degrees (~5.5 km); distances to hotspots are capped here
+MANIFEST_NAME = 'shard_manifest.json'
+SHARD_SUFFIX = '_crime_data.csv'
+
+
+def read_crime_csv(file_path):
+    if file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path)
+    else:
+        # Low-cardinality strings are read straight into categoricals to keep the load peak down
+        df = pd.read_csv(file_path, dtype={col: 'category' for col in CATEGORICAL_COLUMNS})
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        raise ValueError("Missing required columns in dataset")
+    return df
+
+
+class CrimeShard:
+    """Crime records of one area, held as a compact CrimeTable, with their KD-tree and hotspot clusters."""
+
+    def __init__(self, name, df, clustering_mode='grid'):
+        self.name = name
+        self.table = CrimeTable(df)
+        self.crime_points = self.table.points
+        self.kd_tree = KDTree(self.crime_points)  # contiguous float64 input, so the tree shares it
+        self.max_severity = int(self.table.severity.max()) if len(df) else 0
+
+        if clustering_mode == 'grid':
+            labels = grid_dbscan(self.crime_points, eps=HOTSPOT_EPS, min_samples=HOTSPOT_MIN_SAMPLES)
+        else:
+            labels = DBSCAN(eps=HOTSPOT_EPS, min_samples=HOTSPOT_MIN_SAMPLES).fit(self.crime_points).labels_
+        self.cluster_labels = labels
+        self.cluster_centroids, self.cluster_severities = cluster_stats(
+            self.crime_points, self.table.severity, labels)
+        self.hotspot_tree = KDTree(self.cluster_centroids if self.cluster_centroids.size else np.empty((0, 2)))
+        # Table columns, the tree's index array and the cluster labels
+        self.nbytes = self.table.nbytes + self.kd_tree.indices.nbytes + self.cluster_labels.nbytes
+        self._heatmap = None
+        self.heatmap_lock = threading.Lock()
+        logging.info(f"Loaded crime data ({name}): {len(df)} records, {len(self.cluster_centroids)} clusters found")
+
+    @property
+    def heatmap(self):
+        """Per-zoom aggregation grid for heatmap tiles, built once on first use and counted in nbytes."""
+        if self._heatmap is None:
+            with self.heatmap_lock:
+                if self._heatmap is None:
+                    heatmap = HeatmapGrid(self.crime_points[:, 0], self.crime_points[:, 1], self.table.severity,
+                                          time_category_codes(self.table.hours), self.max_severity)
+                    self.nbytes += heatmap.nbytes
+                    self._heatmap = heatmap
+        return self._heatmap
+
+    def columns(self, indices):
+        return self.table.columns(indices)
+
+
+class CrimeIndex:
+    """
+    Crime lookups along routes. The base index holds one always-resident shard,
+    e.g. a single city-wide CSV.
+    """
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.max_severity = shard.max_severity
+
+    @classmethod
+    def from_csv(cls, file_path, clustering_mode='grid'):
+        return cls(CrimeShard(os.path.basename(file_path), read_crime_csv(file_path), clustering_mode))
+
+    def shards_for(self, route_coords, radius):
+        return [self.shard]
+
+    def heatmap_overview(self):
+        """Counts of the whole dataset for tiles up to PRECOMPUTED_MAX_ZOOM; here the one shard's grid."""
+        return self.shard.heatmap
+
+    def hotspot_shards(self, route_coords, radius, points, horizon):
+        """
+        Shards to search for hotspots near a route, and for each of `points` the distance
+        up to which those shards hold every hotspot, at most horizon.
+        """
+        return self.shards_for(route_coords, radius), np.full(len(points), float(horizon))
+
+    def training_areas(self, count, margin):
+        """Bounding boxes synthetic training routes must stay in, or None when they may go anywhere."""
+        return None
+
+    def query_route(self, route_coords, radius, with_keys=False):
+        """
+        Crimes within radius (degrees) of the route, one row per CrimeID.
+
+        Returns:
+        dict: REQUIRED_COLUMNS name -> array, rows in matching order, plus the int64
+        'CrimeKey' of each row (see encode_crime_ids) when with_keys is set
+        """
+        probes = corridor_probes(route_coords, radius)
+        shards = self.shards_for(route_coords, radius)
+        hits = [query_corridor(shard.kd_tree, route_coords, radius, probes) for shard in shards]
+        if not shards:
+            empty = {col: np.array([]) for col in REQUIRED_COLUMNS}
+            if with_keys:
+                empty['CrimeKey'] = np.array([], dtype=np.int64)
+            return empty
+        # Keep the first row per CrimeID, compared on the encoded keys
+        keys = np.concatenate([shard.table.id_keys[idx] for shard, idx in zip(shards, hits)])
+        _, first = np.unique(keys, return_index=True)
+        keep = np.zeros(len(keys), dtype=bool)
+        keep[first] = True
+        bounds = np.cumsum([0] + [len(idx) for idx in hits])
+        parts = [shard.columns(idx[keep[lo:hi]]) for shard, idx, lo, hi in zip(shards, hits, bounds[:-1], bounds[1:])]
+        crimes = {col: np.concatenate([part[col] for part in parts]) for col in REQUIRED_COLUMNS}
+        if with_keys:
+            crimes['CrimeKey'] = keys[keep]
+        return crimes
+
+    def query_hotspots(self, route_coords, radius, horizon=HOTSPOT_HORIZON):
+        """
+        Mean severities of hotspots within radius (degrees) of the route, and the
+        distance from the route to the closest hotspot, capped at horizon.
+        """
+        severities = []
+        probes = corridor_probes(route_coords, radius)
+        shards, probe_distances = self.hotspot_shards(route_coords, radius, probes[0], horizon)
+        for shard in shards:
+            if shard.cluster_centroids.size == 0:
+                continue
+            close_clusters = query_corridor(shard.hotspot_tree, route_coords, radius, probes)
+            severities.append(shard.cluster_severities[close_clusters])
+            distances, _ = shard.hotspot_tree.query(probes[0], distance_upper_bound=horizon)
+            probe_distances = np.minimum(probe_distances, distances)
+        min_distance = float(probe_distances.min()) if len(probe_distances) else horizon
+        return (np.concatenate(severities) if severities else np.array([])), min_distance
+
+    def route_hotspots(self, route_coords, radius, horizon=HOTSPOT_HORIZON):
+        """
+        Hotspots within radius (degrees) of the route, and the distance from each corridor
+        probe to its closest hotspot, capped at horizon; query_hotspots reduced per probe.
+
+        Returns:
+        tuple: (centroids (K, 2), mean severities (K,), probes (M, 2), probe distances (M,))
+        """
+        centroids, severities = [np.empty((0, 2))], [np.array([])]
+        probes = corridor_probes(route_coords, radius)
+        shards, probe_distances = self.hotspot_shards(route_coords, radius, probes[0], horizon)
+        for shard in shards:
+            if shard.cluster_centroids.size == 0:
+                continue
+            close_clusters = query_corridor(shard.hotspot_tree, route_coords, radius, probes)
+            centroids.append(shard.cluster_centroids[close_clusters])
+            severities.append(shard.cluster_severities[close_clusters])
+            distances, _ = shard.hotspot_tree.query(probes[0], distance_upper_bound=horizon)
+            probe_distances = np.minimum(probe_distances, distances)
+        return np.concatenate(centroids), np.concatenate(severities), probes[0], probe_distances
+
+    def hotspot_distances(self, points, horizon=HOTSPOT_HORIZON):
+        """Distance (degrees) from each point to its closest hotspot, capped at horizon."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        shards, distances = self.hotspot_shards(points, 0, points, horizon)
+        for shard in shards:
+            if shard.cluster_centroids.size == 0:
+                continue
+            distances = np.minimum(distances, shard.hotspot_tree.query(points, distance_upper_bound=horizon)[0])
+        return distances
+
+    def hotspot_severity_near(self, points, radius):
+        """Summed mean severity of the hotspots within radius (degrees) of each point."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        totals = np.zeros(len(points))
+        for shard in self.shards_for(points, radius):
+            if shard.cluster_centroids.size == 0:
+                continue
+            for i, close in enumerate(shard.hotspot_tree.query_ball_point(points, radius)):
+                totals[i] += shard.cluster_severities[close].sum()
+        return totals
+
+
+def _bbox_distances(points, bboxes):
+    """Distance from every point to every (min lat, min lon, max lat, max lon) box, 0 inside it."""
+    below = bboxes[None, :, :2] - points[:, None, :]
+    above = points[:, None, :] - bboxes[None, :, 2:]
+    return np.linalg.norm(np.maximum(np.maximum(below, above), 0), axis=2)
+
+
+def _row_hashes(columns):
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+def index_changes(old, new):
+    """
+    Where two single-shard indexes differ: crimes added, removed or edited, and
+    hotspots that appeared, moved, vanished or changed severity.
+
+    Returns:
+    tuple: (crime points (N, 2), hotspot centroids (K, 2)), or None when the indexes
+    cannot be compared cheaply (missing or sharded)
+    """
+    if type(old) is not CrimeIndex or type(new) is not CrimeIndex:
+        return None
+    old, new = old.shard, new.shard
+    old_rows, new_rows = _row_hashes(old.columns(slice(None))), _row_hashes(new.columns(slice(None)))
+    crime_points = np.vstack([old.crime_points[~np.isin(old_rows, new_rows)],
+                              new.crime_points[~np.isin(new_rows, old_rows)]])
+    old_centroids, new_centroids = old.cluster_centroids.reshape(-1, 2), new.cluster_centroids.reshape(-1, 2)
+    old_rows = _row_hashes({'lat': old_centroids[:, 0], 'lon': old_centroids[:, 1], 'severity': old.cluster_severities})
+    new_rows = _row_hashes({'lat': new_centroids[:, 0], 'lon': new_centroids[:, 1], 'severity': new.cluster_severities})
+    hotspot_points = np.vstack([old_centroids[~np.isin(old_rows, new_rows)], new_centroids[~np.isin(new_rows, old_rows)]])
+    return crime_points, hotspot_points
+
+
+class ShardedCrimeIndex(CrimeIndex):
+    """
+    Crime index split into per-district or per-tile shards listed in a manifest.
+
+    Only shards whose bounding box, buffered by the query radius, overlaps a route are
+    loaded. Loaded shards stay resident until the memory budget is exceeded, then the
+    least recently used ones are evicted. A shard is read and clustered by one caller
+    at a time, without holding the index lock, so queries touching resident shards
+    never wait behind a cold load.
+    """
+
+    def __init__(self, path, memory_budget_mb=512, clustering_mode='grid'):
+        manifest_path = os.path.join(path, MANIFEST_NAME) if os.path.isdir(path) else path
+        if not os.path.exists(manifest_path):
+            build_manifest(os.path.dirname(manifest_path))
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        self.base_dir = os.path.dirname(manifest_path)
+        self.shard_specs = manifest['shards']
+        if not self.shard_specs:
+            raise ValueError(f"No crime shards listed in {manifest_path}")
+        self.bboxes = np.array([spec['bbox'] for spec in self.shard_specs], dtype=float)
+        self.max_severity = max(spec['max_severity'] for spec in self.shard_specs)
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.clustering_mode = clustering_mode
+        self.resident = OrderedDict()
+        self.loading = {}  # shard name -> Future of the CrimeShard being loaded
+        self.lock = threading.Lock()
+        self._heatmap_overview = None
+        self.heatmap_overview_lock = threading.Lock()
+        logging.info(f"Crime shard manifest: {len(self.shard_specs)} shards, "
+                     f"{sum(spec['records'] for spec in self.shard_specs)} records, loading on demand")
+
+    @property
+    def resident_bytes(self):
+        return sum(shard.nbytes for shard in self.resident.values())
+
+    def shards_for(self, route_coords, radius):
+        coords = np.asarray(route_coords, dtype=float).reshape(-1, 2)
+        if len(coords) == 0:
+            return []
+        low = coords.min(axis=0) - radius
+        high = coords.max(axis=0) + radius
+        overlaps = np.all((self.bboxes[:, :2] <= high) & (self.bboxes[:, 2:] >= low), axis=1)
+        return self._acquire([self.shard_specs[i] for i in np.flatnonzero(overlaps)])
+
+    def hotspot_shards(self, route_coords, radius, points, horizon):
+        """
+        Only the shards the route itself touches are loaded. Resident shards within the
+        horizon are searched as well; any other shard within it is left on disk and caps
+        each point's horizon at the distance to its bounding box, so a hotspot the
+        search could have missed never looks farther away than it might be.
+        """
+        shards = self.shards_for(route_coords, radius)
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        horizons = np.full(len(points), float(horizon))
+        if len(points) == 0:
+            return shards, horizons
+        distances = _bbox_distances(points, self.bboxes)
+        within = distances.min(axis=0) < horizon
+        loaded = {shard.name for shard in shards}
+        with self.lock:
+            for i in np.flatnonzero(within):
+                name = self.shard_specs[i]['name']
+                if name in loaded:
+                    continue
+                if name in self.resident:
+                    shards.append(self.resident[name])
+                else:
+                    horizons = np.minimum(horizons, distances[:, i])
+        return shards, horizons
+
+    def heatmap_overview(self):
+        """
+        Built on first use by reading the shards one at a time, without loading them into the
+        index: shards already resident contribute their tables, the rest are read, counted and
+        dropped, so the overview never holds more than one extra shard and pins none.
+        """
+        if self._heatmap_overview is None:
+            with self.heatmap_overview_lock:
+                if self._heatmap_overview is None:
+                    overview = HeatmapOverview(self.max_severity)
+                    for spec in self.shard_specs:
+                        with self.lock:
+                            shard = self.resident.get(spec['name'])
+                        table = shard.table if shard is not None else CrimeTable(
+                            read_crime_csv(os.path.join(self.base_dir, spec['path'])))
+                        overview.add(table.points[:, 0], table.points[:, 1], table.severity,
+                                     time_category_codes(table.hours))
+                    self._heatmap_overview = overview.finish()
+                    logging.info(f"Heatmap overview built from {len(self.shard_specs)} shards "
+                                 f"({self._heatmap_overview.nbytes / 1024 / 1024:.1f} MB)")
+        return self._heatmap_overview
+
+    def training_areas(self, count, margin):
+        """
+        Bounding boxes of `count` shards sampled with a fixed seed, each shrunk by margin,
+        so training on routes kept inside them loads no other shard.
+        """
+        sample = np.random.default_rng(0).choice(len(self.shard_specs), size=min(count, len(self.shard_specs)),
+                                                 replace=False)
+        chosen = self.bboxes[np.sort(sample)]
+        centres = (chosen[:, :2] + chosen[:, 2:]) / 2
+        # Boxes thinner than twice the margin collapse onto their centre line
+        return np.hstack([np.minimum(chosen[:, :2] + margin, centres), np.maximum(chosen[:, 2:] - margin, centres)])
+
+    def _acquire(self, specs):
+        shards, led, pending = {}, [], {}
+        with self.lock:
+            for spec in specs:
+                name = spec['name']
+                if name in self.resident:
+                    self.resident.move_to_end(name)
+                    shards[name] = self.resident[name]
+                elif name in self.loading:
+                    pending[name] = self.loading[name]
+                else:
+                    pending[name] = self.loading[name] = Future()
+                    led.append(spec)
+
+        # Every shard this caller claimed is loaded before it waits on others, so none is left pending
+        for spec in led:
+            name = spec['name']
+            try:
+                shard = CrimeShard(name, read_crime_csv(os.path.join(self.base_dir, spec['path'])), self.clustering_mode)
+            except Exception as e:
+                with self.lock:
+                    del self.loading[name]
+                pending[name].set_exception(e)
+                continue
+            with self.lock:
+                del self.loading[name]
+                self.resident[name] = shard
+            pending[name].set_result(shard)
+        for name, future in pending.items():
+            shards[name] = future.result()
+
+        with self.lock:
+            for name, shard in shards.items():
+                # Marked used, or put back if a concurrent load evicted it in the meantime
+                if name in self.resident:
+                    self.resident.move_to_end(name)
+                else:
+                    self.resident[name] = shard
+            self._evict(keep=set(shards))
+        return [shards[spec['name']] for spec in specs]
+
+    def _evict(self, keep):
+        resident_bytes = self.resident_bytes
+        for name in list(self.resident):
+            if resident_bytes <= self.memory_budget:
+                break
+            if name in keep:
+                continue
+            resident_bytes -= self.resident.pop(name).nbytes
+            logging.info(f"Evicted crime shard {name}")
+
+
+def build_manifest(data_dir, suffix=SHARD_SUFFIX):
+    """
+    Write a shard manifest listing every `*<suffix>` file in data_dir with its bounding box.
+
+    Parameters:
+    data_dir (str): directory holding one CSV per district or tile
+    suffix (str): file name suffix shared by the shard CSVs
+
+    Returns:
+    str: path of the written manifest
+    """
+    shards = []
+    for path in sorted(glob.glob(os.path.join(data_dir, f'*{suffix}'))):
+        df = pd.read_csv(path, usecols=['Latitude', 'Longitude', 'Severity'])
+        if df.empty:
+            continue
+        shards.append({
+            'name': os.path.basename(path)[:-len(suffix)],
+            'path': os.path.basename(path),
+            'bbox': [float(df['Latitude'].min()), float(df['Longitude'].min()),
+                     float(df['Latitude'].max()), float(df['Longitude'].max())],
+            'records': len(df),
+            'max_severity': int(df['Severity'].max())
+        })
+    manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w') as f:
+        json.dump({'shards': shards}, f, indent=2)
+    logging.info(f"Wrote shard manifest with {len(shards)} shards to {manifest_path}")
+    return manifest_path
+
+
+def split_into_tiles(csv_file, out_dir, tile_size=0.05, chunksize=200000):
+    """
+    Split one large crime CSV into geographic tile shards and write their manifest.
+
+    Parameters:
+    csv_file (str): monolithic crime CSV
+    out_dir (str): directory receiving one `tile_<row>_<col>_crime_data.csv` per tile
+    tile_size (float): tile side in degrees
+    chunksize (int): rows read at a time, bounding memory use
+
+    Returns:
+    str: path of the written manifest
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(out_dir, f'tile_*{SHARD_SUFFIX}')):
+        os.remove(stale)
+    written = set()
+    for chunk in pd.read_csv(csv_file, chunksize=chunksize):
+        rows = np.floor(chunk['Latitude'] / tile_size).astype(int)
+        cols = np.floor(chunk['Longitude'] / tile_size).astype(int)
+        for (row, col), tile in chunk.groupby([rows, cols]):
+            path = os.path.join(out_dir, f'tile_{row}_{col}{SHARD_SUFFIX}')
+            tile.to_csv(path, mode='a', header=path not in written, index=False)
+            written.add(path)
+    return build_manifest(out_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build crime shard manifests")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    manifest_parser = subparsers.add_parser('manifest', help="index existing per-district CSVs")
+    manifest_parser.add_argument('data_dir')
+    tile_parser = subparsers.add_parser('tile', help="split one CSV into geographic tiles")
+    tile_parser.add_argument('csv_file')
+    tile_parser.add_argument('out_dir')
+    tile_parser.add_argument('--tile-size', type=float, default=0.05)
+    memory_parser = subparsers.add_parser('memory', help="compare the compact table with the old DataFrame layout")
+    memory_parser.add_argument('csv_file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'manifest':
+        print(build_manifest(args.data_dir))
+    elif args.command == 'tile':
+        print(split_into_tiles(args.csv_file, args.out_dir, args.tile_size))
+    else:
+        df = pd.read_parquet(args.csv_file) if args.csv_file.endswith('.parquet') else pd.read_csv(args.csv_file)
+        report = memory_report(df)
+        print(f"{report['records']} records")
+        for layout in ('legacy', 'compact'):
+            print(f"\n{layout} layout: {sum(report[layout].values()) / 2 ** 20:.1f} MB")
+            for part, size in report[layout].items():
+                print(f"  {part:<32} {size / 2 ** 20:8.2f} MB")
+        print(f"\n{report['saving_ratio']}x smaller")
+
+
+if __name__ == '__main__':
+    main()
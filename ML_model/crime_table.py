@@ -0,0 +1,184 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+ID_PATTERN = r'^([A-Z]{1,4})-(\d{6})-(\d{1,6})$'  # e.g. CAR-210417-626
+ID_FIELD_BITS = 20
+SECONDS_PER_DAY = 86400
+
+
+def _hash_ids(ids):
+    keys = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') >> 1 for s in ids]
+    return np.array(keys, dtype=np.int64)
+
+
+def encode_crime_ids(ids):
+    """
+    Pack crime IDs into int64 keys that compare equal exactly when the IDs do.
+
+    IDs shaped like `ABC-YYMMDD-NNN` are bit-packed (prefix letters, date digits,
+    sequence number and its width), so keys agree across shards and decode without a
+    dictionary. Any other ID set falls back to 63-bit hashes plus a lookup table.
+
+    Returns:
+    tuple: (keys (N,) int64, lookup dict key -> ID or None when bit-packed)
+    """
+    ids = pd.Series(ids, dtype=object).astype(str)
+    parts = ids.str.extract(ID_PATTERN)
+    if len(ids) == 0 or parts.notna().all().all():
+        prefix = np.zeros(len(ids), dtype=np.int64)
+        letters = parts[0].str.pad(4, side='right', fillchar='@').to_numpy(dtype='U4')
+        codes = letters.view(np.uint32).reshape(len(ids), 4).astype(np.int64) - ord('@')
+        for i in range(4):
+            prefix = prefix << 5 | codes[:, i]
+        digits = parts[1].astype(np.int64).to_numpy()
+        sequence = parts[2].astype(np.int64).to_numpy()
+        width = parts[2].str.len().to_numpy(dtype=np.int64)
+        keys = ((prefix << ID_FIELD_BITS | digits) << ID_FIELD_BITS | sequence) << 3 | width
+        return keys, None
+    uniques, codes = np.unique(ids.to_numpy(), return_inverse=True)
+    unique_keys = _hash_ids(uniques)
+    return unique_keys[codes], dict(zip(unique_keys.tolist(), uniques.tolist()))
+
+
+def decode_crime_ids(keys, lookup=None):
+    """Crime ID strings for keys produced by encode_crime_ids."""
+    if lookup is not None:
+        return np.array([lookup[k] for k in np.asarray(keys).tolist()], dtype=object)
+    ids = []
+    for key in np.asarray(keys, dtype=np.int64).tolist():
+        width = key & 7
+        key >>= 3
+        sequence = key & (2 ** ID_FIELD_BITS - 1)
+        key >>= ID_FIELD_BITS
+        digits = key & (2 ** ID_FIELD_BITS - 1)
+        prefix = key >> ID_FIELD_BITS
+        letters = ''.join(chr(ord('@') + (prefix >> shift & 31)) for shift in (15, 10, 5, 0)).rstrip('@')
+        ids.append(f"{letters}-{digits:06d}-{sequence:0{width}d}")
+    return np.array(ids, dtype=object)
+
+
+def _dictionary_encode(values):
+    """Categorical codes in the narrowest integer type, and their labels."""
+    categorical = pd.Categorical(values)
+    return categorical.codes, categorical.categories.to_numpy(dtype=object)
+
+
+def category_codes(labels):
+    """Integer code per decoded category label, equal labels sharing one, and -1 where the category is missing (None)."""
+    return pd.factorize(np.asarray(labels, dtype=object))[0]
+
+
+def pack_timestamps(dates, times):
+    """
+    Seconds since the epoch as uint32, parsed once per distinct date and time string.
+    Rows with a missing or unparsable date or time get 0.
+    """
+    date_codes, date_labels = _dictionary_encode(dates)
+    time_codes, time_labels = _dictionary_encode(times)
+    day_seconds = pd.to_datetime(pd.Series(date_labels, dtype=object), format='%Y-%m-%d', errors='coerce')
+    day_seconds = (day_seconds - pd.Timestamp(0)).dt.total_seconds().to_numpy()
+    clock = pd.to_timedelta(pd.Series(time_labels, dtype=object), errors='coerce').dt.total_seconds().to_numpy()
+    # A trailing NaN serves code -1 (missing)
+    day_seconds = np.append(day_seconds, np.nan)[date_codes]
+    clock = np.append(clock, np.nan)[time_codes]
+    seconds = day_seconds + clock
+    return np.where(np.isfinite(seconds), seconds, 0).astype(np.uint32)
+
+
+class CrimeTable:
+    """
+    Column store of crime records with narrow dtypes.
+
+    - points: one (N, 2) float64 Latitude/Longitude array, shared with the KD-tree
+    - severity: smallest integer type holding the values (int8 for 1-5)
+    - category, crime_type: categorical codes plus their labels
+    - timestamp: uint32 seconds since the epoch, 0 when unknown
+    - id_keys: int64 encoded CrimeIDs (see encode_crime_ids)
+    """
+
+    def __init__(self, df):
+        self.points = np.ascontiguousarray(
+            np.column_stack([df['Latitude'].astype(float), df['Longitude'].astype(float)]))
+        self.severity = pd.to_numeric(df['Severity'], downcast='integer').to_numpy()
+        self.category, self.category_labels = _dictionary_encode(df['CrimeCategory'])
+        if 'CrimeType' in df.columns:
+            self.crime_type, self.crime_type_labels = _dictionary_encode(df['CrimeType'])
+        else:
+            self.crime_type, self.crime_type_labels = np.full(len(df), -1, dtype=np.int8), np.array([], dtype=object)
+        if 'CrimeDate' in df.columns and 'CrimeTime' in df.columns:
+            self.timestamp = pack_timestamps(df['CrimeDate'], df['CrimeTime'])
+        else:
+            self.timestamp = np.zeros(len(df), dtype=np.uint32)
+        self.id_keys, self.id_lookup = encode_crime_ids(df['CrimeID'])
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def nbytes(self):
+        arrays = [self.points, self.severity, self.category, self.crime_type, self.timestamp, self.id_keys]
+        labels = [self.category_labels, self.crime_type_labels]
+        total = sum(a.nbytes for a in arrays) + sum(pd.Series(l).memory_usage(deep=True) for l in labels)
+        if self.id_lookup is not None:
+            total += int(pd.Series(list(self.id_lookup.values())).memory_usage(deep=True)) + 16 * len(self.id_lookup)
+        return int(total)
+
+    @property
+    def hours(self):
+        """Hour of day per crime, -1 when unknown."""
+        return np.where(self.timestamp > 0, self.timestamp % SECONDS_PER_DAY // 3600, -1)
+
+    def columns(self, indices):
+        """Latitude, Longitude, Severity, CrimeID and CrimeCategory (None when missing) of the given rows, decoded."""
+        return {
+            'Latitude': self.points[indices, 0],
+            'Longitude': self.points[indices, 1],
+            'Severity': self.severity[indices],
+            'CrimeID': decode_crime_ids(self.id_keys[indices], self.id_lookup),
+            # Code -1 (missing) picks the trailing None rather than the last label
+            'CrimeCategory': np.append(self.category_labels, None)[self.category[indices]],
+        }
+
+    def to_frame(self, indices=slice(None)):
+        """Rows decoded back to the CSV layout."""
+        df = pd.DataFrame(self.columns(indices))
+        df['CrimeType'] = np.append(self.crime_type_labels, None)[self.crime_type[indices]]
+        stamps = pd.to_datetime(self.timestamp[indices].astype(np.int64), unit='s')
+        known = self.timestamp[indices] > 0
+        df['CrimeDate'] = np.where(known, stamps.strftime('%Y-%m-%d'), None)
+        df['CrimeTime'] = np.where(known, stamps.strftime('%H:%M:%S'), None)
+        return df[['CrimeID', 'CrimeCategory', 'CrimeType', 'Latitude', 'Longitude', 'CrimeDate', 'CrimeTime', 'Severity']]
+
+
+def memory_report(df):
+    """
+    Bytes held per crime record set: the previous layout (full object DataFrame, the
+    lower-case coordinate copies, the crime_points array and the KD-tree's own copy)
+    against CrimeTable, whose points the KD-tree shares.
+
+    Returns:
+    dict: {'records', 'legacy': {part: bytes}, 'compact': {part: bytes}, 'saving_ratio'}
+    """
+    n = len(df)
+    legacy = {
+        'dataframe': int(df.memory_usage(deep=True).sum()),
+        'latitude/longitude copies': 2 * 8 * n,
+        'crime_points': 16 * n,
+        'kd_tree data copy': 16 * n,
+        'kd_tree indices': 8 * n,
+    }
+    table = CrimeTable(df)
+    compact = {
+        'points (shared with kd_tree)': table.points.nbytes,
+        'severity': table.severity.nbytes,
+        'category + crime_type codes': table.category.nbytes + table.crime_type.nbytes,
+        'labels': table.nbytes - sum(a.nbytes for a in (table.points, table.severity, table.category,
+                                                          table.crime_type, table.timestamp, table.id_keys)),
+        'timestamp': table.timestamp.nbytes,
+        'id_keys': table.id_keys.nbytes,
+        'kd_tree indices': 8 * n,
+    }
+    return {'records': n, 'legacy': legacy, 'compact': compact,
+            'saving_ratio': round(sum(legacy.values()) / max(sum(compact.values()), 1), 2)}
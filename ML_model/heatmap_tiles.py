@@ -0,0 +1,282 @@
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+GRID = 64  # aggregation cells per tile side; each cell is 4 x 4 pixels of a 256 px tile
+TILE_PIXELS = 256
+PRECOMPUTED_MAX_ZOOM = 12  # deeper tiles are aggregated on demand from the points of their z12 parent
+MAX_ZOOM = 18
+TIME_CATEGORIES = ['Morning', 'Afternoon', 'Evening', 'Night']
+N_TIME_CODES = len(TIME_CATEGORIES) + 1  # last code: time unknown
+
+
+def time_category_codes(hours):
+    """Map hours of day to TIME_CATEGORIES indices using the app's boundaries; -1 is unknown."""
+    hours = np.asarray(hours)
+    codes = np.full(len(hours), len(TIME_CATEGORIES), dtype=np.int8)
+    codes[(hours >= 6) & (hours < 12)] = 0
+    codes[(hours >= 12) & (hours < 17)] = 1
+    codes[(hours >= 17) & (hours < 21)] = 2
+    codes[((hours >= 21) & (hours < 24)) | ((hours >= 0) & (hours < 6))] = 3
+    return codes
+
+
+def mercator(lat, lon):
+    """Web Mercator coordinates normalised to [0, 1) with y growing southwards."""
+    lat = np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511)
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2
+    return np.clip(x, 0, np.nextafter(1, 0)), np.clip(y, 0, np.nextafter(1, 0))
+
+
+def tile_bounds(z, x, y):
+    """(min_lat, min_lon, max_lat, max_lon) covered by a z/x/y tile."""
+    n = 2 ** z
+    lons = np.array([x, x + 1]) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * np.array([y + 1, y]) / n))))
+    return lats[0], lons[0], lats[1], lons[1]
+
+
+def _layer_codes(severities, time_codes, max_severity):
+    """Severity/time layer of each crime, severities clipped to 1..max_severity."""
+    severity = np.clip(np.asarray(severities, dtype=np.int64), 1, max_severity)
+    return (severity - 1) * N_TIME_CODES + np.asarray(time_codes, dtype=np.int64)
+
+
+def _zoom_keys(mx, my, layers, n_layers, z):
+    """Sorted (cell, layer) keys at zoom z and the number of crimes under each."""
+    cells = GRID * 2 ** z
+    cell_keys = (my * cells).astype(np.int64) * cells + (mx * cells).astype(np.int64)
+    return np.unique(cell_keys * n_layers + layers, return_counts=True)
+
+
+def _densest_cell(keys, counts, n_layers):
+    """Crime count of the fullest cell over all layers."""
+    if len(keys) == 0:
+        return 0.0
+    cell_ids = keys // n_layers
+    cell_starts = np.flatnonzero(np.r_[True, cell_ids[1:] != cell_ids[:-1]])
+    return float(np.add.reduceat(counts, cell_starts).max())
+
+
+class _ZoomCounts:
+    """Sparse per-zoom (cell, layer) counts up to PRECOMPUTED_MAX_ZOOM, shared by the grids below."""
+
+    def __init__(self, max_severity):
+        self.max_severity = int(max(max_severity, 1))
+        self.n_layers = self.max_severity * N_TIME_CODES
+        self.zoom_keys, self.zoom_counts, self.zoom_max = [], [], []
+
+    def layer_mask(self, min_severity=1, time_category=None):
+        layers = np.arange(self.n_layers)
+        mask = layers // N_TIME_CODES + 1 >= min_severity
+        if time_category is not None:
+            mask &= layers % N_TIME_CODES == TIME_CATEGORIES.index(time_category)
+        return mask
+
+    def max_count(self, z):
+        """Densest cell at zoom z over all layers, used to scale colours consistently."""
+        if z <= PRECOMPUTED_MAX_ZOOM:
+            return self.zoom_max[z]
+        return self.zoom_max[PRECOMPUTED_MAX_ZOOM] / 4 ** (z - PRECOMPUTED_MAX_ZOOM)
+
+    def _precomputed_counts(self, z, x, y, layer_mask):
+        counts = np.zeros(GRID * GRID, dtype=np.float64)
+        cells = GRID * 2 ** z
+        rows = np.arange(y * GRID, (y + 1) * GRID, dtype=np.int64)
+        starts = (rows * cells + x * GRID) * self.n_layers
+        keys = self.zoom_keys[z]
+        lo = np.searchsorted(keys, starts)
+        hi = np.searchsorted(keys, starts + GRID * self.n_layers)
+        if not np.any(hi > lo):
+            return counts.reshape(GRID, GRID)
+        idx = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi) if b > a])
+        cell, layer = np.divmod(keys[idx], self.n_layers)
+        keep = layer_mask[layer]
+        cy, cx = np.divmod(cell[keep], cells)
+        np.add.at(counts, (cy - y * GRID) * GRID + (cx - x * GRID), self.zoom_counts[z][idx][keep])
+        return counts.reshape(GRID, GRID)
+
+
+class HeatmapGrid(_ZoomCounts):
+    """
+    Per-zoom crime counts over GRID x GRID cells per tile, split into severity/time layers.
+
+    Zooms up to PRECOMPUTED_MAX_ZOOM are stored as sorted sparse (cell, layer) keys.
+    Deeper zooms are counted on request from the points of their parent tile, which
+    are kept contiguous by sorting them on that tile.
+    """
+
+    def __init__(self, lat, lon, severities, time_codes, max_severity):
+        super().__init__(max_severity)
+        self.mx, self.my = mercator(lat, lon)
+        self.layers = _layer_codes(severities, time_codes, self.max_severity)
+
+        for z in range(PRECOMPUTED_MAX_ZOOM + 1):
+            keys, counts = _zoom_keys(self.mx, self.my, self.layers, self.n_layers, z)
+            self.zoom_keys.append(keys)
+            self.zoom_counts.append(counts.astype(np.int32))
+            self.zoom_max.append(_densest_cell(keys, counts, self.n_layers))
+
+        parents = 2 ** PRECOMPUTED_MAX_ZOOM
+        parent_keys = (self.my * parents).astype(np.int64) * parents + (self.mx * parents).astype(np.int64)
+        order = np.argsort(parent_keys, kind='stable')
+        self.parent_keys = parent_keys[order]
+        self.mx, self.my, self.layers = self.mx[order], self.my[order], self.layers[order]
+
+    @property
+    def nbytes(self):
+        arrays = self.zoom_keys + self.zoom_counts + [self.parent_keys, self.mx, self.my, self.layers]
+        return sum(a.nbytes for a in arrays)
+
+    def tile_counts(self, z, x, y, layer_mask):
+        """GRID x GRID array of counts for one tile, rows running north to south."""
+        if z <= PRECOMPUTED_MAX_ZOOM:
+            return self._precomputed_counts(z, x, y, layer_mask)
+
+        counts = np.zeros(GRID * GRID, dtype=np.float64)
+        shift = z - PRECOMPUTED_MAX_ZOOM
+        parents = 2 ** PRECOMPUTED_MAX_ZOOM
+        parent_key = (y >> shift) * parents + (x >> shift)
+        lo, hi = np.searchsorted(self.parent_keys, [parent_key, parent_key + 1])
+        cells = GRID * 2 ** z
+        cx = (self.mx[lo:hi] * cells).astype(np.int64) - x * GRID
+        cy = (self.my[lo:hi] * cells).astype(np.int64) - y * GRID
+        keep = (cx >= 0) & (cx < GRID) & (cy >= 0) & (cy < GRID) & layer_mask[self.layers[lo:hi]]
+        np.add.at(counts, cy[keep] * GRID + cx[keep], 1)
+        return counts.reshape(GRID, GRID)
+
+
+class HeatmapOverview(_ZoomCounts):
+    """
+    Per-zoom counts of a whole sharded dataset, up to PRECOMPUTED_MAX_ZOOM.
+
+    Shards are added one at a time and their counts merged per (cell, layer), so cells
+    on shard borders hold their full count and the result does not depend on how the
+    data was split. Only the sparse keys are kept, not the points, so it stays small
+    enough to hold for the whole dataset while shards come and go.
+    """
+
+    def __init__(self, max_severity):
+        super().__init__(max_severity)
+        self.zoom_keys = [np.array([], dtype=np.int64) for _ in range(PRECOMPUTED_MAX_ZOOM + 1)]
+        self.zoom_counts = [np.array([], dtype=np.int64) for _ in range(PRECOMPUTED_MAX_ZOOM + 1)]
+
+    def add(self, lat, lon, severities, time_codes):
+        mx, my = mercator(lat, lon)
+        layers = _layer_codes(severities, time_codes, self.max_severity)
+        for z in range(PRECOMPUTED_MAX_ZOOM + 1):
+            keys, counts = _zoom_keys(mx, my, layers, self.n_layers, z)
+            keys, inverse = np.unique(np.r_[self.zoom_keys[z], keys], return_inverse=True)
+            self.zoom_keys[z] = keys
+            self.zoom_counts[z] = np.bincount(inverse, weights=np.r_[self.zoom_counts[z], counts],
+                                              minlength=len(keys)).astype(np.int64)
+
+    def finish(self):
+        """Compute the colour scale once every shard has been added. Returns self."""
+        self.zoom_max = [_densest_cell(keys, counts, self.n_layers)
+                         for keys, counts in zip(self.zoom_keys, self.zoom_counts)]
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.zoom_keys + self.zoom_counts)
+
+    def tile_counts(self, z, x, y, layer_mask):
+        """GRID x GRID array of counts for one tile up to PRECOMPUTED_MAX_ZOOM."""
+        return self._precomputed_counts(z, x, y, layer_mask)
+
+
+def render_png(counts, max_count):
+    """Transparent-to-red heat colouring on a log scale, upscaled to a 256 px PNG."""
+    from PIL import Image
+
+    intensity = np.log1p(counts) / np.log1p(max(max_count, 1.0))
+    intensity = np.clip(intensity, 0, 1)
+    rgba = np.zeros(counts.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = 255
+    rgba[..., 1] = (220 * (1 - intensity)).astype(np.uint8)
+    rgba[..., 3] = np.where(counts > 0, 80 + 175 * intensity, 0).astype(np.uint8)
+    image = Image.fromarray(rgba, 'RGBA').resize((TILE_PIXELS, TILE_PIXELS), Image.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class HeatmapTileService:
+    """
+    Heatmap PNG or aggregated-count tiles rendered from the shards of a crime index.
+
+    Rendered tiles are kept in an LRU cache; a new service is created whenever the
+    crime data is reloaded, which drops the cache with it.
+    """
+
+    def __init__(self, crime_index, cache_size=2048):
+        self.crime_index = crime_index
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _grids(self, z, x, y):
+        """
+        Grids to sum for a tile. Up to PRECOMPUTED_MAX_ZOOM the index's overview covers the
+        tile on its own, so wide tiles never load the shards beneath them; deeper tiles are
+        no wider than a few shards and are counted from those shards' points.
+        """
+        if z <= PRECOMPUTED_MAX_ZOOM:
+            return [self.crime_index.heatmap_overview()]
+        min_lat, min_lon, max_lat, max_lon = tile_bounds(z, x, y)
+        shards = self.crime_index.shards_for([(min_lat, min_lon), (max_lat, max_lon)], 0)
+        return [shard.heatmap for shard in shards if len(shard.crime_points)]
+
+    def tile(self, z, x, y, fmt='png', min_severity=1, time_category=None):
+        """
+        Render one tile.
+
+        Parameters:
+        z, x, y (int): slippy-map tile address
+        fmt (str): 'png' for a heatmap image, 'json' for non-empty cell counts
+        min_severity (int): only count crimes at least this severe
+        time_category (str, optional): only count crimes in this time of day
+
+        Returns:
+        bytes for 'png', dict for 'json'
+
+        Raises:
+        ValueError: if the tile address or filters are invalid
+        """
+        if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError(f"Invalid tile {z}/{x}/{y}")
+        if time_category is not None and time_category not in TIME_CATEGORIES:
+            raise ValueError(f"time_category must be one of {TIME_CATEGORIES}")
+        if fmt not in ('png', 'json'):
+            raise ValueError("Tile format must be 'png' or 'json'")
+
+        key = (z, x, y, fmt, min_severity, time_category)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        counts = np.zeros((GRID, GRID))
+        for grid in self._grids(z, x, y):
+            counts += grid.tile_counts(z, x, y, grid.layer_mask(min_severity, time_category))
+        # Scaled by the whole dataset's densest cell, summed across shards, so colours do not depend on the split
+        max_count = self.crime_index.heatmap_overview().max_count(z)
+
+        if fmt == 'png':
+            result = render_png(counts, max_count)
+        else:
+            rows, cols = np.nonzero(counts)
+            result = {
+                'z': z, 'x': x, 'y': y, 'grid': GRID,
+                'cells': [[int(c), int(r), int(n)] for r, c, n in zip(rows, cols, counts[rows, cols])]
+            }
+
+        with self.lock:
+            self.cache[key] = result
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return result
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+DEFAULT_TILE_SIZE = 0.05  # degrees (~5.5 km) per tile side
+PARALLEL_MIN_POINTS = 50000  # below this the pool start-up costs more than it saves
+
+
+def cluster_stats(points, severities, labels):
+    """
+    Centroids and mean severities of every cluster in one grouped reduction.
+
+    Parameters:
+    points (ndarray): (N, 2) coordinates
+    severities (ndarray): (N,) severity per point
+    labels (ndarray): (N,) cluster label per point, -1 for noise
+
+    Returns:
+    tuple: (centroids (K, 2), mean severities (K,)), empty arrays if no clusters
+    """
+    mask = labels >= 0
+    if not np.any(mask):
+        return np.array([]), np.array([])
+    lbl = labels[mask]
+    pts = points[mask]
+    n_clusters = int(lbl.max()) + 1
+    counts = np.bincount(lbl, minlength=n_clusters).astype(float)
+    keep = counts > 0
+    lat = np.bincount(lbl, weights=pts[:, 0], minlength=n_clusters)[keep]
+    lon = np.bincount(lbl, weights=pts[:, 1], minlength=n_clusters)[keep]
+    sev = np.bincount(lbl, weights=np.asarray(severities, dtype=float)[mask], minlength=n_clusters)[keep]
+    counts = counts[keep]
+    return np.column_stack([lat / counts, lon / counts]), sev / counts
+
+
+def _tile_tasks(points, eps, min_samples, tile_size):
+    """
+    Hash every point into the grid tiles whose box, grown by a 2*eps halo, contains it.
+
+    A point within tile+eps has all its eps-neighbours within tile+2*eps, so a tile can
+    decide core status for those points and emit every core-core edge touching a point it
+    owns without talking to its neighbours.
+    """
+    origin = points.min(axis=0)
+    halo = 2 * eps
+    own_key = np.floor((points - origin) / tile_size).astype(np.int64)
+    lo = np.floor((points - halo - origin) / tile_size).astype(np.int64)
+    hi = np.floor((points + halo - origin) / tile_size).astype(np.int64)
+    n_cols = int(hi[:, 1].max()) + 2
+
+    # halo < tile_size, so each point falls into at most 2 x 2 expanded tiles
+    members, keys = [], []
+    for row in (lo[:, 0], hi[:, 0]):
+        for col in (lo[:, 1], hi[:, 1]):
+            members.append(np.arange(len(points)))
+            keys.append((row + 1) * n_cols + (col + 1))
+    n = len(points)
+    packed = np.unique(np.concatenate(keys) * n + np.concatenate(members))
+    keys, members = np.divmod(packed, n)
+    own_flat = (own_key[:, 0] + 1) * n_cols + (own_key[:, 1] + 1)
+
+    splits = np.flatnonzero(np.diff(keys)) + 1
+    for tile_key, idx in zip(keys[np.r_[0, splits]], np.split(members, splits)):
+        owned = own_flat[idx] == tile_key
+        if not np.any(owned):
+            continue
+        row, col = divmod(int(tile_key), n_cols)
+        box_min = origin + np.array([row - 1, col - 1]) * tile_size
+        box_max = box_min + tile_size
+        tile_points = points[idx]
+        inner = np.all((tile_points >= box_min - eps) & (tile_points < box_max + eps), axis=1)
+        yield tile_points, idx, inner, owned, eps, min_samples
+
+
+def _tile_worker(task):
+    tile_points, global_idx, inner, owned, eps, min_samples = task
+    pairs = cKDTree(tile_points).query_pairs(eps, output_type='ndarray')
+    counts = np.bincount(pairs.ravel(), minlength=len(tile_points)) + 1  # a point is its own neighbour
+    core = (counts >= min_samples) & inner
+    a, b = pairs[:, 0], pairs[:, 1]
+
+    edges = pairs[core[a] & core[b] & (owned[a] | owned[b])]
+
+    # Owned border points join the cluster of their nearest core neighbour
+    border = owned & ~core
+    src = np.concatenate([a[border[a] & core[b]], b[border[b] & core[a]]])
+    dst = np.concatenate([b[border[a] & core[b]], a[border[b] & core[a]]])
+    if len(src):
+        dist = np.linalg.norm(tile_points[src] - tile_points[dst], axis=1)
+        order = np.lexsort((dist, src))
+        src, dst = src[order], dst[order]
+        _, first = np.unique(src, return_index=True)
+        src, dst = src[first], dst[first]
+
+    return global_idx[core & owned], global_idx[edges], global_idx[src], global_idx[dst]
+
+
+def _map_tiles(tasks, workers):
+    if workers == 1 or len(tasks) == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [_tile_worker(task) for task in tasks]
+    # fork keeps the service module from being re-imported (and reloaded) in every worker
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as pool:
+        return list(pool.map(_tile_worker, tasks))
+
+
+def grid_dbscan(points, eps, min_samples, tile_size=DEFAULT_TILE_SIZE, workers=None):
+    """
+    DBSCAN over overlapping grid tiles processed in parallel, merged across tile borders.
+
+    Core points and the clusters they form match sklearn's DBSCAN exactly; a border point
+    reachable from several clusters is given to its nearest core point, where sklearn
+    picks whichever cluster reached it first.
+
+    Parameters:
+    points (ndarray): (N, 2) coordinates
+    eps (float): neighbourhood radius, in the same units as points
+    min_samples (int): neighbours (including the point itself) needed for a core point
+    tile_size (float): tile side, must be larger than 2 * eps
+    workers (int, optional): process count; 1 forces in-process. Defaults to the CPU count.
+
+    Returns:
+    ndarray: (N,) cluster label per point, -1 for noise
+    """
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    labels = np.full(n, -1, dtype=np.int64)
+    if n == 0:
+        return labels
+    if tile_size <= 2 * eps:
+        raise ValueError("tile_size must be larger than 2 * eps")
+    if n < PARALLEL_MIN_POINTS:
+        workers = 1
+
+    results = _map_tiles(list(_tile_tasks(points, eps, min_samples, tile_size)), workers)
+    core_idx, edges, border_idx, border_core = (np.concatenate(parts) for parts in zip(*results))
+    if len(core_idx) == 0:
+        return labels
+    edges = edges.reshape(-1, 2)
+
+    graph = coo_matrix((np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    _, components = connected_components(graph, directed=False)
+    core_idx = np.sort(core_idx)
+    _, labels[core_idx] = np.unique(components[core_idx], return_inverse=True)
+    labels[border_idx] = labels[border_core]
+    return labels
@@ -0,0 +1,263 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from corridor import polyline_nearest
+from crime_index import HOTSPOT_HORIZON
+from crime_table import category_codes
+from route_similarity import route_fingerprint
+
+EARTH_RADIUS_KM = 6371.0088
+OFF_ROUTE_DISTANCE = 0.0005  # degrees (~55 m) from the route before a GPS fix counts as off-route
+MATCH_WINDOW = 50  # segments searched ahead of the last matched one
+MATCH_BACKTRACK = 3  # segments searched behind it, for GPS jitter
+UPCOMING_HOTSPOT_KM = 1.0
+MAX_UPCOMING_HOTSPOTS = 5
+
+
+def haversine_km(a, b):
+    a, b = np.radians(np.asarray(a, dtype=float)), np.radians(np.asarray(b, dtype=float))
+    dlat, dlon = b[..., 0] - a[..., 0], b[..., 1] - a[..., 1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(a[..., 0]) * np.cos(b[..., 0]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(h))
+
+
+def _suffix(values, ufunc, empty):
+    """ufunc accumulated from each position to the end, plus a trailing `empty` for past-the-end."""
+    if len(values) == 0:
+        return np.array([empty])
+    return np.append(ufunc.accumulate(values[::-1])[::-1], empty)
+
+
+class RouteProfile:
+    """
+    Corridor aggregates of one route, ordered by distance along it.
+
+    Crimes, hotspots and hotspot-distance probes are projected onto the route once.
+    Prefix sums and suffix max/min/distinct arrays over that order then give the
+    aggregates of the rest of the route from any position with a binary search.
+    """
+
+    def __init__(self, coords, crime_index, crime_radius, hotspot_radius, high_severity):
+        self.coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        if len(self.coords) < 2:
+            raise ValueError("A route needs at least two points")
+        self.segment_km = haversine_km(self.coords[:-1], self.coords[1:])
+        self.cum_km = np.r_[0, np.cumsum(self.segment_km)]
+
+        crimes = crime_index.query_route(self.coords, crime_radius)
+        along = self.along(np.column_stack([crimes['Latitude'], crimes['Longitude']]))
+        order = np.argsort(along, kind='stable')
+        severity = crimes['Severity'][order].astype(np.int64)
+        self.crime_along = along[order]
+        self.severity_prefix = np.r_[0, np.cumsum(severity)]
+        self.high_severity_prefix = np.r_[0, np.cumsum(severity >= high_severity)]
+        self.severity_suffix_max = _suffix(severity, np.maximum, 0)
+        codes = category_codes(crimes['CrimeCategory'][order])
+        self.category_suffix_distinct = np.zeros(len(codes) + 1, dtype=np.int64)
+        seen = set()
+        for i in range(len(codes) - 1, -1, -1):
+            if codes[i] >= 0:
+                seen.add(codes[i])
+            self.category_suffix_distinct[i] = len(seen)
+
+        centroids, hotspot_severities, probes, probe_distances = crime_index.route_hotspots(self.coords, hotspot_radius)
+        along = self.along(centroids)
+        order = np.argsort(along, kind='stable')
+        self.hotspots, self.hotspot_severities, self.hotspot_along = centroids[order], hotspot_severities[order], along[order]
+        self.high_severity_hotspot_prefix = np.r_[0, np.cumsum(self.hotspot_severities >= high_severity)]
+        along = self.along(probes)
+        order = np.argsort(along, kind='stable')
+        self.probe_along = along[order]
+        self.probe_distance_suffix_min = _suffix(probe_distances[order], np.minimum, HOTSPOT_HORIZON)
+
+    @property
+    def length_km(self):
+        return float(self.cum_km[-1])
+
+    def along(self, points):
+        """Distance in km from the start of the route to the projection of each point."""
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if len(points) == 0:
+            return np.array([])
+        _, segments, positions = polyline_nearest(points, self.coords)
+        return self.cum_km[segments] + positions * self.segment_km[segments]
+
+    def match(self, point, hint_segment=0):
+        """
+        Project a GPS fix onto the route near the last matched segment, falling back to the
+        whole route when it is not found there (e.g. after a GPS gap).
+
+        Returns:
+        tuple: (distance from the route in degrees, segment index, km along the route)
+        """
+        n_segments = len(self.segment_km)
+        lo = max(hint_segment - MATCH_BACKTRACK, 0)
+        hi = min(hint_segment + MATCH_WINDOW, n_segments)
+        distance, segment, position = (v[0] for v in polyline_nearest([point], self.coords[lo:hi + 1]))
+        segment += lo
+        if distance > OFF_ROUTE_DISTANCE and (lo > 0 or hi < n_segments):
+            distance, segment, position = (v[0] for v in polyline_nearest([point], self.coords))
+        return float(distance), int(segment), float(self.cum_km[segment] + position * self.segment_km[segment])
+
+    def remaining(self, along_km):
+        """Corridor aggregates of the route beyond along_km, shaped like extract_features' own."""
+        i = np.searchsorted(self.crime_along, along_km)
+        j = np.searchsorted(self.hotspot_along, along_km)
+        k = np.searchsorted(self.probe_along, along_km)
+        return {
+            'total_crimes': len(self.crime_along) - i,
+            'total_severity': int(self.severity_prefix[-1] - self.severity_prefix[i]),
+            'max_severity': int(self.severity_suffix_max[i]),
+            'high_severity_crimes': int(self.high_severity_prefix[-1] - self.high_severity_prefix[i]),
+            'crime_types': int(self.category_suffix_distinct[i]),
+            'distance': max(self.length_km - along_km, 0.0),
+            'num_hotspots': len(self.hotspot_along) - j,
+            'high_severity_hotspots': int(self.high_severity_hotspot_prefix[-1] - self.high_severity_hotspot_prefix[j]),
+            'min_distance_to_hotspot': float(self.probe_distance_suffix_min[k])
+        }
+
+    def upcoming_hotspots(self, along_km, within_km=UPCOMING_HOTSPOT_KM, limit=MAX_UPCOMING_HOTSPOTS):
+        lo = np.searchsorted(self.hotspot_along, along_km)
+        hi = min(np.searchsorted(self.hotspot_along, along_km + within_km, side='right'), lo + limit)
+        return [
+            {'location': (float(lat), float(lon)), 'severity': round(float(severity), 2),
+             'distance_ahead_km': round(float(ahead - along_km), 3)}
+            for (lat, lon), severity, ahead in zip(self.hotspots[lo:hi], self.hotspot_severities[lo:hi],
+                                                   self.hotspot_along[lo:hi])
+        ]
+
+
+class LiveNavigator:
+    """
+    Navigation sessions that re-score the rest of a scored route from GPS updates.
+
+    Routes are remembered by id when /evaluate_routes scores them. A session builds the
+    route's RouteProfile once, reusing it across sessions on the same route and dataset
+    version, so each update costs a local map match and a few binary searches.
+    """
+
+    def __init__(self, model, crime_radius, hotspot_radius, max_routes=4096, max_profiles=256,
+                 max_sessions=10000, session_ttl=3600):
+        self.model = model
+        self.crime_radius = crime_radius
+        self.hotspot_radius = hotspot_radius
+        self.max_routes = max_routes
+        self.max_profiles = max_profiles
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.routes = OrderedDict()  # route_id -> (coords, max_crimes_per_route)
+        self.profiles = OrderedDict()  # (route_id, dataset_version) -> RouteProfile
+        self.sessions = OrderedDict()  # session_id -> session state
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _put(store, key, value, limit):
+        store[key] = value
+        store.move_to_end(key)
+        while len(store) > limit:
+            store.popitem(last=False)
+
+    def remember_route(self, coords, max_crimes_per_route):
+        """Keep a scored route for later sessions and return its id."""
+        route_id = route_fingerprint(coords).hex()
+        # Kept as an array: the store is sized for every route a cached ranking can hand out
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        with self.lock:
+            self._put(self.routes, route_id, (coords, max_crimes_per_route), self.max_routes)
+        return route_id
+
+    def _profile(self, route_id):
+        key = (route_id, self.model.dataset_version)
+        with self.lock:
+            profile = self.profiles.get(key)
+            if profile is not None:
+                self.profiles.move_to_end(key)
+                return profile
+            if route_id not in self.routes:
+                raise KeyError(f"Unknown route_id {route_id}; evaluate the route again")
+            coords, _ = self.routes[route_id]
+        profile = RouteProfile(coords, self.model.crime_index, self.crime_radius, self.hotspot_radius,
+                               self.model.max_severity * 0.6)
+        with self.lock:
+            self._put(self.profiles, key, profile, self.max_profiles)
+        return profile
+
+    def start(self, time_category, route_id=None, route_coords=None):
+        """
+        Open a session on a scored route, given by route_id or, failing that, its coordinates.
+
+        Returns:
+        dict: the session id and the whole route's risk summary
+        """
+        if route_id is None:
+            if not route_coords:
+                raise ValueError("route_id or route_coords required")
+            route_id = self.remember_route([tuple(p) for p in route_coords], self.model.max_crimes_per_route)
+        if not self.model.model:
+            self.model.load_model()
+        profile = self._profile(route_id)
+
+        session_id = uuid.uuid4().hex
+        session = {'route_id': route_id, 'time_category': time_category, 'segment': 0, 'progress_km': 0.0,
+                   'expires_at': time.monotonic() + self.session_ttl, 'lock': threading.Lock()}
+        now = time.monotonic()
+        with self.lock:
+            for stale in [sid for sid, s in self.sessions.items() if s['expires_at'] <= now][:100]:
+                del self.sessions[stale]
+            self._put(self.sessions, session_id, session, self.max_sessions)
+        return self._report(session_id, session, profile, 0.0)
+
+    def update(self, session_id, location):
+        """
+        Advance a session to a GPS fix and re-score the remaining route.
+
+        Raises:
+        KeyError: if the session is unknown or expired
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None or session['expires_at'] <= time.monotonic():
+                self.sessions.pop(session_id, None)
+                raise KeyError(f"Unknown or expired session {session_id}")
+            session['expires_at'] = time.monotonic() + self.session_ttl
+            self.sessions.move_to_end(session_id)
+
+        # Updates to one session are applied one at a time; other sessions are not held up
+        with session['lock']:
+            profile = self._profile(session['route_id'])
+            distance, segment, along_km = profile.match((float(location[0]), float(location[1])), session['segment'])
+            if distance > OFF_ROUTE_DISTANCE:
+                return {'session_id': session_id, 'route_id': session['route_id'], 'on_route': False,
+                        'distance_from_route_m': round(distance * 111000),
+                        'progress_km': round(session['progress_km'], 3)}
+            session['segment'], session['progress_km'] = segment, along_km
+            return self._report(session_id, session, profile, distance)
+
+    def end(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def _report(self, session_id, session, profile, distance):
+        _, max_crimes_per_route = self.routes.get(session['route_id'], (None, self.model.max_crimes_per_route))
+        aggregates = profile.remaining(session['progress_km'])
+        features, raw_safety_score = self.model.features_from_aggregates(
+            aggregates, session['time_category'], max_crimes_per_route)
+        return {
+            'session_id': session_id,
+            'route_id': session['route_id'],
+            'on_route': True,
+            'distance_from_route_m': round(distance * 111000),
+            'progress_km': round(session['progress_km'], 3),
+            'remaining_distance_km': round(aggregates['distance'], 3),
+            'remaining_crimes': aggregates['total_crimes'],
+            'remaining_high_severity_crimes': aggregates['high_severity_crimes'],
+            'remaining_hotspots': aggregates['num_hotspots'],
+            'remaining_safety_score': self.model.predict_safety(features, raw_safety_score),
+            'upcoming_hotspots': profile.upcoming_hotspots(session['progress_km']),
+            'arrived': aggregates['distance'] < 0.02,
+            'time_category': session['time_category']
+        }
@@ -0,0 +1,494 @@
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import psutil
+import requests
+
+from osrm_client import route_query
+
+# Metro stations and landmarks used as origins and destinations (lat, lon)
+DELHI_PLACES = {
+    'Rajiv Chowk': (28.6328, 77.2197),
+    'Kashmere Gate': (28.6675, 77.2282),
+    'New Delhi Railway Station': (28.6431, 77.2223),
+    'Chandni Chowk': (28.6580, 77.2300),
+    'India Gate': (28.6129, 77.2295),
+    'AIIMS': (28.5672, 77.2100),
+    'Hauz Khas': (28.5433, 77.2066),
+    'Saket': (28.5206, 77.2013),
+    'Nehru Place': (28.5494, 77.2519),
+    'Lajpat Nagar': (28.5700, 77.2373),
+    'Okhla': (28.5355, 77.2720),
+    'Karol Bagh': (28.6440, 77.1880),
+    'Rajouri Garden': (28.6492, 77.1226),
+    'Janakpuri West': (28.6296, 77.0779),
+    'Dwarka Sector 21': (28.5523, 77.0584),
+    'IGI Airport T3': (28.5562, 77.1000),
+    'Vasant Kunj': (28.5293, 77.1530),
+    'Mayur Vihar': (28.6042, 77.2950),
+    'Laxmi Nagar': (28.6304, 77.2777),
+    'Anand Vihar': (28.6469, 77.3160),
+    'Shahdara': (28.6735, 77.2899),
+    'Rohini West': (28.7149, 77.1150),
+    'Pitampura': (28.7033, 77.1322),
+    'Model Town': (28.7025, 77.1940),
+}
+TIME_CATEGORIES = ['Morning', 'Afternoon', 'Evening', 'Night']
+MAX_TRIP_KM = 15  # longer straight-line trips are rare for the app's users
+SYNTHETIC_STEP = 0.0005  # degrees (~55 m) between vertices of synthesized routes
+SERVICE_URL = "http://127.0.0.1:8000"
+
+
+def _km(a, b):
+    lat = math.radians((a[0] + b[0]) / 2)
+    return 111.2 * math.hypot(a[0] - b[0], (a[1] - b[1]) * math.cos(lat))
+
+
+def od_corpus(max_km=MAX_TRIP_KM):
+    """Every ordered pair of DELHI_PLACES closer than max_km, with a time category each."""
+    pairs = [(a, b) for a, b in itertools.permutations(DELHI_PLACES, 2)
+             if _km(DELHI_PLACES[a], DELHI_PLACES[b]) <= max_km]
+    return [{'source': list(DELHI_PLACES[a]), 'destination': list(DELHI_PLACES[b]),
+             'time_category': TIME_CATEGORIES[i % len(TIME_CATEGORIES)], 'name': f"{a} -> {b}"}
+            for i, (a, b) in enumerate(pairs)]
+
+
+def load_od_pairs(path=None):
+    if path is None:
+        return od_corpus()
+    with open(path) as f:
+        return json.load(f)
+
+
+def encode_polyline(coords, precision=5):
+    """Google encoded polyline of (lat, lon) pairs, as OSRM returns for geometries=polyline(6)."""
+    scaled = np.round(np.asarray(coords, dtype=float) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    chunks = []
+    for value in deltas.tolist():
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+
+def _lattice_wiggle(cells):
+    """Small fixed offset of each street lattice point, so synthesized streets are not ruler-straight."""
+    h = (cells[:, 0] * 73856093) ^ (cells[:, 1] * 19349663)
+    return (np.column_stack([h % 997 / 997, h // 997 % 991 / 991]) - 0.5) * 0.00004
+
+
+def synthetic_route(points, variant=0):
+    """
+    Plausible street-like path through (lat, lon) points: a dogleg per leg along a fixed
+    street lattice, densified like an OSRM overview=full geometry. Vertices other than the
+    requested points are lattice points, so routes sharing a street share its vertices.
+    """
+    seed = int.from_bytes(hashlib.blake2b(repr((points, variant)).encode(), digest_size=4).digest(), 'big')
+    rng = np.random.default_rng(seed)
+    points = [np.asarray(p, dtype=float) for p in points]
+    path, requested = [points[0]], [True]
+    for start, end in zip(points[:-1], points[1:]):
+        bend_at = 0.2 + 0.6 * rng.random()
+        bend = start + (end - start) * ([bend_at, 0] if variant % 2 == 0 else [0, bend_at])
+        for a, b in ((start, bend), (bend, end)):
+            steps = max(int(np.ceil(np.abs(b - a).max() / SYNTHETIC_STEP)), 1)
+            t = np.arange(1, steps + 1)[:, None] / steps
+            path.extend(a + t * (b - a))
+            requested.extend([False] * steps)
+        path[-1], requested[-1] = end, True
+    path, requested = np.vstack(path), np.array(requested)
+    cells = np.round(path / SYNTHETIC_STEP).astype(np.int64)
+    path[~requested] = cells[~requested] * SYNTHETIC_STEP + _lattice_wiggle(cells[~requested])
+    repeated = np.r_[False, np.all(cells[1:] == cells[:-1], axis=1) & ~requested[1:] & ~requested[:-1]]
+    return path[~repeated]
+
+
+def synthetic_nodes(path, points):
+    """Stand-in OSM node ids: one per street lattice point and one per requested coordinate."""
+    path = np.asarray(path)
+    cells = np.round(path / SYNTHETIC_STEP).astype(np.int64)
+    ids = cells[:, 0] * 10 ** 7 + cells[:, 1]
+    requested = np.any(np.all(path[:, None, :] == np.asarray(points, dtype=float)[None], axis=2), axis=1)
+    exact = np.round(path[requested] * 1e6).astype(np.int64)
+    ids[requested] = (1 << 62) + exact[:, 0] * 10 ** 9 + exact[:, 1]
+    return ids.tolist()
+
+
+def synthetic_response(points, alternatives, geometries, annotations=False):
+    """OSRM-shaped route response with one route, or three with alternatives."""
+    routes = []
+    for variant in range(3 if alternatives else 1):
+        path = synthetic_route(points, variant)
+        distance = sum(_km(a, b) for a, b in zip(path[:-1], path[1:])) * 1000
+        if geometries == 'geojson':
+            geometry = {'type': 'LineString', 'coordinates': path[:, ::-1].round(6).tolist()}
+        else:
+            geometry = encode_polyline(path, 6 if geometries == 'polyline6' else 5)
+        leg = {'distance': round(distance, 1), 'duration': round(distance / 7, 1)}
+        if annotations:
+            leg['annotation'] = {'nodes': synthetic_nodes(path, points)}
+        routes.append({'geometry': geometry, 'distance': round(distance, 1),
+                       'duration': round(distance / 7, 1), 'weight': round(distance / 7, 1), 'legs': [leg]})
+    return {'code': 'Ok', 'routes': routes,
+            'waypoints': [{'location': [p[1], p[0]]} for p in points]}
+
+
+def _recording_key(coordinates, params):
+    return (coordinates, params.get('alternatives', ['false'])[0] != 'false',
+            params.get('geometries', ['polyline'])[0], 'nodes' in params.get('annotations', [''])[0].split(','))
+
+
+class _OSRMHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # Not urlparse: it treats what follows the first ';' as path parameters, cutting the coordinate list short
+        url = urlsplit(self.path)
+        prefix = '/route/v1/driving/'
+        if not url.path.startswith(prefix):
+            self.send_error(404)
+            return
+        self.server.owner.requests += 1
+        delay, fail = self.server.owner.next_outcome()
+        time.sleep(delay)
+        if fail:
+            self.server.owner.errors += 1
+            self.send_error(503, "Injected failure")
+            return
+
+        coordinates = url.path[len(prefix):]
+        params = parse_qs(url.query)
+        key = _recording_key(coordinates, params)
+        body = self.server.owner.recordings.get(key)
+        if body is None:
+            try:
+                points = [tuple(map(float, pair.split(',')))[::-1] for pair in coordinates.split(';')]
+            except ValueError:
+                self.send_error(400, "Invalid coordinates")
+                return
+            body = json.dumps(synthetic_response(points, *key[1:])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOSRMServer:
+    """
+    Local stand-in for OSRM's route/v1/driving service.
+
+    Recorded responses are replayed for the exact coordinates and options they were
+    captured with; any other request gets a synthesized, deterministic route. Latency
+    and failures (HTTP 503) are injected at the configured rates.
+
+    Parameters:
+    port (int): 0 picks a free port
+    recordings (str, optional): JSONL file written by `loadtest.py record`
+    latency_ms (float): mean injected latency per request
+    jitter_ms (float): standard deviation of the injected latency
+    error_rate (float): fraction of requests answered with 503
+    seed (int): makes injected latency and failures reproducible
+    """
+
+    def __init__(self, port=0, recordings=None, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.recordings = {}
+        self.requests = self.errors = 0
+        if recordings:
+            with open(recordings) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    key = _recording_key(entry['coordinates'], parse_qs(entry['query']))
+                    self.recordings[key] = json.dumps(entry['response']).encode()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _OSRMHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.owner = self
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/route/v1/driving/"
+
+    def next_outcome(self):
+        with self.rng_lock:
+            delay = max(self.rng.gauss(self.latency_ms, self.jitter_ms), 0) / 1000 if self.latency_ms else 0
+            return delay, self.rng.random() < self.error_rate
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logging.info(f"Fake OSRM listening on {self.base_url} ({len(self.recordings)} recorded responses)")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def record(upstream, od_pairs, output_file, annotations=True):
+    """
+    Capture route responses for the corpus from an OSRM server we are allowed to load,
+    e.g. a self-hosted instance, for later replay by FakeOSRMServer.
+
+    The query is the services' own direct source-to-destination request, so replay
+    matches it; `annotations` must match the service's osrm_node_annotations.
+    """
+    query = route_query(3, annotations)
+    with open(output_file, 'w') as f:
+        for pair in od_pairs:
+            source, destination = pair['source'], pair['destination']
+            coordinates = f"{source[1]},{source[0]};{destination[1]},{destination[0]}"
+            response = requests.get(f"{upstream}{coordinates}?{query}", timeout=30)
+            response.raise_for_status()
+            f.write(json.dumps({'coordinates': coordinates, 'query': query, 'response': response.json()}) + '\n')
+    logging.info(f"Recorded {len(od_pairs)} responses to {output_file}")
+
+
+class ResourceMonitor:
+    """Samples CPU time and RSS of a process and its children in the background."""
+
+    def __init__(self, pid, interval=0.25):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak_rss = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self):
+        try:
+            return [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def cpu_seconds(self):
+        total = 0.0
+        for proc in self._processes():
+            try:
+                times = proc.cpu_times()
+                total += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def rss(self):
+        total = 0
+        for proc in self._processes():
+            try:
+                total += proc.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, self.rss())
+
+    def start(self):
+        self.peak_rss = self.rss()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def run_step(service_url, od_pairs, concurrency, duration, jitter=0.0, timeout=60, monitor=None, seed=0):
+    """
+    Drive /evaluate_routes from `concurrency` closed-loop clients for `duration` seconds.
+
+    Parameters:
+    jitter (float): uniform noise in degrees added to each origin and destination;
+        above the route cache's snapping cell it defeats result caching
+
+    Returns:
+    dict: throughput, latency percentiles (ms), error rate and server resource use
+    """
+    deadline = time.monotonic() + duration
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def client(worker):
+        rng = random.Random(seed * 1000 + worker)
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            pair = rng.choice(od_pairs)
+            payload = {
+                'source': [c + rng.uniform(-jitter, jitter) for c in pair['source']],
+                'destination': [c + rng.uniform(-jitter, jitter) for c in pair['destination']],
+                'time_category': pair['time_category']
+            }
+            start = time.perf_counter()
+            try:
+                ok = session.post(f"{service_url}/evaluate_routes", json=payload, timeout=timeout).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                (latencies if ok else failures).append(elapsed)
+
+    cpu_before = monitor.cpu_seconds() if monitor else 0.0
+    if monitor:
+        monitor.peak_rss = monitor.rss()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    wall = time.monotonic() - started
+
+    total = len(latencies) + len(failures)
+    result = {
+        'concurrency': concurrency,
+        'requests': total,
+        'rps': round(len(latencies) / wall, 2),
+        'error_rate': round(len(failures) / total, 4) if total else 0.0,
+    }
+    for q in (50, 90, 99):
+        result[f'p{q}_ms'] = round(float(np.percentile(latencies, q)), 1) if latencies else None
+    if monitor:
+        result['server_cpu_percent'] = round((monitor.cpu_seconds() - cpu_before) / wall * 100, 1)
+        result['server_peak_rss_mb'] = round(monitor.peak_rss / 2 ** 20, 1)
+    return result
+
+
+def max_sustainable_rps(steps, slo_p99_ms, max_error_rate):
+    """Highest throughput among steps meeting the p99 latency and error-rate objectives."""
+    passing = [step['rps'] for step in steps
+               if step['p99_ms'] is not None and step['p99_ms'] <= slo_p99_ms and step['error_rate'] <= max_error_rate]
+    return max(passing, default=0.0)
+
+
+def start_service(command, osrm_url, service_url, startup_timeout=900):
+    """Launch the service with OSRM_BASE_URL pointed at the stand-in and wait until its warm-up has finished."""
+    env = dict(os.environ, OSRM_BASE_URL=osrm_url)
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Service exited with code {process.returncode} during start-up")
+        try:
+            if requests.get(f"{service_url}/readyz", timeout=2).status_code == 200:
+                return process
+            health = requests.get(f"{service_url}/healthz", timeout=2)
+            if health.status_code != 200 and health.json().get('status') == 'failed':
+                process.terminate()
+                raise RuntimeError(f"Service warm-up failed: {health.json()['warmup']['error']}")
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    process.terminate()
+    raise RuntimeError(f"Service was not ready within {startup_timeout}s")
+
+
+def print_report(steps, sustainable_rps):
+    columns = ['concurrency', 'requests', 'rps', 'p50_ms', 'p90_ms', 'p99_ms', 'error_rate',
+               'server_cpu_percent', 'server_peak_rss_mb']
+    print(' '.join(f"{col:>18}" for col in columns))
+    for step in steps:
+        print(' '.join(f"{str(step.get(col, '-')):>18}" for col in columns))
+    print(f"\nMax sustainable RPS: {sustainable_rps}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load tests for /evaluate_routes against a fake OSRM")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    def add_osrm_options(sub):
+        sub.add_argument('--recordings', help="JSONL of recorded OSRM responses to replay")
+        sub.add_argument('--latency-ms', type=float, default=30.0, help="mean injected OSRM latency")
+        sub.add_argument('--jitter-ms', type=float, default=10.0)
+        sub.add_argument('--error-rate', type=float, default=0.0, help="fraction of OSRM calls failing with 503")
+        sub.add_argument('--seed', type=int, default=0)
+
+    osrm_parser = subparsers.add_parser('osrm', help="only run the fake OSRM server")
+    osrm_parser.add_argument('--port', type=int, default=5001)
+    add_osrm_options(osrm_parser)
+
+    run_parser = subparsers.add_parser('run', help="start the service and drive it at stepped concurrency")
+    add_osrm_options(run_parser)
+    run_parser.add_argument('--service', default='model.py', help="service script to start, relative to ML_model")
+    run_parser.add_argument('--service-url', default=SERVICE_URL)
+    run_parser.add_argument('--attach-pid', type=int, help="measure an already running service instead")
+    run_parser.add_argument('--od-file', help="JSON list of {source, destination, time_category}")
+    run_parser.add_argument('--concurrency', default='1,2,4,8,16')
+    run_parser.add_argument('--duration', type=float, default=30.0, help="seconds per concurrency step")
+    run_parser.add_argument('--od-jitter', type=float, default=0.0, help="degrees of noise on every OD point")
+    run_parser.add_argument('--slo-p99-ms', type=float, default=2000.0)
+    run_parser.add_argument('--max-error-rate', type=float, default=0.01)
+    run_parser.add_argument('--output', help="write the step results as JSON")
+
+    record_parser = subparsers.add_parser('record', help="capture responses from an OSRM server you may load")
+    record_parser.add_argument('upstream', help="e.g. http://localhost:5000/route/v1/driving/")
+    record_parser.add_argument('output')
+    record_parser.add_argument('--od-file')
+    record_parser.add_argument('--no-annotations', action='store_true',
+                               help="record without OSM node ids, for services with osrm_node_annotations off")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'record':
+        record(args.upstream, load_od_pairs(args.od_file), args.output, not args.no_annotations)
+        return
+
+    osrm = FakeOSRMServer(getattr(args, 'port', 0), args.recordings, args.latency_ms, args.jitter_ms,
+                          args.error_rate, args.seed).start()
+    if args.command == 'osrm':
+        try:
+            osrm.thread.join()
+        except KeyboardInterrupt:
+            osrm.stop()
+        return
+
+    process = None
+    try:
+        if args.attach_pid:
+            pid = args.attach_pid
+        else:
+            process = start_service([sys.executable, args.service], osrm.base_url, args.service_url)
+            pid = process.pid
+        monitor = ResourceMonitor(pid).start()
+        od_pairs = load_od_pairs(args.od_file)
+        steps = []
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            step = run_step(args.service_url, od_pairs, concurrency, args.duration, args.od_jitter,
+                            monitor=monitor, seed=args.seed)
+            logging.info(f"Concurrency {concurrency}: {step}")
+            steps.append(step)
+        monitor.stop()
+        sustainable_rps = max_sustainable_rps(steps, args.slo_p99_ms, args.max_error_rate)
+        print_report(steps, sustainable_rps)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'steps': steps, 'max_sustainable_rps': sustainable_rps,
+                           'osrm': {'requests': osrm.requests, 'injected_errors': osrm.errors}}, f, indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        osrm.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FILE = os.environ.get('LOG_FILE')  # e.g. route_logs.log; stderr only when unset
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # records beyond this are dropped, never waited on
+DETAIL_SAMPLE_RATE = float(os.environ.get('LOG_DETAIL_SAMPLE_RATE', 0.01))  # share of per-route detail records kept
+LOG_FILE_MAX_BYTES = 50 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+# Attributes every LogRecord has; anything else was passed through `extra` and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def _json_default(value):
+    # NumPy scalars and arrays become plain numbers and lists
+    return value.tolist() if hasattr(value, 'tolist') else str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=_json_default)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread as they are.
+
+    The stock QueueHandler formats every message on the calling thread; here formatting
+    happens on the listener, and a full queue drops the record instead of blocking.
+    """
+
+    def __init__(self, log_queue, max_size):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue puts take no lock in Python code; its size check is approximate but cheap
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+
+class SampledLogger:
+    """
+    Front for high-volume detail records (per route, per OSRM call) that keeps only a
+    random share of them. Skipped records cost one random draw: no record is built and
+    no message is formatted.
+    """
+
+    def __init__(self, name, sample_rate=DETAIL_SAMPLE_RATE):
+        self.logger = logging.getLogger(name)
+        self.sample_rate = sample_rate
+
+    def _emit(self, level, msg, args, fields):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, msg, *args, extra=fields)
+
+    def info(self, msg, *args, **fields):
+        if random.random() < self.sample_rate:
+            self._emit(logging.INFO, msg, args, fields)
+
+    def debug(self, msg, *args, **fields):
+        if random.random() < self.sample_rate:
+            self._emit(logging.DEBUG, msg, args, fields)
+
+
+detail_log = SampledLogger('saferoute.detail')
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, log_format=LOG_FORMAT, sample_rate=DETAIL_SAMPLE_RATE,
+                  queue_size=LOG_QUEUE_SIZE):
+    """
+    Route all logging through a queue to a background thread that formats and writes it.
+
+    Request threads only append records to a bounded queue, so their latency does not
+    depend on string formatting or disk I/O. Safe to call more than once; only the first
+    call configures anything.
+
+    Parameters:
+    level (str or int): root log level
+    log_file (str, optional): also write to this file, rotated at LOG_FILE_MAX_BYTES
+    log_format (str): 'json' for one JSON object per line, 'text' for the plain format
+    sample_rate (float): share of detail_log records kept, 0 to 1
+    queue_size (int): records buffered before new ones are dropped
+
+    Returns:
+    QueueListener: the running listener, stopped automatically at exit
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return _listener
+        if log_format == 'json':
+            formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handlers = [logging.StreamHandler()]
+        if log_file:
+            handlers.append(logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        log_queue = queue.SimpleQueue()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(NonBlockingQueueHandler(log_queue, queue_size))
+        root.setLevel(level)
+        detail_log.sample_rate = sample_rate
+
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+        return _listener
@@ -1,91 +1,142 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-import requests
-import pandas as pd
-from geopy.distance import geodesic
-from scipy.spatial import KDTree
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
-from sklearn.cluster import DBSCAN
-from sklearn.model_selection import train_test_split
 import pickle
 import os
 import uuid
 import logging
+from admission import DEGRADED, FULL, AdmissionController, Overloaded
+from osrm_client import join_routes, parse_route, route_query, run_plan
+from log_pipeline import detail_log, setup_logging
+from route_cache import SingleFlightCache, route_request_key
+from route_similarity import RouteSet
+from waypoints import MAX_DETOUR_RATIO, plan_waypoints
+from warmup import RETRY_AFTER, Warmup
+
+# sklearn, scipy, pandas and geopy take seconds to import, so the modules using them are
+# imported where first needed: by the warm-up thread, after the server is already up.
 
 # Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for frontend compatibility
 
-OSRM_BASE_URL = "http://router.project-osrm.org/route/v1/driving/"
+CRIME_RADIUS = 0.1 / 111  # degrees (~100 m) either side of a route counted as its crimes
+HOTSPOT_RADIUS = 0.001  # degrees (~110 m) to a hotspot centroid for it to be on the route
+OSRM_BASE_URL = os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org/route/v1/driving/")  # e.g. a local stand-in for load tests
+LOAD_STEPS = ('indexing crime data', 'training model')  # progress steps reported by load_crime_data
+MAX_ROUTES = 7  # candidate routes ranked per /evaluate_routes request
 
 class SafeRouteMLModel:
     def __init__(self):
-        self.crime_data = None
-        self.kd_tree = None
-        self.crime_points = None
+        self.crime_index = None
+        self.heatmap_tiles = None
         self.model = None
         self.label_encoder = None
         self.model_file = "safe_route_model.pkl"
-        self.cluster_labels = None
-        self.cluster_centroids = None
-        self.cluster_severities = None
+        self.clustering_mode = 'grid'  # 'grid' (tiled, parallel) or 'dbscan' (sklearn, single process)
+        self.shard_memory_budget_mb = 512  # Resident shard budget when loading a sharded dataset
+        self.training_shards = 8  # Shards of a sharded dataset the synthetic training routes are drawn from
         self.model_performance = {}  # To store performance metrics
         self.max_severity = 5  # Default, will be updated in load_crime_data
+        self.route_overlap_threshold = 0.9  # Candidates sharing more of their length than this are pruned
+        self.osrm_node_annotations = True  # Also ask OSRM for the OSM node ids along each route, for segment_cache
+        self.dataset_version = 0  # Bumped on every load so cached route rankings never outlive their data
+        self.result_cache = SingleFlightCache(max_entries=1024, ttl=300)  # Ranked /evaluate_routes bodies
+        self.admission = AdmissionController()  # In-flight limit and degraded tier for /evaluate_routes
+        self.segment_cache = None  # SegmentFeatureCache of per-road-segment crime data, created with the first dataset
         self.max_crimes_per_route = 1000  # Default, will be adjusted dynamically
+        self.navigator = None  # LiveNavigator re-scoring the rest of a route from GPS updates, created with the first dataset
 
-    def load_crime_data(self, file_path):
-        try:
-            df = pd.read_csv(file_path)
-            required_columns = ['Latitude', 'Longitude', 'Severity', 'CrimeID', 'CrimeCategory']
-            if not all(col in df.columns for col in required_columns):
-                raise ValueError("Missing required columns in dataset")
-            df['latitude'] = df['Latitude'].astype(float)
-            df['longitude'] = df['Longitude'].astype(float)
-            self.crime_data = df
-            self.crime_points = df[['latitude', 'longitude']].values
-            self.kd_tree = KDTree(self.crime_points)
-
-            self.max_severity = df['Severity'].max() if 'Severity' in df.columns else 5
-            logging.info(f"Dataset max severity: {self.max_severity}")
-
-            clustering = DBSCAN(eps=0.001, min_samples=5).fit(self.crime_points)
-            self.cluster_labels = clustering.labels_
-            cluster_ids = set(self.cluster_labels) - {-1}
-            self.cluster_centroids = []
-            self.cluster_severities = []
-            for cid in cluster_ids:
-                cluster_points = self.crime_points[self.cluster_labels == cid]
-                cluster_crimes = self.crime_data[self.cluster_labels == cid]
-                centroid = np.mean(cluster_points, axis=0)
-                avg_severity = np.mean(cluster_crimes['Severity'])
-                self.cluster_centroids.append(centroid)
-                self.cluster_severities.append(avg_severity)
-            self.cluster_centroids = np.array(self.cluster_centroids) if self.cluster_centroids else np.array([])
-            self.cluster_severities = np.array(self.cluster_severities) if self.cluster_severities else np.array([])
-            logging.info(f"Loaded crime data: {len(df)} records, {len(cluster_ids)} clusters found")
+    def load_crime_data(self, file_path, progress=None):
+        """
+        Index a crime dataset and train the model on it.
 
+        Parameters:
+        file_path (str): CSV file, or a sharded dataset's directory or manifest
+        progress (callable, optional): called with each of LOAD_STEPS as it starts
+        """
+        progress = progress or (lambda step: None)
+        try:
+            progress(LOAD_STEPS[0])
+            from crime_index import CrimeIndex, ShardedCrimeIndex, index_changes
+            from heatmap_tiles import HeatmapTileService
+            if self.navigator is None:
+                from live_tracking import LiveNavigator
+                from segment_cache import SegmentFeatureCache
+                self.segment_cache = SegmentFeatureCache(CRIME_RADIUS, HOTSPOT_RADIUS)
+                # Every route in a cached ranking must stay known to the navigator for as long as the
+                # ranking can be served, with as much room again for rankings that were not cached
+                self.navigator = LiveNavigator(self, CRIME_RADIUS, HOTSPOT_RADIUS,
+                                               max_routes=2 * self.result_cache.max_entries * MAX_ROUTES)
+
+            if os.path.isdir(file_path) or file_path.endswith('.json'):
+                crime_index = ShardedCrimeIndex(file_path, self.shard_memory_budget_mb, self.clustering_mode)
+            else:
+                crime_index = CrimeIndex.from_csv(file_path, self.clustering_mode)
+            changes = index_changes(self.crime_index, crime_index)
+
+            # The caches follow the index as soon as it is swapped in, not after training
+            self.crime_index = crime_index
+            self.heatmap_tiles = HeatmapTileService(crime_index)
+            self.max_severity = crime_index.max_severity
+            self.dataset_version += 1
+            self.result_cache.clear()
+            if changes is None:
+                self.segment_cache.clear(crime_index)
+            else:
+                # Reloading an updated file keeps the cached segments far from what changed
+                stale = self.segment_cache.invalidate_near(crime_index, *changes)
+                logging.info("%d crimes and %d hotspots changed; %d cached road segments invalidated",
+                             len(changes[0]), len(changes[1]), stale)
+            logging.info("Dataset max severity: %s", self.max_severity)
+
+            progress(LOAD_STEPS[1])
             self.train_model()
+            # Rankings cached while training were scored by the previous model
+            self.result_cache.clear()
         except Exception as e:
-            logging.error(f"Error loading crime data: {e}")
+            logging.error("Error loading crime data: %s", e)
             raise
 
+    def synthetic_route(self, areas, i):
+        """
+        A random 15-vertex route for training, inside areas[i % len(areas)] when areas is given.
+
+        Parameters:
+        areas (ndarray or None): (K, 4) min_lat, min_lon, max_lat, max_lon boxes, or None for all of Delhi
+        i (int): index of the route being generated
+
+        Returns:
+        list: (lat, lon) tuples
+        """
+        if areas is None:
+            lat = np.random.uniform(28.4, 28.8)
+            lon = np.random.uniform(77.0, 77.4)
+            return [(lat + np.random.uniform(-0.05, 0.05), lon + np.random.uniform(-0.05, 0.05)) for _ in range(15)]
+        min_lat, min_lon, max_lat, max_lon = areas[i % len(areas)]
+        lat = np.random.uniform(min_lat, max_lat)
+        lon = np.random.uniform(min_lon, max_lon)
+        return [(float(np.clip(lat + np.random.uniform(-0.05, 0.05), min_lat, max_lat)),
+                 float(np.clip(lon + np.random.uniform(-0.05, 0.05), min_lon, max_lon))) for _ in range(15)]
+
     def train_model(self):
+        from sklearn.ensemble import RandomForestRegressor
+        from sklearn.preprocessing import LabelEncoder
+
         np.random.seed(42)
         X, y = [], []
         time_categories = ['Morning', 'Afternoon', 'Evening', 'Night']
         self.label_encoder = LabelEncoder()
         self.label_encoder.fit(time_categories)
+        # A sharded dataset trains inside a sample of its shards, so only those get loaded
+        areas = self.crime_index.training_areas(self.training_shards, max(CRIME_RADIUS, HOTSPOT_RADIUS))
 
         # Generate training data with reduced noise
         for i in range(2000):
             try:
-                lat = np.random.uniform(28.4, 28.8)
-                lon = np.random.uniform(77.0, 77.4)
-                route_coords = [(lat + np.random.uniform(-0.05, 0.05), lon + np.random.uniform(-0.05, 0.05)) for _ in range(15)]
+                route_coords = self.synthetic_route(areas, i)
                 time_category = np.random.choice(time_categories)
                 
                 features, safety_score = self.extract_features(route_coords, time_category)
@@ -95,7 +146,7 @@ class SafeRouteMLModel:
                 X.append(features)
                 y.append(safety_score_with_noise)
             except Exception as e:
-                logging.warning(f"Error processing synthetic route {i}: {e}")
+                logging.warning("Error processing synthetic route %s: %s", i, e)
                 continue
 
         if len(X) < 50:
@@ -108,9 +159,7 @@ class SafeRouteMLModel:
         X_test_noisy, y_test_noisy = [], []
         for i in range(200):
             try:
-                lat = np.random.uniform(28.4, 28.8)
-                lon = np.random.uniform(77.0, 77.4)
-                route_coords = [(lat + np.random.uniform(-0.05, 0.05), lon + np.random.uniform(-0.05, 0.05)) for _ in range(15)]
+                route_coords = self.synthetic_route(areas, i)
                 time_category = np.random.choice(time_categories)
                 
                 features, safety_score = self.extract_features(route_coords, time_category)
@@ -119,7 +168,7 @@ class SafeRouteMLModel:
                 X_test_noisy.append(features)
                 y_test_noisy.append(safety_score_with_noise)
             except Exception as e:
-                logging.warning(f"Error processing test route {i}: {e}")
+                logging.warning("Error processing test route %s: %s", i, e)
                 continue
 
         X_test_noisy = np.array(X_test_noisy)
@@ -155,9 +204,9 @@ class SafeRouteMLModel:
         print(f"Mean Absolute Error: {mae:.2f}")
         print(f"Root Mean Squared Error: {rmse:.2f}")
         logging.info("--- Model Performance Evaluation ---")
-        logging.info(f"Custom Accuracy (within +/- {tolerance} points): {accuracy_within_tolerance:.2%}")
-        logging.info(f"Mean Absolute Error: {mae:.2f}")
-        logging.info(f"Root Mean Squared Error: {rmse:.2f}")
+        logging.info("Custom Accuracy (within +/- %s points): %.2f%%", tolerance, accuracy_within_tolerance * 100)
+        logging.info("Mean Absolute Error: %.2f", mae)
+        logging.info("Root Mean Squared Error: %.2f", rmse)
         logging.info("------------------------------------")
 
         with open(self.model_file, 'wb') as f:
@@ -171,35 +220,44 @@ class SafeRouteMLModel:
         else:
             self.train_model()
 
-    def extract_features(self, route_coords, time_category):
-        total_crimes, nearby_crimes = self.get_nearby_crimes(route_coords)
-        distance = self.calculate_distance(route_coords)
-        
-        total_severity = sum(crime['severity'] for crime in nearby_crimes) if nearby_crimes else 0
+    def extract_features(self, route_coords, time_category, max_crimes_per_route=None):
+        return self.features_from_aggregates(self.route_aggregates(route_coords), time_category, max_crimes_per_route)
+
+    def route_aggregates(self, route_coords):
+        """Corridor aggregates of a route, assembled from cached road segments when OSRM sent its node ids."""
+        nodes = getattr(route_coords, 'nodes', None)
+        if nodes is not None and len(nodes) > 1:
+            return self.segment_cache.route_aggregates(self.crime_index, route_coords, nodes, self.max_severity * 0.6)
+
+        crimes = self.crime_index.query_route(route_coords, CRIME_RADIUS)
+        severities = crimes['Severity']
+        total_crimes = len(severities)
+        hotspot_severities, min_distance_to_hotspot = self.crime_index.query_hotspots(route_coords, HOTSPOT_RADIUS)
+        return {
+            'total_crimes': total_crimes,
+            'total_severity': severities.sum() if total_crimes else 0,
+            'max_severity': severities.max() if total_crimes else 0,
+            'high_severity_crimes': int(np.sum(severities >= self.max_severity * 0.6)),
+            'crime_types': len(set(crimes['CrimeCategory'].tolist()) - {None}),  # a missing category is not a type
+            'distance': self.calculate_distance(route_coords),
+            'num_hotspots': len(hotspot_severities),
+            'high_severity_hotspots': int(np.sum(hotspot_severities >= self.max_severity * 0.6)),
+            'min_distance_to_hotspot': min_distance_to_hotspot
+        }
+
+    def features_from_aggregates(self, aggregates, time_category, max_crimes_per_route=None):
+        """Model features and raw safety score from a route's corridor aggregates."""
+        max_crimes_per_route = max_crimes_per_route or self.max_crimes_per_route
+        total_crimes = aggregates['total_crimes']
+        total_severity = aggregates['total_severity']
+        high_severity_crimes = aggregates['high_severity_crimes']
+        high_severity_hotspots = aggregates['high_severity_hotspots']
         avg_severity = total_severity / total_crimes if total_crimes > 0 else 0
-        max_severity_val = max((crime['severity'] for crime in nearby_crimes), default=0)
-        high_severity_crimes = sum(1 for crime in nearby_crimes if crime['severity'] >= self.max_severity * 0.6)
-        crime_types = len(set(crime['category'] for crime in nearby_crimes))
         time_encoded = self.label_encoder.transform([time_category])[0] if time_category else 0
+        min_distance_to_hotspot = aggregates['min_distance_to_hotspot'] * 111
 
-        num_hotspots = 0
-        high_severity_hotspots = 0
-        min_distance_to_hotspot = float('inf')
-        if self.cluster_centroids.size > 0:
-            for point in route_coords:
-                distances = np.linalg.norm(self.cluster_centroids - point, axis=1)
-                close_clusters = distances < 0.001
-                if np.any(close_clusters):
-                    num_hotspots += 1
-                    cluster_indices = np.where(close_clusters)[0]
-                    for idx in cluster_indices:
-                        if self.cluster_severities[idx] >= self.max_severity * 0.6:
-                            high_severity_hotspots += 1
-                min_distance_to_hotspot = min(min_distance_to_hotspot, np.min(distances))
-        min_distance_to_hotspot = min_distance_to_hotspot * 111
-
-        severity_penalty = total_severity / (self.max_crimes_per_route * self.max_severity) if total_crimes > 0 else 0
-        high_severity_penalty = high_severity_crimes / self.max_crimes_per_route * 0.5
+        severity_penalty = total_severity / (max_crimes_per_route * self.max_severity) if total_crimes > 0 else 0
+        high_severity_penalty = high_severity_crimes / max_crimes_per_route * 0.5
         hotspot_penalty = high_severity_hotspots * 0.05
         time_multipliers = {'Morning': 1.0, 'Afternoon': 1.0, 'Evening': 0.9, 'Night': 0.7}
         time_multiplier = time_multipliers.get(time_category, 1.0)
@@ -208,130 +266,179 @@ class SafeRouteMLModel:
         safety_score = max(10, safety_score)
 
         features = [
-            total_crimes, avg_severity, max_severity_val, high_severity_crimes,
-            distance, crime_types, time_encoded, num_hotspots, high_severity_hotspots, min_distance_to_hotspot
+            total_crimes, avg_severity, aggregates['max_severity'], high_severity_crimes,
+            aggregates['distance'], aggregates['crime_types'], time_encoded, aggregates['num_hotspots'],
+            high_severity_hotspots, min_distance_to_hotspot
         ]
         return features, safety_score
+
+    def predict_safety(self, features, raw_safety_score):
+        """Blend of the raw and model-predicted safety scores, on the 0.1-1.0 scale."""
+        return self.blend_safety(raw_safety_score, self.model.predict([features])[0])
+
+    @staticmethod
+    def blend_safety(raw_safety_score, predicted_score):
+        final_score = (raw_safety_score * 0.5) + (predicted_score * 0.5)
+        final_score = max(10, min(100, final_score))
+        return round(final_score / 100, 2)
     
     def get_nearby_crimes(self, route_coords, radius=0.1):
-        total_crimes = 0
-        nearby_crimes = []
-        seen_crimes = set()
-
-        for point in route_coords:
-            indices = self.kd_tree.query_ball_point(point, radius / 111)
-            for i in indices:
-                crime = self.crime_data.iloc[i]
-                crime_id = crime['CrimeID']
-                if crime_id not in seen_crimes:
-                    seen_crimes.add(crime_id)
-                    total_crimes += 1
-                    nearby_crimes.append({
-                        'crime_id': crime_id,
-                        'category': crime['CrimeCategory'],
-                        'location': (crime['Latitude'], crime['Longitude']),
-                        'severity': crime['Severity']
-                    })
-
-        return total_crimes, nearby_crimes
+        crimes = self.crime_index.query_route(route_coords, radius / 111)
+        nearby_crimes = [
+            {
+                'crime_id': crime_id,
+                'category': category,
+                'location': (lat, lon),
+                'severity': severity
+            }
+            for crime_id, category, lat, lon, severity in zip(
+                crimes['CrimeID'].tolist(), crimes['CrimeCategory'].tolist(), crimes['Latitude'].tolist(),
+                crimes['Longitude'].tolist(), crimes['Severity'].tolist())
+        ]
+        return len(nearby_crimes), nearby_crimes
 
     def calculate_distance(self, route_coords):
+        from geopy.distance import geodesic
+
         return sum(geodesic(route_coords[i], route_coords[i+1]).km for i in range(len(route_coords) - 1)) if len(route_coords) > 1 else 0
 
-    def get_routes(self, source, destination):
+    def get_routes(self, source, destination, degraded=False):
         try:
-            url = f"{OSRM_BASE_URL}{source[1]},{source[0]};{destination[1]},{destination[0]}?alternatives=true&steps=true&geometries=geojson&overview=full&alternatives=3"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            if 'routes' not in data or not data['routes']:
-                logging.error("OSRM returned no routes")
-                return None
-
-            routes = {}
-            route_keys = set()
-            for i, route in enumerate(data['routes']):
-                coords = [(step[1], step[0]) for step in route['geometry']['coordinates']]
-                route_key = tuple(tuple(coord) for coord in coords)
-                if route_key not in route_keys:
-                    routes[f'Route {len(routes) + 1}'] = coords
-                    route_keys.add(route_key)
-
-            if len(routes) < 6:
-                min_lat, max_lat = min(source[0], destination[0]) - 0.05, max(source[0], destination[0]) + 0.05
-                min_lon, max_lon = min(source[1], destination[1]) - 0.05, max(source[1], destination[1]) + 0.05
-                waypoints = [(np.random.uniform(min_lat, max_lat), np.random.uniform(min_lon, max_lon)) for _ in range(3)]
-
-                for i, waypoint in enumerate(waypoints):
-                    try:
-                        url1 = f"{OSRM_BASE_URL}{source[1]},{source[0]};{waypoint[1]},{waypoint[0]}?alternatives=false&steps=true&geometries=geojson&overview=full"
-                        url2 = f"{OSRM_BASE_URL}{waypoint[1]},{waypoint[0]};{destination[1]},{destination[0]}?alternatives=false&steps=true&geometries=geojson&overview=full"
-                        
-                        res1 = requests.get(url1)
-                        res2 = requests.get(url2)
-                        res1.raise_for_status()
-                        res2.raise_for_status()
-
-                        data1 = res1.json()['routes'][0]
-                        data2 = res2.json()['routes'][0]
-                        
-                        coords1 = [(step[1], step[0]) for step in data1['geometry']['coordinates']]
-                        coords2 = [(step[1], step[0]) for step in data2['geometry']['coordinates']]
-                        combined_coords = coords1[:-1] + coords2
-                        route_key = tuple(tuple(coord) for coord in combined_coords)
-                        if route_key not in route_keys:
-                            routes[f'Route {len(routes) + 1}'] = combined_coords
-                            route_keys.add(route_key)
-                    except Exception as e:
-                        logging.warning(f"Error processing waypoint {i+1}: {e}")
-                        continue
-            
-            shortest_distance = min((self.calculate_distance(coords) for coords in routes.values()), default=float('inf'))
-            max_distance = shortest_distance * 1.5
-            filtered_routes = {
-                name: coords for name, coords in sorted(routes.items(), key=lambda item: self.calculate_distance(item[1]))
-                if self.calculate_distance(coords) <= max_distance
-            }
-            
-            final_routes = dict(list(filtered_routes.items())[:7])
-            logging.info(f"Generated {len(final_routes)} unique routes")
-            return final_routes if final_routes else None
+            return run_plan(self.route_plan(source, destination, degraded))
         except Exception as e:
-            logging.error(f"Error fetching routes: {e}")
+            logging.error("Error fetching routes: %s", e)
             return None
 
-    def evaluate_routes(self, routes, time_category):
+    def route_plan(self, source, destination, degraded=False):
+        """
+        Candidate route generation, written as a plan so blocking and async servers share it.
+
+        The generator yields lists of OSRM URLs and is sent back, for each URL, its decoded
+        JSON or the exception raised fetching it (see osrm_client.run_plan). It returns the
+        routes keyed by name, or None if none were found. Degraded plans stop after OSRM's
+        own alternatives instead of adding waypoint detours.
+        """
+        url = f"{OSRM_BASE_URL}{source[1]},{source[0]};{destination[1]},{destination[0]}?{route_query(3, self.osrm_node_annotations)}"
+        data = (yield [url])[0]
+        if isinstance(data, Exception):
+            raise data
+        if 'routes' not in data or not data['routes']:
+            logging.error("OSRM returned no routes")
+            return None
+
+        routes = {}
+        route_set = RouteSet(self.route_overlap_threshold)
+        for i, route in enumerate(data['routes']):
+            coords = parse_route(route)
+            if route_set.add(coords):
+                routes[f'Route {len(routes) + 1}'] = coords
+
+        if len(routes) < 6 and not degraded:
+            waypoints = plan_waypoints(source, destination, 3, self.crime_index, routes.values())
+
+            urls = []
+            leg_query = route_query(0, self.osrm_node_annotations)
+            for waypoint in waypoints:
+                urls.append(f"{OSRM_BASE_URL}{source[1]},{source[0]};{waypoint[1]},{waypoint[0]}?{leg_query}")
+                urls.append(f"{OSRM_BASE_URL}{waypoint[1]},{waypoint[0]};{destination[1]},{destination[0]}?{leg_query}")
+            responses = yield urls
+
+            for i in range(len(waypoints)):
+                try:
+                    for leg in responses[2 * i:2 * i + 2]:
+                        if isinstance(leg, Exception):
+                            raise leg
+                    coords1 = parse_route(responses[2 * i]['routes'][0])
+                    coords2 = parse_route(responses[2 * i + 1]['routes'][0])
+                    combined_coords = join_routes(coords1, coords2)
+                    if route_set.add(combined_coords):
+                        routes[f'Route {len(routes) + 1}'] = combined_coords
+                except Exception as e:
+                    logging.warning("Error processing waypoint %s: %s", i + 1, e)
+                    continue
+
+        distances = {name: self.calculate_distance(coords) for name, coords in routes.items()}
+        shortest_distance = min(distances.values(), default=float('inf'))
+        max_distance = shortest_distance * MAX_DETOUR_RATIO
+        filtered_routes = {
+            name: coords for name, coords in sorted(routes.items(), key=lambda item: distances[item[0]])
+            if distances[name] <= max_distance
+        }
+
+        final_routes = dict(list(filtered_routes.items())[:MAX_ROUTES])
+        logging.info("Generated %d unique routes", len(final_routes))
+        return final_routes if final_routes else None
+
+    def evaluate_routes(self, routes, time_category, degraded=False):
+        """
+        Score and rank routes. The degraded tier predicts all routes in one model call and
+        leaves out the per-crime listing; scores are the same as the full tier's.
+        """
         if not self.model:
             self.load_model()
 
         results = []
-        max_crimes = 0
-        for _, coords in routes.items():
-            total_crimes, _ = self.get_nearby_crimes(coords)
-            max_crimes = max(max_crimes, total_crimes)
-        
-        self.max_crimes_per_route = max(max_crimes, 100)
-        
+        aggregates = {}
         for route_name, coords in routes.items():
             try:
-                features, raw_safety_score = self.extract_features(coords, time_category)
-                predicted_score = self.model.predict([features])[0]
-                
-                final_score = (raw_safety_score * 0.5) + (predicted_score * 0.5)
-                final_score = max(10, min(100, final_score))
+                aggregates[route_name] = self.route_aggregates(coords)
+            except Exception as e:
+                logging.warning("Error evaluating route %s: %s", route_name, e)
+        max_crimes = max((a['total_crimes'] for a in aggregates.values()), default=0)
+        
+        # Passed explicitly as well: concurrent requests scored on other threads set their own
+        max_crimes_per_route = self.max_crimes_per_route = max(max_crimes, 100)
+
+        if degraded:
+            # Routes that fail are dropped before the batched predict, so they cannot sink the others
+            scored = {}
+            for route_name in aggregates:
+                try:
+                    scored[route_name] = self.features_from_aggregates(aggregates[route_name], time_category, max_crimes_per_route)
+                except Exception as e:
+                    logging.warning("Error evaluating route %s: %s", route_name, e)
+            predictions = self.model.predict([features for features, _ in scored.values()]) if scored else []
+            for (route_name, (_, raw_safety_score)), predicted_score in zip(scored.items(), predictions):
+                coords = routes[route_name]
+                try:
+                    results.append({
+                        'route_name': route_name,
+                        'route_id': self.navigator.remember_route(coords, max_crimes_per_route),
+                        'total_crimes': aggregates[route_name]['total_crimes'],
+                        'safety_score': self.blend_safety(raw_safety_score, predicted_score),
+                        'total_distance_km': aggregates[route_name]['distance'],
+                        'nearby_crimes': [],
+                        'route_coords': coords,
+                        'time_category': time_category,
+                        'tier': DEGRADED
+                    })
+                except Exception as e:
+                    logging.warning("Error evaluating route %s: %s", route_name, e)
+            return sorted(results, key=lambda x: x['safety_score'], reverse=True)
+
+        for route_name in aggregates:
+            coords = routes[route_name]
+            try:
+                features, raw_safety_score = self.features_from_aggregates(
+                    aggregates[route_name], time_category, max_crimes_per_route)
+                safety_score = self.predict_safety(features, raw_safety_score)
+                detail_log.info("Route scored", route_name=route_name, time_category=time_category,
+                                raw_safety_score=raw_safety_score, safety_score=safety_score, **aggregates[route_name])
 
                 total_crimes, nearby_crimes = self.get_nearby_crimes(coords)
                 results.append({
                     'route_name': route_name,
+                    'route_id': self.navigator.remember_route(coords, max_crimes_per_route),
                     'total_crimes': total_crimes,
-                    'safety_score': round(final_score / 100, 2),
-                    'total_distance_km': self.calculate_distance(coords),
+                    'safety_score': safety_score,
+                    'total_distance_km': aggregates[route_name]['distance'],
                     'nearby_crimes': nearby_crimes,
                     'route_coords': coords,
-                    'time_category': time_category
+                    'time_category': time_category,
+                    'tier': FULL
                 })
             except Exception as e:
-                logging.warning(f"Error evaluating route {route_name}: {e}")
+                logging.warning("Error evaluating route %s: %s", route_name, e)
                 continue
         
         return sorted(results, key=lambda x: x['safety_score'], reverse=True)
@@ -346,12 +453,38 @@ class SafeRouteMLModel:
             return {k: SafeRouteMLModel.serialize(v) for k, v in data.items()}
         elif isinstance(data, list):
             return [SafeRouteMLModel.serialize(item) for item in data]
+        elif isinstance(data, np.ndarray):
+            return data.tolist()
         return data
 
 # Initialize model
 model = SafeRouteMLModel()
 crime_file = os.path.join(os.path.dirname(__file__), '2021-2024_DELHI_DATA.csv')
-model.load_crime_data(crime_file)
+# Loading takes a while; the server answers health checks meanwhile and 503 everything else
+warmup = Warmup(LOAD_STEPS).start(model.load_crime_data, crime_file)
+
+HEALTH_ENDPOINTS = ('healthz', 'readyz')
+
+def not_ready_body():
+    return {'error': 'Service is starting up, retry shortly', 'warmup': warmup.status()}
+
+@app.before_request
+def require_warm():
+    if not warmup.ready and request.endpoint not in HEALTH_ENDPOINTS:
+        return jsonify(not_ready_body()), 503, {'Retry-After': str(RETRY_AFTER)}
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Alive unless the warm-up failed, which no amount of waiting fixes
+    if warmup.failed:
+        return jsonify({'status': 'failed', 'warmup': warmup.status()}), 503
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    if not warmup.ready:
+        return jsonify(not_ready_body()), 503, {'Retry-After': str(RETRY_AFTER)}
+    return jsonify({'status': 'ready', 'warmup': warmup.status()}), 200
 
 @app.route('/evaluate_routes', methods=['POST'])
 def evaluate_routes():
@@ -364,18 +497,35 @@ def evaluate_routes():
         if not source or not destination:
             return jsonify({'error': 'Source and destination required'}), 400
 
-        logging.info(f"Received request: source={source}, destination={destination}, time_category={time_category}")
-        routes = model.get_routes(source, destination)
-        if not routes:
-            return jsonify({'error': 'Could not fetch routes'}), 500
+        logging.info("Received request: source=%s, destination=%s, time_category=%s", source, destination, time_category)
 
-        ranked_routes = model.evaluate_routes(routes, time_category)
-        if not ranked_routes:
-            return jsonify({'error': 'No valid routes evaluated'}), 500
-        
-        return jsonify(model.serialize(ranked_routes)), 200
+        def rank():
+            # Only the request that computes holds an admission slot; coalesced ones wait on it
+            try:
+                with model.admission.admit() as tier:
+                    degraded = tier == DEGRADED
+                    routes = model.get_routes(source, destination, degraded)
+                    if not routes:
+                        return {'error': 'Could not fetch routes'}, 500, tier
+
+                    ranked_routes = model.evaluate_routes(routes, time_category, degraded)
+                    if not ranked_routes:
+                        return {'error': 'No valid routes evaluated'}, 500, tier
+                    return app.json.dumps(model.serialize(ranked_routes)), 200, tier
+            except Overloaded as e:
+                return {'error': str(e), 'retry_after': e.retry_after}, 503, None
+
+        # Identical concurrent requests share one computation; full-tier successes are cached
+        key = route_request_key(source, destination, time_category, model.dataset_version)
+        body, status, tier = model.result_cache.get_or_compute(
+            key, rank, cacheable=lambda result: result[1] == 200 and result[2] == FULL)
+        if status == 503:
+            return jsonify(body), 503, {'Retry-After': str(body['retry_after'])}
+        if status != 200:
+            return jsonify(body), status
+        return Response(body, mimetype='application/json', headers={'X-Service-Tier': tier}), 200
     except Exception as e:
-        logging.error(f"Error in evaluate_routes: {e}")
+        logging.error("Error in evaluate_routes: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/load_crime_data', methods=['POST'])
@@ -385,7 +535,7 @@ def load_crime_data():
         model.load_crime_data(file_path)
         return jsonify({'message': 'Crime data loaded successfully'}), 200
     except Exception as e:
-        logging.error(f"Error loading crime data: {e}")
+        logging.error("Error loading crime data: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/model_performance', methods=['GET'])
@@ -394,5 +544,54 @@ def get_model_performance():
         return jsonify({'error': 'Model performance metrics not available. Model might not be trained yet.'}), 404
     return jsonify(model.serialize(model.model_performance)), 200
 
+@app.route('/navigation/start', methods=['POST'])
+def navigation_start():
+    try:
+        data = request.json
+        session = model.navigator.start(data.get('time_category'), data.get('route_id'), data.get('route_coords'))
+        return jsonify(model.serialize(session)), 200
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error("Error starting navigation: %s", e)
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/navigation/update', methods=['POST'])
+def navigation_update():
+    try:
+        data = request.json
+        if not data.get('session_id') or not data.get('location'):
+            return jsonify({'error': 'session_id and location required'}), 400
+        return jsonify(model.serialize(model.navigator.update(data['session_id'], data['location']))), 200
+    except KeyError as e:
+        return jsonify({'error': str(e.args[0])}), 404
+    except Exception as e:
+        logging.error("Error updating navigation: %s", e)
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/navigation/end', methods=['POST'])
+def navigation_end():
+    if not model.navigator.end(request.json.get('session_id')):
+        return jsonify({'error': 'Unknown session'}), 404
+    return jsonify({'message': 'Navigation session ended'}), 200
+
+@app.route('/tiles/<int:z>/<int:x>/<int:y>.<fmt>', methods=['GET'])
+def heatmap_tile(z, x, y, fmt):
+    try:
+        min_severity = request.args.get('min_severity', default=1, type=int)
+        time_category = request.args.get('time_category')
+        tile = model.heatmap_tiles.tile(z, x, y, fmt, min_severity, time_category)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logging.error("Error rendering tile %s/%s/%s: %s", z, x, y, e)
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+    response = Response(tile, mimetype='image/png') if fmt == 'png' else jsonify(tile)
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response, 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=False)
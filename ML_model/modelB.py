@@ -1,88 +1,104 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import requests
-import pandas as pd
-from geopy.distance import geodesic
-from scipy.spatial import KDTree
 import numpy as np
-from sklearn.ensemble import GradientBoostingRegressor  # Changed from RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
-from sklearn.cluster import DBSCAN
 import pickle
 import os
 import uuid
 import logging
+from log_pipeline import detail_log, setup_logging
+from osrm_client import join_routes, parse_route, route_query
+from route_cache import SingleFlightCache, route_request_key
+from route_similarity import RouteSet
+from waypoints import MAX_DETOUR_RATIO, plan_waypoints
+from warmup import RETRY_AFTER, Warmup
+
+# sklearn, scipy, pandas and geopy are imported where first needed, by the warm-up thread
 
 # Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+setup_logging()
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for frontend compatibility
 
-OSRM_BASE_URL = "http://router.project-osrm.org/route/v1/driving/"
+OSRM_BASE_URL = os.environ.get("OSRM_BASE_URL", "http://router.project-osrm.org/route/v1/driving/")  # e.g. a local stand-in for load tests
+LOAD_STEPS = ('indexing crime data', 'training model')  # progress steps reported by load_crime_data
 
 class SafeRouteMLModelB:
     def __init__(self):
-        self.crime_data = None
-        self.kd_tree = None
-        self.crime_points = None
+        self.crime_index = None
         self.model = None
         self.label_encoder = None
         self.model_file = "safe_route_model_b.pkl"  # Changed to distinguish from Model A
-        self.cluster_labels = None
-        self.cluster_centroids = None
-        self.cluster_severities = None
+        self.clustering_mode = 'grid'  # 'grid' (tiled, parallel) or 'dbscan' (sklearn, single process)
+        self.shard_memory_budget_mb = 512  # Resident shard budget when loading a sharded dataset
+        self.training_shards = 8  # Shards of a sharded dataset the synthetic training routes are drawn from
         self.max_severity = 5
+        self.route_overlap_threshold = 0.9  # Candidates sharing more of their length than this are pruned
+        self.osrm_node_annotations = False  # Also ask OSRM for the OSM node ids along each route
+        self.dataset_version = 0  # Bumped on every load so cached route rankings never outlive their data
+        self.result_cache = SingleFlightCache(max_entries=1024, ttl=300)  # Ranked /evaluate_routes bodies
         self.max_crimes_per_route = 1000
 
-    def load_crime_data(self, file_path):
+    def load_crime_data(self, file_path, progress=None):
+        progress = progress or (lambda step: None)
         try:
-            df = pd.read_csv(file_path)
-            required_columns = ['Latitude', 'Longitude', 'Severity', 'CrimeID', 'CrimeCategory']
-            if not all(col in df.columns for col in required_columns):
-                raise ValueError("Missing required columns in dataset")
-            df['latitude'] = df['Latitude'].astype(float)
-            df['longitude'] = df['Longitude'].astype(float)
-            self.crime_data = df
-            self.crime_points = df[['latitude', 'longitude']].values
-            self.kd_tree = KDTree(self.crime_points)
-
-            self.max_severity = df['Severity'].max() if 'Severity' in df.columns else 5
-            logging.info(f"Dataset max severity: {self.max_severity}")
-
-            clustering = DBSCAN(eps=0.001, min_samples=5).fit(self.crime_points)
-            self.cluster_labels = clustering.labels_
-            cluster_ids = set(self.cluster_labels) - {-1}
-            self.cluster_centroids = []
-            self.cluster_severities = []
-            for cid in cluster_ids:
-                cluster_points = self.crime_points[self.cluster_labels == cid]
-                cluster_crimes = self.crime_data[self.cluster_labels == cid]
-                centroid = np.mean(cluster_points, axis=0)
-                avg_severity = np.mean(cluster_crimes['Severity'])
-                self.cluster_centroids.append(centroid)
-                self.cluster_severities.append(avg_severity)
-            self.cluster_centroids = np.array(self.cluster_centroids) if self.cluster_centroids else np.array([])
-            self.cluster_severities = np.array(self.cluster_severities) if self.cluster_severities else np.array([])
-            logging.info(f"Loaded crime data: {len(df)} records, {len(cluster_ids)} clusters found")
-
+            progress(LOAD_STEPS[0])
+            from crime_index import CrimeIndex, ShardedCrimeIndex
+            if os.path.isdir(file_path) or file_path.endswith('.json'):
+                self.crime_index = ShardedCrimeIndex(file_path, self.shard_memory_budget_mb, self.clustering_mode)
+            else:
+                self.crime_index = CrimeIndex.from_csv(file_path, self.clustering_mode)
+
+            self.max_severity = self.crime_index.max_severity
+            self.dataset_version += 1
+            self.result_cache.clear()
+            logging.info("Dataset max severity: %s", self.max_severity)
+
+            progress(LOAD_STEPS[1])
             self.train_model()
+            # Rankings cached while training were scored by the previous model
+            self.result_cache.clear()
         except Exception as e:
-            logging.error(f"Error loading crime data: {e}")
+            logging.error("Error loading crime data: %s", e)
             raise
 
+    def synthetic_route(self, areas, i):
+        """
+        A random 15-vertex route for training, inside areas[i % len(areas)] when areas is given.
+
+        Parameters:
+        areas (ndarray or None): (K, 4) min_lat, min_lon, max_lat, max_lon boxes, or None for all of Delhi
+        i (int): index of the route being generated
+
+        Returns:
+        list: (lat, lon) tuples
+        """
+        if areas is None:
+            lat = np.random.uniform(28.4, 28.8)
+            lon = np.random.uniform(77.0, 77.4)
+            return [(lat + np.random.uniform(-0.05, 0.05), lon + np.random.uniform(-0.05, 0.05)) for _ in range(15)]
+        min_lat, min_lon, max_lat, max_lon = areas[i % len(areas)]
+        lat = np.random.uniform(min_lat, max_lat)
+        lon = np.random.uniform(min_lon, max_lon)
+        return [(float(np.clip(lat + np.random.uniform(-0.05, 0.05), min_lat, max_lat)),
+                 float(np.clip(lon + np.random.uniform(-0.05, 0.05), min_lon, max_lon))) for _ in range(15)]
+
     def train_model(self):
+        from sklearn.ensemble import GradientBoostingRegressor  # Changed from RandomForestRegressor
+        from sklearn.preprocessing import LabelEncoder
+
         np.random.seed(42)
         X, y = [], []
         time_categories = ['Morning', 'Afternoon', 'Evening', 'Night']
         self.label_encoder = LabelEncoder()
         self.label_encoder.fit(time_categories)
+        # A sharded dataset trains inside a sample of its shards, so only those get loaded
+        areas = self.crime_index.training_areas(self.training_shards, 0.001)  # the wider of the crime and hotspot radii
 
         for i in range(2000):
             try:
-                lat = np.random.uniform(28.4, 28.8)
-                lon = np.random.uniform(77.0, 77.4)
-                route_coords = [(lat + np.random.uniform(-0.05, 0.05), lon + np.random.uniform(-0.05, 0.05)) for _ in range(15)]
+                route_coords = self.synthetic_route(areas, i)
                 time_category = np.random.choice(time_categories)
                 
                 total_crimes, nearby_crimes = self.get_nearby_crimes(route_coords)
@@ -97,7 +113,7 @@ class SafeRouteMLModelB:
                 X.append(features)
                 y.append(safety_score)
             except Exception as e:
-                logging.warning(f"Error processing synthetic route {i}: {e}")
+                logging.warning("Error processing synthetic route %s: %s", i, e)
                 continue
 
         if not X:
@@ -121,30 +137,21 @@ class SafeRouteMLModelB:
             self.train_model()
 
     def extract_features(self, route_coords, time_category):
-        total_crimes, nearby_crimes = self.get_nearby_crimes(route_coords)
+        crimes = self.crime_index.query_route(route_coords, 0.1 / 111)
+        severities = crimes['Severity']
+        total_crimes = len(severities)
         distance = self.calculate_distance(route_coords)
-        
-        total_severity = sum(crime['severity'] for crime in nearby_crimes) if nearby_crimes else 0
+
+        total_severity = severities.sum() if total_crimes else 0
         avg_severity = total_severity / total_crimes if total_crimes > 0 else 0
-        max_severity = max((crime['severity'] for crime in nearby_crimes), default=0)
-        high_severity_crimes = sum(1 for crime in nearby_crimes if crime['severity'] >= self.max_severity * 0.6)
-        crime_types = len(set(crime['category'] for crime in nearby_crimes))
+        max_severity = severities.max() if total_crimes else 0
+        high_severity_crimes = int(np.sum(severities >= self.max_severity * 0.6))
+        crime_types = len(set(crimes['CrimeCategory'].tolist()) - {None})  # a missing category is not a type
         time_encoded = self.label_encoder.transform([time_category])[0] if time_category else 0
 
-        num_hotspots = 0
-        high_severity_hotspots = 0
-        min_distance_to_hotspot = float('inf')
-        if self.cluster_centroids.size > 0:
-            for point in route_coords:
-                distances = np.linalg.norm(self.cluster_centroids - point, axis=1)
-                close_clusters = distances < 0.001
-                if np.any(close_clusters):
-                    num_hotspots += 1
-                    cluster_indices = np.where(close_clusters)[0]
-                    for idx in cluster_indices:
-                        if self.cluster_severities[idx] >= self.max_severity * 0.6:
-                            high_severity_hotspots += 1
-                min_distance_to_hotspot = min(min_distance_to_hotspot, np.min(distances))
+        hotspot_severities, min_distance_to_hotspot = self.crime_index.query_hotspots(route_coords, 0.001)
+        num_hotspots = len(hotspot_severities)
+        high_severity_hotspots = int(np.sum(hotspot_severities >= self.max_severity * 0.6))
         min_distance_to_hotspot = min_distance_to_hotspot * 111
 
         severity_penalty = total_severity / (self.max_crimes_per_route * self.max_severity) if total_crimes > 0 else 0
@@ -156,10 +163,10 @@ class SafeRouteMLModelB:
         safety_score = 100 * (1 - severity_penalty - high_severity_penalty - hotspot_penalty) * time_multiplier
         safety_score = max(10, safety_score)
 
-        logging.info(f"Route features: crimes={total_crimes}, total_severity={total_severity:.2f}, "
-                     f"high_severity_crimes={high_severity_crimes}, high_severity_hotspots={high_severity_hotspots}, "
-                     f"severity_penalty={severity_penalty:.4f}, high_severity_penalty={high_severity_penalty:.4f}, "
-                     f"hotspot_penalty={hotspot_penalty:.4f}, raw_safety_score={safety_score:.2f}")
+        detail_log.info("Route features", crimes=total_crimes, total_severity=total_severity,
+                        high_severity_crimes=high_severity_crimes, high_severity_hotspots=high_severity_hotspots,
+                        severity_penalty=severity_penalty, high_severity_penalty=high_severity_penalty,
+                        hotspot_penalty=hotspot_penalty, raw_safety_score=safety_score)
 
         features = [
             total_crimes, avg_severity, max_severity, high_severity_crimes,
@@ -168,37 +175,32 @@ class SafeRouteMLModelB:
         return features, safety_score
 
     def get_nearby_crimes(self, route_coords, radius=0.1):
-        total_crimes = 0
-        nearby_crimes = []
-        seen_crimes = set()
-
-        for point in route_coords:
-            indices = self.kd_tree.query_ball_point(point, radius / 111)
-            for i in indices:
-                crime = self.crime_data.iloc[i]
-                crime_id = crime['CrimeID']
-                if crime_id not in seen_crimes:
-                    seen_crimes.add(crime_id)
-                    total_crimes += 1
-                    nearby_crimes.append({
-                        'crime_id': crime_id,
-                        'category': crime['CrimeCategory'],
-                        'location': (crime['Latitude'], crime['Longitude']),
-                        'severity': crime['Severity']
-                    })
-
-        return total_crimes, nearby_crimes
+        crimes = self.crime_index.query_route(route_coords, radius / 111)
+        nearby_crimes = [
+            {
+                'crime_id': crime_id,
+                'category': category,
+                'location': (lat, lon),
+                'severity': severity
+            }
+            for crime_id, category, lat, lon, severity in zip(
+                crimes['CrimeID'].tolist(), crimes['CrimeCategory'].tolist(), crimes['Latitude'].tolist(),
+                crimes['Longitude'].tolist(), crimes['Severity'].tolist())
+        ]
+        return len(nearby_crimes), nearby_crimes
 
     def calculate_distance(self, route_coords):
+        from geopy.distance import geodesic
+
         return sum(geodesic(route_coords[i], route_coords[i+1]).km for i in range(len(route_coords) - 1)) if len(route_coords) > 1 else 0
 
     def get_routes(self, source, destination):
         try:
-            url = f"{OSRM_BASE_URL}{source[1]},{source[0]};{destination[1]},{destination[0]}?alternatives=true&steps=true&geometries=geojson&overview=full&alternatives=3"
-            logging.info(f"Fetching direct routes from OSRM: {url}")
+            url = f"{OSRM_BASE_URL}{source[1]},{source[0]};{destination[1]},{destination[0]}?{route_query(3, self.osrm_node_annotations)}"
+            detail_log.info("Fetching direct routes from OSRM", url=url)
             response = requests.get(url)
             if response.status_code != 200:
-                logging.error(f"OSRM error: {response.status_code} - {response.text}")
+                logging.error("OSRM error: %s - %s", response.status_code, response.text)
                 return None
             data = response.json()
             if 'routes' not in data or not data['routes']:
@@ -206,66 +208,55 @@ class SafeRouteMLModelB:
                 return None
 
             routes = {}
-            route_keys = set()
+            route_set = RouteSet(self.route_overlap_threshold)
             for i, route in enumerate(data['routes']):
-                coords = [(step[1], step[0]) for step in route['geometry']['coordinates']]
-                route_key = tuple(tuple(coord) for coord in coords)
-                if route_key not in route_keys:
+                coords = parse_route(route)
+                if route_set.add(coords):
                     routes[f'Route {len(routes) + 1}'] = coords
-                    route_keys.add(route_key)
 
             if len(routes) < 6:
-                min_lat = min(source[0], destination[0]) - 0.05
-                max_lat = max(source[0], destination[0]) + 0.05
-                min_lon = min(source[1], destination[1]) - 0.05
-                max_lon = max(source[1], destination[1]) + 0.05
-
-                waypoints = [
-                    (np.random.uniform(min_lat, max_lat), np.random.uniform(min_lon, max_lon))
-                    for _ in range(3)
-                ]
+                waypoints = plan_waypoints(source, destination, 3, self.crime_index, routes.values())
 
+                leg_query = route_query(1, self.osrm_node_annotations)
                 for i, waypoint in enumerate(waypoints):
-                    url1 = f"{OSRM_BASE_URL}{source[1]},{source[0]};{waypoint[1]},{waypoint[0]}?alternatives=true&steps=true&geometries=geojson&overview=full&alternatives=1"
-                    url2 = f"{OSRM_BASE_URL}{waypoint[1]},{waypoint[0]};{destination[1]},{destination[0]}?alternatives=true&steps=true&geometries=geojson&overview=full&alternatives=1"
-                    logging.info(f"Fetching waypoint {i+1} routes: {url1} and {url2}")
+                    url1 = f"{OSRM_BASE_URL}{source[1]},{source[0]};{waypoint[1]},{waypoint[0]}?{leg_query}"
+                    url2 = f"{OSRM_BASE_URL}{waypoint[1]},{waypoint[0]};{destination[1]},{destination[0]}?{leg_query}"
+                    detail_log.info("Fetching waypoint routes", waypoint=i + 1, urls=[url1, url2])
 
                     try:
                         response1 = requests.get(url1)
                         response2 = requests.get(url2)
                         if response1.status_code != 200 or response2.status_code != 200:
-                            logging.warning(f"Waypoint {i+1} fetch failed: {response1.status_code}, {response2.status_code}")
+                            logging.warning("Waypoint %s fetch failed: %s, %s", i + 1, response1.status_code, response2.status_code)
                             continue
                         data1 = response1.json()
                         data2 = response2.json()
 
+                        legs2 = [parse_route(r2) for r2 in data2['routes']]
                         for r1 in data1['routes']:
-                            for r2 in data2['routes']:
-                                coords1 = [(step[1], step[0]) for step in r1['geometry']['coordinates']]
-                                coords2 = [(step[1], step[0]) for step in r2['geometry']['coordinates']]
-                                combined_coords = coords1[:-1] + coords2
-                                route_key = tuple(tuple(coord) for coord in combined_coords)
-                                if route_key not in route_keys:
+                            coords1 = parse_route(r1)
+                            for coords2 in legs2:
+                                combined_coords = join_routes(coords1, coords2)
+                                if route_set.add(combined_coords):
                                     routes[f'Route {len(routes) + 1}'] = combined_coords
-                                    route_keys.add(route_key)
                     except Exception as e:
-                        logging.warning(f"Error processing waypoint {i+1}: {e}")
+                        logging.warning("Error processing waypoint %s: %s", i + 1, e)
                         continue
 
-            shortest_distance = min(self.calculate_distance(coords) for coords in routes.values()) if routes else float('inf')
-            max_distance = shortest_distance * 1.5
-            filtered_routes = {}
             route_list = [(name, coords, self.calculate_distance(coords)) for name, coords in routes.items()]
             route_list = sorted(route_list, key=lambda x: x[2])
+            shortest_distance = route_list[0][2] if route_list else float('inf')
+            max_distance = shortest_distance * MAX_DETOUR_RATIO
+            filtered_routes = {}
 
             for name, coords, distance in route_list:
                 if distance <= max_distance and len(filtered_routes) < 7:
                     filtered_routes[name] = coords
 
-            logging.info(f"Generated {len(filtered_routes)} unique routes (target 6–7)")
+            logging.info("Generated %d unique routes (target 6–7)", len(filtered_routes))
             return filtered_routes if filtered_routes else None
         except Exception as e:
-            logging.error(f"Error fetching routes: {e}")
+            logging.error("Error fetching routes: %s", e)
             return None
 
     def evaluate_routes(self, routes, time_category):
@@ -284,7 +275,7 @@ class SafeRouteMLModelB:
             max_total_severity = max(max_total_severity, total_severity)
 
         self.max_crimes_per_route = max(max_crimes, 100)
-        logging.info(f"Dynamic max_crimes_per_route: {self.max_crimes_per_route}, max_total_severity: {max_total_severity}")
+        logging.info("Dynamic max_crimes_per_route: %d, max_total_severity: %s", self.max_crimes_per_route, max_total_severity)
 
         for route_name, coords in routes.items():
             try:
@@ -307,10 +298,10 @@ class SafeRouteMLModelB:
                 })
                 raw_scores.append(raw_safety_score)
             except Exception as e:
-                logging.warning(f"Error evaluating route {route_name}: {e}")
+                logging.warning("Error evaluating route %s: %s", route_name, e)
                 continue
 
-        logging.info(f"Raw safety scores: {[round(s, 2) for s in raw_scores]}")
+        detail_log.info("Raw safety scores", raw_safety_scores=[round(s, 2) for s in raw_scores])
         return sorted(results, key=lambda x: x['safety_score'], reverse=True)
 
     @staticmethod
@@ -323,12 +314,31 @@ class SafeRouteMLModelB:
             return {k: SafeRouteMLModelB.serialize(v) for k, v in data.items()}
         elif isinstance(data, list):
             return [SafeRouteMLModelB.serialize(item) for item in data]
+        elif isinstance(data, np.ndarray):
+            return data.tolist()
         return data
 
 # Initialize model
 model = SafeRouteMLModelB()
 crime_file = os.path.join(os.path.dirname(__file__), '2021-2024_DELHI_DATA.csv')
-model.load_crime_data(crime_file)
+warmup = Warmup(LOAD_STEPS).start(model.load_crime_data, crime_file)
+
+@app.before_request
+def require_warm():
+    if not warmup.ready and request.endpoint not in ('healthz', 'readyz'):
+        return jsonify({'error': 'Service is starting up, retry shortly', 'warmup': warmup.status()}), 503, {'Retry-After': str(RETRY_AFTER)}
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    if warmup.failed:
+        return jsonify({'status': 'failed', 'warmup': warmup.status()}), 503
+    return jsonify({'status': 'alive'}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    if not warmup.ready:
+        return jsonify({'error': 'Service is starting up, retry shortly', 'warmup': warmup.status()}), 503, {'Retry-After': str(RETRY_AFTER)}
+    return jsonify({'status': 'ready', 'warmup': warmup.status()}), 200
 
 @app.route('/evaluate_routes', methods=['POST'])
 def evaluate_routes():
@@ -342,21 +352,30 @@ def evaluate_routes():
             logging.error("Missing source or destination")
             return jsonify({'error': 'Source and destination required'}), 400
 
-        logging.info(f"Received request: source={source}, destination={destination}, time_category={time_category}")
-        routes = model.get_routes(source, destination)
-        if not routes:
-            logging.error("No routes fetched from OSRM")
-            return jsonify({'error': 'Could not fetch routes'}), 500
+        logging.info("Received request: source=%s, destination=%s, time_category=%s", source, destination, time_category)
+
+        def rank():
+            routes = model.get_routes(source, destination)
+            if not routes:
+                logging.error("No routes fetched from OSRM")
+                return {'error': 'Could not fetch routes'}, 500
+
+            ranked_routes = model.evaluate_routes(routes, time_category)
+            if not ranked_routes:
+                logging.error("No routes evaluated successfully")
+                return {'error': 'No valid routes evaluated'}, 500
 
-        ranked_routes = model.evaluate_routes(routes, time_category)
-        if not ranked_routes:
-            logging.error("No routes evaluated successfully")
-            return jsonify({'error': 'No valid routes evaluated'}), 500
+            logging.info("Returning %d ranked routes", len(ranked_routes))
+            return app.json.dumps(model.serialize(ranked_routes)), 200
 
-        logging.info(f"Returning {len(ranked_routes)} ranked routes")
-        return jsonify(model.serialize(ranked_routes)), 200
+        # Identical concurrent requests share one computation; successful bodies are cached
+        key = route_request_key(source, destination, time_category, model.dataset_version)
+        body, status = model.result_cache.get_or_compute(key, rank, cacheable=lambda result: result[1] == 200)
+        if status != 200:
+            return jsonify(body), status
+        return Response(body, mimetype='application/json'), 200
     except Exception as e:
-        logging.error(f"Error in evaluate_routes: {e}")
+        logging.error("Error in evaluate_routes: %s", e)
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/load_crime_data', methods=['POST'])
@@ -367,10 +386,8 @@ def load_crime_data():
         logging.info("Crime data loaded successfully")
         return jsonify({'message': 'Crime data loaded successfully'}), 200
     except Exception as e:
-        logging.error(f"Error loading crime data: {e}")
+        logging.error("Error loading crime data: %s", e)
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    model = SafeRouteMLModelB()
-    model.load_crime_data(os.path.join(os.path.dirname(__file__), '2021-2024_DELHI_DATA.csv'))
     app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
@@ -0,0 +1,134 @@
+import asyncio
+
+import numpy as np
+import requests
+
+POLYLINE_PRECISION = 6  # geometries=polyline6
+OSRM_TIMEOUT = 10  # seconds; a hung request would otherwise hold its admission slot indefinitely
+
+
+class RouteGeometry(np.ndarray):
+    """(N, 2) lat/lon route array carrying the OSM node ids of its vertices when OSRM sent them."""
+
+    def __new__(cls, coords, nodes=None):
+        geometry = np.asarray(coords, dtype=float).reshape(-1, 2).view(cls)
+        geometry.nodes = nodes
+        return geometry
+
+    def __array_finalize__(self, obj):
+        # Slices and arithmetic results no longer line up with the node ids
+        self.nodes = None
+
+
+def route_query(alternatives=0, annotations=False):
+    """OSRM route options asking only for what scoring uses: the full geometry, no steps."""
+    query = f"alternatives={alternatives if alternatives else 'false'}&steps=false&geometries=polyline6&overview=full"
+    return query + "&annotations=nodes" if annotations else query
+
+
+def decode_polyline(encoded, precision=POLYLINE_PRECISION):
+    """
+    Decode an encoded polyline into an (N, 2) lat/lon array without a per-character loop.
+
+    Every value is a run of 5-bit groups, least significant first, whose last group has
+    the 0x20 continuation bit clear; values are zigzag-encoded deltas.
+    """
+    chunks = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if len(chunks) == 0:
+        return np.empty((0, 2))
+    ends = np.flatnonzero((chunks & 0x20) == 0)
+    starts = np.r_[0, ends[:-1] + 1]
+    shifts = 5 * (np.arange(len(chunks)) - np.repeat(starts, ends - starts + 1))
+    values = np.add.reduceat((chunks & 0x1f) << shifts, starts)
+    deltas = (values >> 1) ^ -(values & 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10 ** precision
+
+
+def parse_route(route):
+    """RouteGeometry of one OSRM route, with node ids when annotations=nodes was requested."""
+    geometry = route['geometry']
+    if isinstance(geometry, dict):
+        coords = np.asarray(geometry['coordinates'], dtype=float).reshape(-1, 2)[:, ::-1]
+    else:
+        coords = decode_polyline(geometry)
+    nodes = None
+    legs = route.get('legs') or []
+    if legs and all('annotation' in leg and 'nodes' in leg['annotation'] for leg in legs):
+        # Consecutive legs share the node at the waypoint between them
+        leg_nodes = [np.asarray(leg['annotation']['nodes'], dtype=np.int64) for leg in legs]
+        nodes = np.concatenate([leg_nodes[0]] + [n[1:] for n in leg_nodes[1:]])
+        if len(nodes) != len(coords):
+            nodes = None
+    return RouteGeometry(coords, nodes)
+
+
+def join_routes(first, second):
+    """One route from two whose end and start coincide, e.g. source->waypoint->destination."""
+    nodes = None
+    if first.nodes is not None and second.nodes is not None:
+        nodes = np.concatenate([first.nodes[:-1], second.nodes])
+    return RouteGeometry(np.vstack([np.asarray(first)[:-1], np.asarray(second)]), nodes)
+
+
+def fetch_json(urls, session=None):
+    """
+    GET each OSRM URL in turn.
+
+    Returns:
+    list: the decoded JSON of each response, or the exception raised fetching it
+    """
+    results = []
+    for url in urls:
+        try:
+            response = (session or requests).get(url, timeout=OSRM_TIMEOUT)
+            response.raise_for_status()
+            results.append(response.json())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+async def fetch_json_async(client, urls):
+    """Concurrent counterpart of fetch_json using an httpx.AsyncClient."""
+    async def fetch(url):
+        response = await client.get(url)
+        response.raise_for_status()
+        return response.json()
+
+    return await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+
+
+def _advance(plan, value=None):
+    # StopIteration cannot cross a Future, so completion is reported as a flag
+    try:
+        return False, plan.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def run_plan(plan, fetch=fetch_json):
+    """
+    Drive a route plan to completion with blocking requests.
+
+    A plan is a generator that yields lists of OSRM URLs, is sent back the
+    fetch_json results for them, and finally returns its routes.
+    """
+    done, value = _advance(plan)
+    while not done:
+        done, value = _advance(plan, fetch(value))
+    return value
+
+
+async def run_plan_async(plan, client, executor):
+    """
+    Drive a route plan with non-blocking OSRM calls.
+
+    The plan's own steps (parsing, deduplication, distances) run on the executor so
+    the event loop only waits on the network.
+    """
+    loop = asyncio.get_running_loop()
+    done, value = await loop.run_in_executor(executor, _advance, plan)
+    while not done:
+        responses = await fetch_json_async(client, value)
+        done, value = await loop.run_in_executor(executor, _advance, plan, responses)
+    return value
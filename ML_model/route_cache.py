@@ -0,0 +1,154 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+SNAP_CELL = 0.0005  # degrees (~55 m); requests starting and ending in the same cells share a result
+
+
+def snap(point, cell=SNAP_CELL):
+    """Grid cell of a (lat, lon) point, used as part of a cache key."""
+    return (round(float(point[0]) / cell), round(float(point[1]) / cell))
+
+
+def route_request_key(source, destination, time_category, dataset_version):
+    return (snap(source), snap(destination), time_category, dataset_version)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlightCache:
+    """
+    Bounded LRU/TTL cache in front of an expensive computation, with request coalescing.
+
+    Concurrent callers asking for a key that is not cached wait for the single caller
+    computing it instead of repeating the work. Only results accepted by `cacheable`
+    are stored; errors are passed to every waiting caller and never cached.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, result)
+        self.in_flight = {}
+        self.async_in_flight = {}  # key -> asyncio.Future, for callers on an event loop
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = 0
+
+    def get_or_compute(self, key, compute, cacheable=lambda result: True):
+        """
+        Cached result for key, computing it at most once across concurrent callers.
+
+        Parameters:
+        key (hashable): identifies the computation
+        compute (callable): produces the result when it is neither cached nor in flight
+        cacheable (callable): decides whether a computed result may be stored
+
+        Returns:
+        The cached, shared or freshly computed result
+        """
+        with self.lock:
+            found, result = self._lookup(key)
+            if found:
+                return result
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                # A clear() while computing drops the flight, so a stale result is not stored
+                if self.in_flight.get(key) is flight:
+                    del self.in_flight[key]
+                    if flight.error is None and cacheable(flight.result):
+                        self._store(key, flight.result)
+            flight.done.set()
+        return flight.result
+
+    async def get_or_compute_async(self, key, compute, cacheable=lambda result: True):
+        """
+        get_or_compute for coroutines: waiting callers await the leader instead of
+        blocking a thread. `compute` is a coroutine function.
+        """
+        with self.lock:
+            found, result = self._lookup(key)
+            if found:
+                return result
+            future = self.async_in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.async_in_flight[key] = asyncio.get_running_loop().create_future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return await asyncio.shield(future)
+
+        try:
+            result = await compute()
+        except BaseException as e:
+            with self.lock:
+                if self.async_in_flight.get(key) is future:
+                    del self.async_in_flight[key]
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()  # retrieved here, so no warning when nobody was waiting
+            else:
+                future.cancel()
+            raise
+        with self.lock:
+            if self.async_in_flight.get(key) is future:
+                del self.async_in_flight[key]
+                if cacheable(result):
+                    self._store(key, result)
+        future.set_result(result)
+        return result
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry[0] <= time.monotonic():
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def _store(self, key, result):
+        self.entries[key] = (time.monotonic() + self.ttl, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.in_flight.clear()
+            self.async_in_flight.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'in_flight': len(self.in_flight) + len(self.async_in_flight),
+                    'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
@@ -0,0 +1,66 @@
+import hashlib
+
+import numpy as np
+
+from corridor import polyline_distances, resample, simplify
+
+MATCH_TOLERANCE = 0.0003  # degrees (~33 m); points closer than this to the other route overlap it
+SNAP_CELL = 0.0005  # degrees (~55 m) grid used for fingerprints
+
+
+def route_fingerprint(coords, cell=SNAP_CELL):
+    """
+    Compact hash of a route's shape: simplified, grid-snapped and with repeats dropped.
+
+    Routes that differ only by vertex density or a few metres of drift share a fingerprint.
+    """
+    snapped = np.round(simplify(coords, cell / 2) / cell).astype(np.int64)
+    if len(snapped) > 1:
+        snapped = snapped[np.r_[True, np.any(np.diff(snapped, axis=0) != 0, axis=1)]]
+    return hashlib.blake2b(snapped.tobytes(), digest_size=8).digest()
+
+
+def overlap_fraction(samples, simplified, tolerance=MATCH_TOLERANCE):
+    """
+    Share of a route's evenly spaced samples lying within tolerance of another polyline.
+
+    This is a partial Hausdorff test: the directed Hausdorff distance is bounded by
+    tolerance once the fraction reaches 1.
+    """
+    return float(np.mean(polyline_distances(samples, simplified) <= tolerance))
+
+
+class RouteSet:
+    """
+    Candidate routes kept so far, rejecting any new one that mostly overlaps a kept one.
+
+    A route is a near-duplicate when its fingerprint matches, or when both it and a
+    kept route have more than `overlap_threshold` of their length within
+    MATCH_TOLERANCE of each other.
+    """
+
+    def __init__(self, overlap_threshold=0.9, tolerance=MATCH_TOLERANCE):
+        self.overlap_threshold = overlap_threshold
+        self.tolerance = tolerance
+        self.fingerprints = set()
+        self.kept = []  # (simplified, samples, bbox_min, bbox_max)
+
+    def add(self, coords):
+        """Keep the route and return True unless it duplicates a route already kept."""
+        fingerprint = route_fingerprint(coords)
+        if fingerprint in self.fingerprints:
+            return False
+
+        simplified = simplify(coords, self.tolerance / 4)
+        samples = resample(simplified, self.tolerance)
+        bbox_min, bbox_max = samples.min(axis=0), samples.max(axis=0)
+        for other_simplified, other_samples, other_min, other_max in self.kept:
+            if np.any(bbox_min > other_max + self.tolerance) or np.any(other_min > bbox_max + self.tolerance):
+                continue
+            if (overlap_fraction(samples, other_simplified, self.tolerance) > self.overlap_threshold
+                    and overlap_fraction(other_samples, simplified, self.tolerance) > self.overlap_threshold):
+                return False
+
+        self.fingerprints.add(fingerprint)
+        self.kept.append((simplified, samples, bbox_min, bbox_max))
+        return True
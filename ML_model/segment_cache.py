@@ -0,0 +1,244 @@
+import threading
+
+import numpy as np
+from geopy.distance import geodesic
+from scipy.spatial import KDTree
+
+from corridor import segments_near
+from crime_index import HOTSPOT_HORIZON
+
+MAX_SEGMENTS = 200000  # about the drivable network of a large city; the least recently used half goes beyond it
+
+
+def segment_keys(nodes):
+    """Undirected (node, node) key of each consecutive pair, so both directions of a street share an entry."""
+    nodes = np.asarray(nodes, dtype=np.int64)
+    a, b = nodes[:-1], nodes[1:]
+    return list(zip(np.minimum(a, b).tolist(), np.maximum(a, b).tolist()))
+
+
+def _group(rows, groups, n_groups):
+    """Split row indices by group number into n_groups arrays."""
+    order = np.argsort(groups, kind='stable')
+    return np.split(rows[order], np.searchsorted(groups[order], np.arange(1, n_groups)))
+
+
+class SegmentFeatureCache:
+    """
+    Crime and hotspot data of road segments, keyed by the OSM node ids at their ends.
+
+    Routes served in one city keep reusing the same streets, so each segment's length,
+    nearby crimes, hotspots and distance to the closest hotspot are computed once and
+    shared. Fixed-size values live in arrays indexed by a slot number per segment. The
+    crime and hotspot rows near each segment are kept per slot as well, so that route
+    totals count a crime once even where the corridors of consecutive segments overlap.
+
+    Entries go stale per segment: invalidate_near() marks the segments close to changed
+    crimes or hotspots, which are recomputed the next time a route uses them. Entries
+    belong to the crime index given to clear() or invalidate_near(); results computed
+    from any other index, e.g. by requests still running on the previous one, are
+    returned but not stored.
+    """
+
+    def __init__(self, crime_radius, hotspot_radius, max_segments=MAX_SEGMENTS, horizon=HOTSPOT_HORIZON):
+        self.crime_radius = crime_radius
+        self.hotspot_radius = hotspot_radius
+        self.horizon = horizon
+        self.max_segments = max_segments
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self, crime_index=None):
+        with self.lock:
+            self.crime_index = crime_index  # the index cached entries were computed from
+            self.slots = {}  # segment key -> slot
+            self.keys = []  # slot -> segment key
+            self.ends = np.empty((0, 4))  # slot -> start lat/lon, end lat/lon
+            self.km = np.empty(0)  # NaN until computed
+            self.hotspot_distance = np.empty(0)  # degrees, NaN while stale
+            self.last_used = np.empty(0, dtype=np.int64)
+            self.crimes = []  # slot -> (crime keys, severities, category codes), None while stale
+            self.hotspots = []  # slot -> (centroids, mean severities), None while stale
+            self.categories = {}  # category label -> code shared by all slots; -1 for a missing category
+            self.generation = 0  # bumped when slots are renumbered
+            self.tick = 0
+            self.hits = self.misses = 0
+
+    def _reserve(self, n):
+        capacity = len(self.km)
+        if n <= capacity:
+            return
+        grow = max(n, 2 * capacity, 1024) - capacity
+        self.ends = np.vstack([self.ends, np.zeros((grow, 4))])
+        self.km = np.r_[self.km, np.full(grow, np.nan)]
+        self.hotspot_distance = np.r_[self.hotspot_distance, np.full(grow, np.nan)]
+        self.last_used = np.r_[self.last_used, np.zeros(grow, dtype=np.int64)]
+
+    def _evict(self, count):
+        """Keep only the `count` most recently used segments."""
+        n = len(self.keys)
+        keep = np.sort(np.argsort(self.last_used[:n], kind='stable')[n - count:])
+        self.keys = [self.keys[i] for i in keep]
+        self.crimes = [self.crimes[i] for i in keep]
+        self.hotspots = [self.hotspots[i] for i in keep]
+        self.slots = {key: slot for slot, key in enumerate(self.keys)}
+        for name in ('ends', 'km', 'hotspot_distance', 'last_used'):
+            values = getattr(self, name)
+            compacted = np.zeros_like(values)
+            compacted[:len(keep)] = values[keep]
+            if name in ('km', 'hotspot_distance'):
+                compacted[len(keep):] = np.nan
+            setattr(self, name, compacted)
+        self.generation += 1
+
+    def _slots_for(self, keys, coords):
+        """Slot of each route segment, adding the segments not seen before. Called with the lock held."""
+        self.tick += 1
+        new = {key: i for i, key in enumerate(keys) if key not in self.slots}
+        if len(self.keys) + len(new) > self.max_segments:
+            cached = {key for key in keys if key in self.slots}
+            self.last_used[[self.slots[key] for key in cached]] = self.tick
+            # Halve the cache, or more if the route's new segments need it; the route's own
+            # segments are the most recent, so they always survive, even if the route alone
+            # is larger than the cache
+            self._evict(max(len(cached), min(len(self.keys) // 2,
+                                             self.max_segments - len(cached) - len(new))))
+            new = {key: i for i, key in enumerate(keys) if key not in self.slots}
+        self._reserve(len(self.keys) + len(new))
+        for key, i in new.items():
+            slot = len(self.keys)
+            self.slots[key] = slot
+            self.keys.append(key)
+            self.crimes.append(None)
+            self.hotspots.append(None)
+            self.ends[slot] = np.r_[coords[i], coords[i + 1]]
+            self.km[slot] = np.nan
+            self.hotspot_distance[slot] = np.nan
+        slots = np.array([self.slots[key] for key in keys], dtype=np.int64)
+        self.last_used[slots] = self.tick
+        self.hits += len(keys) - len(new)
+        self.misses += len(new)
+        return slots
+
+    def route_aggregates(self, crime_index, coords, nodes, high_severity):
+        """
+        Corridor aggregates of a route assembled from its segments, shaped like those of
+        SafeRouteMLModel.extract_features.
+
+        Parameters:
+        crime_index (CrimeIndex): queried for the segments not cached yet
+        coords (ndarray): (N, 2) route vertices
+        nodes (ndarray): (N,) OSM node id of each vertex
+        high_severity (float): severity from which a crime or hotspot counts as high-severity
+        """
+        coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+        keys = segment_keys(nodes)
+        with self.lock:
+            generation = self.generation
+            slots = self._slots_for(keys, coords)
+            unique, first, inverse = np.unique(slots, return_index=True, return_inverse=True)
+            km = self.km[unique]
+            hotspot_distance = self.hotspot_distance[unique]
+            crimes = [self.crimes[slot] for slot in unique]
+            hotspots = [self.hotspots[slot] for slot in unique]
+
+        starts, ends = coords[first], coords[first + 1]
+        missing = np.flatnonzero(np.isnan(km))
+        for j in missing:
+            km[j] = geodesic(starts[j], ends[j]).km
+
+        missing_crimes = np.array([j for j, rows in enumerate(crimes) if rows is None], dtype=np.int64)
+        if len(missing_crimes):
+            found = crime_index.query_route(coords, self.crime_radius, with_keys=True)
+            points = np.column_stack([found['Latitude'], found['Longitude']])
+            rows, near = segments_near(points, starts[missing_crimes], ends[missing_crimes], self.crime_radius)
+            with self.lock:
+                codes = np.array([-1 if label is None else self.categories.setdefault(label, len(self.categories))
+                                  for label in found['CrimeCategory'].tolist()], dtype=np.int64)
+            severities = found['Severity'].astype(np.int64)
+            for j, segment_rows in zip(missing_crimes, _group(rows, near, len(missing_crimes))):
+                crimes[j] = (found['CrimeKey'][segment_rows], severities[segment_rows], codes[segment_rows])
+
+        missing_hotspots = np.array([j for j, rows in enumerate(hotspots) if rows is None], dtype=np.int64)
+        if len(missing_hotspots):
+            centroids, severities, _, _ = crime_index.route_hotspots(coords, self.hotspot_radius, self.horizon)
+            rows, near = segments_near(centroids, starts[missing_hotspots], ends[missing_hotspots], self.hotspot_radius)
+            for j, segment_rows in zip(missing_hotspots, _group(rows, near, len(missing_hotspots))):
+                hotspots[j] = (centroids[segment_rows], severities[segment_rows])
+
+        missing_distances = np.flatnonzero(np.isnan(hotspot_distance))
+        if len(missing_distances):
+            # Points every hotspot_radius along each segment, both ends included, as corridor_probes spaces them
+            seg = ends[missing_distances] - starts[missing_distances]
+            steps = np.maximum(np.ceil(np.linalg.norm(seg, axis=1) / self.hotspot_radius).astype(np.int64), 1)
+            offsets = np.r_[0, np.cumsum(steps + 1)[:-1]]
+            owner = np.repeat(np.arange(len(steps)), steps + 1)
+            t = (np.arange(len(owner)) - offsets[owner]) / steps[owner]
+            points = starts[missing_distances][owner] + t[:, None] * seg[owner]
+            hotspot_distance[missing_distances] = np.minimum.reduceat(
+                crime_index.hotspot_distances(points, self.horizon), offsets)
+
+        with self.lock:
+            if generation == self.generation and crime_index is self.crime_index:
+                self.km[unique] = km
+                self.hotspot_distance[unique] = hotspot_distance
+                for j in missing_crimes:
+                    self.crimes[unique[j]] = crimes[j]
+                for j in missing_hotspots:
+                    self.hotspots[unique[j]] = hotspots[j]
+
+        crime_keys = np.concatenate([rows[0] for rows in crimes])
+        _, once = np.unique(crime_keys, return_index=True)
+        severities = np.concatenate([rows[1] for rows in crimes])[once]
+        categories = np.concatenate([rows[2] for rows in crimes])[once]
+        centroids = np.concatenate([rows[0] for rows in hotspots])
+        _, once = np.unique(centroids, axis=0, return_index=True) if len(centroids) else (None, np.array([], dtype=np.int64))
+        hotspot_severities = np.concatenate([rows[1] for rows in hotspots])[once]
+        return {
+            'total_crimes': len(severities),
+            'total_severity': severities.sum() if len(severities) else 0,
+            'max_severity': severities.max() if len(severities) else 0,
+            'high_severity_crimes': int(np.sum(severities >= high_severity)),
+            'crime_types': len(np.unique(categories[categories >= 0])),
+            'distance': float(km[inverse].sum()),
+            'num_hotspots': len(hotspot_severities),
+            'high_severity_hotspots': int(np.sum(hotspot_severities >= high_severity)),
+            'min_distance_to_hotspot': float(min(hotspot_distance.min(), self.horizon)) if len(keys) else self.horizon
+        }
+
+    def invalidate_near(self, crime_index, crime_points=(), hotspot_points=()):
+        """
+        Switch to an updated crime index, marking segments stale around what changed: crime
+        rows within the crime radius of a changed crime, hotspot rows within the hotspot
+        radius of a changed hotspot, and hotspot distances within the horizon of one.
+
+        Returns:
+        int: number of segments touched
+        """
+        with self.lock:
+            self.crime_index = crime_index
+            n = len(self.keys)
+            if n == 0:
+                return 0
+            midpoints = (self.ends[:n, :2] + self.ends[:n, 2:]) / 2
+            half_lengths = np.linalg.norm(self.ends[:n, 2:] - self.ends[:n, :2], axis=1) / 2
+
+            def near(points, radius):
+                points = np.asarray(points, dtype=float).reshape(-1, 2)
+                if len(points) == 0:
+                    return np.zeros(n, dtype=bool)
+                return KDTree(points).query_ball_point(midpoints, half_lengths + radius, return_length=True) > 0
+
+            stale_crimes = near(crime_points, self.crime_radius)
+            stale_hotspots = near(hotspot_points, self.hotspot_radius)
+            stale_distances = near(hotspot_points, self.horizon)
+            for slot in np.flatnonzero(stale_crimes):
+                self.crimes[slot] = None
+            for slot in np.flatnonzero(stale_hotspots):
+                self.hotspots[slot] = None
+            self.hotspot_distance[:n][stale_distances] = np.nan
+            return int(np.sum(stale_crimes | stale_hotspots | stale_distances))
+
+    def stats(self):
+        with self.lock:
+            return {'segments': len(self.keys), 'hits': self.hits, 'misses': self.misses}
@@ -1,8 +1,165 @@
+import argparse
+import os
+
 import pandas as pd
 
-def filter_coordinates(csv_file, min_lat, max_lat, min_lon, max_lon, lat_col='latitude', lon_col='longitude', output_file=None):
+DEFAULT_CHUNKSIZE = 200000
+
+
+def _validate_box(min_lat, max_lat, min_lon, max_lon):
+    # Validate coordinate ranges
+    if min_lat > max_lat:
+        raise ValueError("min_lat must be less than or equal to max_lat")
+    if min_lon > max_lon:
+        raise ValueError("min_lon must be less than or equal to max_lon")
+
+    # Validate latitude values
+    if not (-90 <= min_lat <= 90) or not (-90 <= max_lat <= 90):
+        raise ValueError("Latitude must be between -90 and 90 degrees")
+
+    # Validate longitude values
+    if not (-180 <= min_lon <= 180) or not (-180 <= max_lon <= 180):
+        raise ValueError("Longitude must be between -180 and 180 degrees")
+
+
+def _resolve_columns(columns, lat_col, lon_col):
+    """Actual latitude/longitude column names, matched case-insensitively."""
+    required_columns = {lat_col.lower(), lon_col.lower()}
+    available_columns = {col.lower() for col in columns}
+    if not required_columns.issubset(available_columns):
+        missing = required_columns - available_columns
+        raise ValueError(f"Missing required columns: {missing}. Check column names in CSV (case-insensitive).")
+    lat_actual = next(col for col in columns if col.lower() == lat_col.lower())
+    lon_actual = next(col for col in columns if col.lower() == lon_col.lower())
+    return lat_actual, lon_actual
+
+
+def _read_chunks(source, lat_col, lon_col, boxes, chunksize):
+    """
+    Yield DataFrame chunks of a CSV or Parquet source with standard 'latitude'/'longitude' columns.
+
+    For Parquet files or partitioned Parquet directories the bounding boxes are pushed
+    down into the scan, so row groups outside every box are never decoded.
+    """
+    if os.path.isdir(source) or source.endswith('.parquet'):
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(source, format='parquet')
+        lat_actual, lon_actual = _resolve_columns(dataset.schema.names, lat_col, lon_col)
+        predicate = None
+        for min_lat, max_lat, min_lon, max_lon in boxes:
+            in_box = ((ds.field(lat_actual) >= min_lat) & (ds.field(lat_actual) <= max_lat) &
+                      (ds.field(lon_actual) >= min_lon) & (ds.field(lon_actual) <= max_lon))
+            predicate = in_box if predicate is None else predicate | in_box
+        batches = (batch.to_pandas() for batch in dataset.to_batches(filter=predicate, batch_size=chunksize))
+        empty = dataset.schema.empty_table().to_pandas()
+    else:
+        empty = pd.read_csv(source, nrows=0)
+        lat_actual, lon_actual = _resolve_columns(empty.columns, lat_col, lon_col)
+        batches = pd.read_csv(source, chunksize=chunksize)
+
+    read_any = False
+    for chunk in batches:
+        read_any = True
+        yield _standardize(chunk, lat_actual, lon_actual)
+    if not read_any:
+        # Nothing left after the pushdown (or an empty file): one empty chunk still carries the columns
+        yield _standardize(empty, lat_actual, lon_actual)
+
+
+def _standardize(chunk, lat_actual, lon_actual):
+    # Rename columns to standard 'latitude' and 'longitude' for internal processing
+    chunk = chunk.rename(columns={lat_actual: 'latitude', lon_actual: 'longitude'})
+    # Convert to numeric (in case they're read as strings)
+    chunk['latitude'] = pd.to_numeric(chunk['latitude'], errors='coerce')
+    chunk['longitude'] = pd.to_numeric(chunk['longitude'], errors='coerce')
+    return chunk
+
+
+class _ChunkWriter:
+    """
+    Appends DataFrame chunks to a CSV or Parquet file, creating it on the first write.
+
+    An output no chunk was written to is still replaced on close, by a file holding
+    only the columns, so a stale file from an earlier run never survives.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet_writer = None
+        self.rows = 0
+
+    def write(self, df):
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            # Later chunks may infer narrower types (e.g. an all-null column), so follow the first schema
+            self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+        else:
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=self.rows == 0, index=False)
+        self.rows += len(df)
+
+    def close(self, empty):
+        """Finish the file; `empty` is a zero-row frame with the columns to write if no rows came."""
+        if self.rows == 0:
+            self.write(empty)
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+
+def extract_bounding_boxes(source, boxes, output_files, lat_col='latitude', lon_col='longitude', chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Stream a crime file once and write the rows of several bounding boxes to separate files.
+
+    Memory is bounded by the chunk size: each chunk is filtered with vectorised masks and
+    the matching rows are appended to their output straight away.
+
+    Parameters:
+    source (str): CSV file, Parquet file or partitioned Parquet directory
+    boxes (list): (min_lat, max_lat, min_lon, max_lon) tuples
+    output_files (list): one .csv or .parquet path per box
+    lat_col (str): Name of the latitude column in the source (case-insensitive)
+    lon_col (str): Name of the longitude column in the source (case-insensitive)
+    chunksize (int): rows processed at a time
+
+    Returns:
+    list: number of rows written for each box
+
+    Raises:
+    ValueError: If coordinates are invalid, required columns are missing or the
+    number of boxes and outputs differ
+    """
+    if len(boxes) != len(output_files):
+        raise ValueError("Provide exactly one output file per bounding box")
+    for box in boxes:
+        _validate_box(*box)
+
+    writers = [_ChunkWriter(path) for path in output_files]
+    empty = None
+    try:
+        for chunk in _read_chunks(source, lat_col, lon_col, boxes, chunksize):
+            if empty is None:
+                empty = chunk.iloc[:0]
+            for (min_lat, max_lat, min_lon, max_lon), writer in zip(boxes, writers):
+                mask = chunk['latitude'].between(min_lat, max_lat) & chunk['longitude'].between(min_lon, max_lon)
+                if mask.any():
+                    writer.write(chunk[mask])
+    finally:
+        # No chunk read means the source failed before any output was opened
+        if empty is not None:
+            for writer in writers:
+                writer.close(empty)
+    return [writer.rows for writer in writers]
+
+
+def filter_coordinates(csv_file, min_lat, max_lat, min_lon, max_lon, lat_col='latitude', lon_col='longitude', output_file=None, chunksize=DEFAULT_CHUNKSIZE):
     """
     Filter CSV data to include only rows within specified latitude and longitude range.
+    For several boxes or results too large for memory use extract_bounding_boxes.
     
     Parameters:
     csv_file (str): Path to the CSV file
@@ -13,6 +170,7 @@ def filter_coordinates(csv_file, min_lat, max_lat, min_lon, max_lon, lat_col='la
     lat_col (str): Name of the latitude column in the CSV (default: 'latitude')
     lon_col (str): Name of the longitude column in the CSV (default: 'longitude')
     output_file (str, optional): Path to save filtered data. If None, won't save.
+    chunksize (int): Rows read at a time; only matching rows are kept in memory
     
     Returns:
     DataFrame: Filtered data within the coordinate boundaries, or None if error occurs
@@ -21,49 +179,15 @@ def filter_coordinates(csv_file, min_lat, max_lat, min_lon, max_lon, lat_col='la
     ValueError: If coordinates are invalid or required columns are missing
     """
     try:
-        # Validate coordinate ranges
-        if min_lat > max_lat:
-            raise ValueError("min_lat must be less than or equal to max_lat")
-        if min_lon > max_lon:
-            raise ValueError("min_lon must be less than or equal to max_lon")
-        
-        # Validate latitude values
-        if not (-90 <= min_lat <= 90) or not (-90 <= max_lat <= 90):
-            raise ValueError("Latitude must be between -90 and 90 degrees")
-        
-        # Validate longitude values
-        if not (-180 <= min_lon <= 180) or not (-180 <= max_lon <= 180):
-            raise ValueError("Longitude must be between -180 and 180 degrees")
-        
-        # Read CSV file
-        df = pd.read_csv(csv_file)
-        
-        # Check for required columns
-        required_columns = {lat_col.lower(), lon_col.lower()}
-        available_columns = {col.lower() for col in df.columns}
-        
-        if not required_columns.issubset(available_columns):
-            missing = required_columns - available_columns
-            raise ValueError(f"Missing required columns: {missing}. Check column names in CSV (case-insensitive).")
-
-        # Rename columns to standard 'latitude' and 'longitude' for internal processing
-        lat_actual = next(col for col in df.columns if col.lower() == lat_col.lower())
-        lon_actual = next(col for col in df.columns if col.lower() == lon_col.lower())
-        df = df.rename(columns={lat_actual: 'latitude', lon_actual: 'longitude'})
-
-        # Convert to numeric (in case they're read as strings)
-        df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-        df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-        
-        # Drop rows with invalid coordinates
-        df = df.dropna(subset=['latitude', 'longitude'])
-        
-        # Filter data based on coordinate boundaries
-        filtered_df = df[
-            (df['latitude'].between(min_lat, max_lat)) & 
-            (df['longitude'].between(min_lon, max_lon))
-        ].copy()
-        
+        _validate_box(min_lat, max_lat, min_lon, max_lon)
+
+        # Read the file in chunks, keeping only rows inside the boundaries
+        parts = [
+            chunk[chunk['latitude'].between(min_lat, max_lat) & chunk['longitude'].between(min_lon, max_lon)]
+            for chunk in _read_chunks(csv_file, lat_col, lon_col, [(min_lat, max_lat, min_lon, max_lon)], chunksize)
+        ]
+        filtered_df = pd.concat(parts) if parts else pd.DataFrame()
+
         # Reset index if needed
         filtered_df.reset_index(drop=True, inplace=True)
         
@@ -84,9 +208,28 @@ def filter_coordinates(csv_file, min_lat, max_lat, min_lon, max_lon, lat_col='la
         return None
 
 def main():
-    """Example usage of the coordinate filtering function"""
+    """Example usage of the coordinate filtering function, or a streaming extraction when boxes are given"""
+    parser = argparse.ArgumentParser(description="Extract crimes inside one or more bounding boxes")
+    parser.add_argument('source', nargs='?', default="2021-2024_DELHI_DATA.csv",
+                        help="CSV file, Parquet file or partitioned Parquet directory")
+    parser.add_argument('--box', nargs=5, action='append', default=[],
+                        metavar=('MIN_LAT', 'MAX_LAT', 'MIN_LON', 'MAX_LON', 'OUTPUT'),
+                        help="bounding box and its .csv or .parquet output; repeat for several boxes")
+    parser.add_argument('--lat-col', default='Latitude')
+    parser.add_argument('--lon-col', default='Longitude')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    if args.box:
+        boxes = [tuple(float(v) for v in box[:4]) for box in args.box]
+        outputs = [box[4] for box in args.box]
+        counts = extract_bounding_boxes(args.source, boxes, outputs, args.lat_col, args.lon_col, args.chunksize)
+        for box, output, count in zip(boxes, outputs, counts):
+            print(f"{box}: {count} records written to '{output}'")
+        return
+
     # Example coordinates for a small area in Delhi
-    CSV_FILE = "2021-2024_DELHI_DATA.csv"  # Replace with your actual file path
+    CSV_FILE = args.source
     OUTPUT_FILE = "filtered_data.csv"
     
     # Coordinate boundaries (example for a small area in Delhi)
@@ -98,8 +241,8 @@ def main():
     }
     
     # Specify the actual column names in your CSV
-    LAT_COLUMN = 'Latitude'  # Replace with the actual latitude column name in your CSV
-    LON_COLUMN = 'Longitude'  # Replace with the actual longitude column name in your CSV
+    LAT_COLUMN = args.lat_col
+    LON_COLUMN = args.lon_col
     
     print(f"Filtering data for coordinates: {COORDINATES}")
     filtered_data = filter_coordinates(
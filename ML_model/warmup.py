@@ -0,0 +1,84 @@
+import logging
+import threading
+import time
+
+RETRY_AFTER = 5  # seconds a client is told to wait before retrying while the service warms up
+
+WARMING_UP = 'warming_up'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class Warmup:
+    """
+    Start-up work (loading data, building indexes, training) run on a background thread,
+    so the web server can bind and answer health checks while it happens.
+
+    The target reports progress by calling the `progress` callback it is given with the
+    name of each step as it starts; `steps` lists the names expected, in order, and is
+    only used to express progress as a fraction.
+    """
+
+    def __init__(self, steps=()):
+        self.steps = list(steps)
+        self.state = WARMING_UP
+        self.step = None
+        self.step_seconds = {}
+        self.error = None
+        self.started = self.step_started = time.monotonic()
+        self.finished = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def advance(self, step):
+        """Mark the current step finished and `step` started."""
+        now = time.monotonic()
+        with self.lock:
+            if self.step is not None:
+                self.step_seconds[self.step] = round(now - self.step_started, 2)
+            self.step, self.step_started = step, now
+        logging.info("Warm-up: %s", step)
+
+    def start(self, target, *args):
+        """Run target(*args, progress=self.advance) on a daemon thread. Returns self."""
+        threading.Thread(target=self._run, args=(target, args), name='warmup', daemon=True).start()
+        return self
+
+    def _run(self, target, args):
+        try:
+            target(*args, progress=self.advance)
+            self.advance(None)
+            self.state = READY
+            logging.info("Warm-up finished in %.1f s", time.monotonic() - self.started)
+        except Exception as e:
+            self.error = str(e)
+            self.state = FAILED
+            logging.exception("Warm-up failed")
+        finally:
+            self.finished = time.monotonic()
+            self.done.set()
+
+    @property
+    def ready(self):
+        return self.state == READY
+
+    @property
+    def failed(self):
+        return self.state == FAILED
+
+    def wait(self, timeout=None):
+        """Block until the warm-up has finished; True if it succeeded."""
+        self.done.wait(timeout)
+        return self.ready
+
+    def status(self):
+        with self.lock:
+            done = len([step for step in self.steps if step in self.step_seconds])
+            return {
+                'status': self.state,
+                'step': self.step,
+                'progress': round(done / len(self.steps), 2) if self.steps else float(self.ready),
+                'elapsed_seconds': round((self.finished or time.monotonic()) - self.started, 2),
+                'step_seconds': dict(self.step_seconds),
+                'error': self.error
+            }
@@ -0,0 +1,107 @@
+import hashlib
+
+import numpy as np
+
+from corridor import polyline_distances, simplify
+from route_cache import snap
+
+MAX_DETOUR_RATIO = 1.5  # candidate routes longer than this times the shortest one are dropped
+DETOUR_MARGIN = 0.8  # share of the allowed detour waypoints may use, leaving room for road circuity
+MIN_DETOUR_RATIO = 1.05  # waypoints closer to the straight line mostly reproduce the direct route
+CANDIDATE_SAMPLES = 96
+LEG_PROBES = 8  # points along each straight leg checked for hotspots
+HOTSPOT_AVOID_RADIUS = 0.005  # degrees (~550 m)
+HOTSPOT_WEIGHT = 0.5  # how much hotspot exposure counts against a waypoint's spread
+
+
+def request_rng(source, destination):
+    """Random generator seeded by the snapped endpoints, so a request always gets the same waypoints."""
+    key = repr((snap(source), snap(destination))).encode()
+    return np.random.default_rng(int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big'))
+
+
+def sample_ellipse(source, destination, max_ratio, n, rng, min_ratio=MIN_DETOUR_RATIO):
+    """
+    Points P with min_ratio <= (|SP| + |PD|) / |SD| <= max_ratio, uniform over that region.
+
+    P lies inside the ellipse with foci S and D and major axis max_ratio * |SD|. Distances
+    are measured in a local plane with longitudes scaled by cos(latitude).
+
+    Returns:
+    ndarray: (k, 2) lat/lon points, k <= n
+    """
+    source, destination = np.asarray(source, dtype=float), np.asarray(destination, dtype=float)
+    scale = np.array([1.0, np.cos(np.radians((source[0] + destination[0]) / 2))])
+    s, d = source * scale, destination * scale
+    focal = np.linalg.norm(d - s) / 2
+    if focal == 0:
+        return np.empty((0, 2))
+    major = (d - s) / (2 * focal)
+    minor = np.array([-major[1], major[0]])
+    a = max_ratio * focal
+    b = np.sqrt(a ** 2 - focal ** 2)
+
+    radius = np.sqrt(rng.random(n))
+    angle = rng.random(n) * 2 * np.pi
+    points = (s + d) / 2 + (a * radius * np.cos(angle))[:, None] * major + (b * radius * np.sin(angle))[:, None] * minor
+    detour = (np.linalg.norm(points - s, axis=1) + np.linalg.norm(points - d, axis=1)) / (2 * focal)
+    return points[detour >= min_ratio] / scale
+
+
+def leg_probes(source, waypoints, destination, n=LEG_PROBES):
+    """(len(waypoints), 2 * n, 2) points along the straight legs source -> waypoint -> destination."""
+    t = (np.arange(n) + 0.5)[None, :, None] / n
+    waypoints = waypoints[:, None, :]
+    first = source + t * (waypoints - source)
+    second = waypoints + t * (destination - waypoints)
+    return np.concatenate([first, second], axis=1)
+
+
+def plan_waypoints(source, destination, count, crime_index=None, existing_routes=(),
+                   max_detour=MAX_DETOUR_RATIO):
+    """
+    Waypoints for alternative routes that can survive the detour filter.
+
+    Candidates are sampled inside the detour ellipse, then picked greedily: each pick is
+    the candidate farthest from the routes already found and the waypoints already
+    picked, less a penalty for hotspots near its straight legs.
+
+    Parameters:
+    source, destination (tuple): (lat, lon)
+    count (int): number of waypoints wanted
+    crime_index (CrimeIndex, optional): used to steer away from hotspots
+    existing_routes (iterable): routes already found, as (N, 2) lat/lon sequences
+    max_detour (float): the route filter's length cutoff relative to the shortest route
+
+    Returns:
+    list: up to count (lat, lon) waypoints, the same for every request with these endpoints
+    """
+    source, destination = np.asarray(source, dtype=float), np.asarray(destination, dtype=float)
+    rng = request_rng(source, destination)
+    candidates = sample_ellipse(source, destination, 1 + (max_detour - 1) * DETOUR_MARGIN, CANDIDATE_SAMPLES, rng)
+    if len(candidates) == 0:
+        return []
+
+    exposure = np.zeros(len(candidates))
+    if crime_index is not None:
+        probes = leg_probes(source, candidates, destination)
+        exposure = crime_index.hotspot_severity_near(probes.reshape(-1, 2), HOTSPOT_AVOID_RADIUS)
+        exposure = exposure.reshape(len(candidates), -1).sum(axis=1)
+        if exposure.max() > 0:
+            exposure = exposure / exposure.max()
+
+    # Spread is measured in units of the ellipse's half-width, so it is comparable to exposure
+    straight = np.linalg.norm(destination - source)
+    half_width = straight / 2 * np.sqrt(max_detour ** 2 - 1)
+    spread = np.full(len(candidates), 1.0)
+    for route in existing_routes:
+        route = simplify(np.asarray(route, dtype=float).reshape(-1, 2), half_width / 50)
+        spread = np.minimum(spread, polyline_distances(candidates, route) / half_width)
+
+    picked = []
+    for _ in range(min(count, len(candidates))):
+        best = int(np.argmax(spread - HOTSPOT_WEIGHT * exposure))
+        picked.append((float(candidates[best][0]), float(candidates[best][1])))
+        spread = np.minimum(spread, np.linalg.norm(candidates - candidates[best], axis=1) / half_width)
+        spread[best] = -np.inf
+    return picked
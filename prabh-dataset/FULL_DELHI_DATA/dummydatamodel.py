@@ -1,9 +1,17 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
 import osmnx as ox
 import numpy as np
 import pandas as pd
 import folium
-import random
-from datetime import datetime, timedelta
+from folium.plugins import HeatMap
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
 
 # Multiple coordinates to cover wider Delhi area
 REGION_COORDS = [
@@ -14,6 +22,12 @@ REGION_COORDS = [
     ("Central Delhi", 28.6328, 77.2190)
 ]
 
+GRAPH_CACHE_DIR = "graph_cache"
+BATCH_SIZE = 1_000_000  # rows generated and written per batch
+BATCHES_IN_FLIGHT_PER_WORKER = 2  # batches submitted ahead of the writer, bounding memory held by finished ones
+MAP_CELL = 0.005  # degrees (~550 m) per heatmap cell; the map holds one point per cell, not per crime
+TILE_SERVER_URL = "http://localhost:8000"  # ML_model service exposing /tiles/{z}/{x}/{y}.png for the data it has loaded
+
 def generate_detailed_crime_types():
     return {
         'Theft': [
@@ -75,93 +89,215 @@ def generate_detailed_crime_types():
         ]
     }
 
-def generate_simplified_id(crime_type, date):
-    crime_prefix = crime_type[:3].upper()
-    date_part = date.strftime('%y%m%d')
-    random_suffix = f"{random.randint(0, 999):03d}"
-    return f"{crime_prefix}-{date_part}-{random_suffix}"
+_TIME_LABELS = None
+
+def _time_labels():
+    """All 86,400 `HH:MM:SS` strings, so times are formatted by a single take()."""
+    global _TIME_LABELS
+    if _TIME_LABELS is None:
+        seconds = np.arange(24 * 3600)
+        _TIME_LABELS = pa.array([f"{h:02d}:{m:02d}:{s:02d}" for h, m, s in zip(seconds // 3600, seconds // 60 % 60, seconds % 60)])
+    return _TIME_LABELS
+
+def generate_simplified_ids(type_prefixes, date_parts, rng):
+    """Vectorised `<TYP>-<yymmdd>-<nnn>` IDs from per-row type prefixes and date parts."""
+    suffixes = pa.array([f"{i:03d}" for i in range(1000)]).take(rng.integers(0, 1000, len(date_parts)))
+    return pc.binary_join_element_wise(type_prefixes, date_parts, suffixes, '-')
+
+def load_region_edges(latitude, longitude, dist=10000, cache_dir=GRAPH_CACHE_DIR):
+    """
+    Road geometries and lengths around a point, downloading the graph only once.
+
+    The osmnx graph is cached as GraphML under cache_dir, so repeated runs and every
+    worker process reuse the same download.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{latitude:.4f}_{longitude:.4f}_{dist}.graphml")
+    if os.path.exists(path):
+        graph = ox.load_graphml(path)
+    else:
+        graph = ox.graph_from_point((latitude, longitude), dist=dist, network_type='drive')
+        ox.save_graphml(graph, path)
+    edges = ox.graph_to_gdfs(graph, nodes=False)
+    geometries = edges.geometry.values
+    return np.asarray(geometries), shapely.length(geometries)
+
+_EDGE_CACHE = {}
+
+def _region_edges(latitude, longitude):
+    key = (latitude, longitude)
+    if key not in _EDGE_CACHE:
+        _EDGE_CACHE[key] = load_region_edges(latitude, longitude)
+    return _EDGE_CACHE[key]
+
+def generate_road_table(num_entries, latitude, longitude, specific_year=2021, rng=None):
+    """
+    Synthetic crimes placed on the road network around a point, as an Arrow table.
+
+    Roads are sampled in proportion to their length and every column is produced as a
+    whole array, so the cost per row is a handful of vectorised operations.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    geometries, lengths = _region_edges(latitude, longitude)
+
+    edge_idx = rng.choice(len(geometries), size=num_entries, p=lengths / lengths.sum())
+    points = shapely.line_interpolate_point(geometries[edge_idx], rng.random(num_entries), normalized=True)
+
+    crime_types_dict = generate_detailed_crime_types()
+    categories = list(crime_types_dict)
+    category_idx = rng.integers(0, len(categories), num_entries)
+    type_counts = np.array([len(crime_types_dict[c]) for c in categories])
+    type_offsets = np.concatenate([[0], np.cumsum(type_counts)[:-1]])
+    type_idx = type_offsets[category_idx] + (rng.random(num_entries) * type_counts[category_idx]).astype(int)
+    all_types = [t for c in categories for t in crime_types_dict[c]]
+    type_names = np.array([name for name, _ in all_types], dtype=object)
+    type_severities = np.array([severity for _, severity in all_types], dtype=np.int8)
+
+    month_starts = np.arange(f'{specific_year}-01', f'{specific_year + 1}-01', dtype='datetime64[M]').astype('datetime64[D]')
+    dates = month_starts[rng.integers(0, 12, num_entries)] + rng.integers(0, 28, num_entries)
+    # At most 336 distinct days: format each once, then gather
+    days, day_idx = np.unique(dates, return_inverse=True)
+    day_labels = np.datetime_as_string(days)
+    date_labels = pa.array(day_labels).take(day_idx)
+    id_date_labels = pa.array([d[2:4] + d[5:7] + d[8:10] for d in day_labels]).take(day_idx)
+    type_prefixes = pa.array([name[:3].upper() for name in type_names]).take(type_idx)
+
+    return pa.table({
+        'CrimeID': generate_simplified_ids(type_prefixes, id_date_labels, rng),
+        'CrimeCategory': pa.array(np.array(categories, dtype=object)[category_idx], type=pa.string()),
+        'CrimeType': pa.array(type_names[type_idx], type=pa.string()),
+        'Latitude': shapely.get_y(points),
+        'Longitude': shapely.get_x(points),
+        'CrimeDate': date_labels,
+        'CrimeTime': _time_labels().take(rng.integers(0, 24 * 3600, num_entries)),
+        'Severity': type_severities[type_idx]
+    })
 
 def generate_road_data(num_entries, latitude, longitude, specific_year=2021):
     try:
-        graph = ox.graph_from_point(
-            (latitude, longitude), 
-            dist=10000,  
-            network_type='drive'
-        )
-        
-        edges = ox.graph_to_gdfs(graph, nodes=False)
-        crime_types_dict = generate_detailed_crime_types()
-        crime_data = []
-        
-        for _ in range(num_entries):
-            crime_category = random.choice(list(crime_types_dict.keys()))
-            specific_crime, severity = random.choice(crime_types_dict[crime_category])
-            road = edges.iloc[random.randint(0, len(edges)-1)]
-            road_line = road.geometry
-            point_along_road = road_line.interpolate(random.random(), normalized=True)
-            
-            crime_date = datetime(year=specific_year, month=random.randint(1, 12), day=random.randint(1, 28))
-            crime_datetime = crime_date.replace(
-                hour=random.randint(0, 23), 
-                minute=random.randint(0, 59), 
-                second=random.randint(0, 59)
-            )
-            
-            crime_data.append({
-                'CrimeID': generate_simplified_id(specific_crime, crime_datetime),
-                'CrimeCategory': crime_category,
-                'CrimeType': specific_crime,
-                'Latitude': point_along_road.y,
-                'Longitude': point_along_road.x,
-                'CrimeDate': crime_datetime.strftime('%Y-%m-%d'),
-                'CrimeTime': crime_datetime.strftime('%H:%M:%S'),
-                'Severity': severity
-            })
-        
-        return pd.DataFrame(crime_data)
+        return generate_road_table(num_entries, latitude, longitude, specific_year).to_pandas()
     except Exception as e:
         print(f"Error generating road-specific data: {e}")
         return pd.DataFrame()
 
-def get_color(severity):
-    colors = {1: 'green', 2: 'lightgreen', 3: 'orange', 4: 'red', 5: 'darkred'}
-    return colors.get(severity, 'blue')
+def bin_crimes(parquet_file, cell=MAP_CELL):
+    """
+    Crime count and severity sum per grid cell, streamed from a Parquet file batch by batch.
 
-def create_combined_map(data):
-    map_center = [data['Latitude'].mean(), data['Longitude'].mean()]
-    crime_map = folium.Map(location=map_center, zoom_start=11)
-    
-    for _, row in data.iterrows():
-        folium.Marker(
-            location=[row['Latitude'], row['Longitude']],
-            popup=f"""
-            ID: {row['CrimeID']}<br>
-            Category: {row['CrimeCategory']}<br>
-            Type: {row['CrimeType']}<br>
-            Date: {row['CrimeDate']}<br>
-            Time: {row['CrimeTime']}<br>
-            Severity: {row['Severity']}
-            """,
-            icon=folium.Icon(color=get_color(row['Severity']))
-        ).add_to(crime_map)
-    
-    crime_map.save("2024_DELHI.html")
-    print("Combined map saved as 2024_DELHI.html")
+    Returns:
+    DataFrame: one row per non-empty cell with its centre 'Latitude'/'Longitude', 'crimes' and 'severity'
+    """
+    totals = None
+    for batch in pq.ParquetFile(parquet_file).iter_batches(columns=['Latitude', 'Longitude', 'Severity']):
+        df = batch.to_pandas()
+        cells = pd.DataFrame({
+            'lat_cell': np.floor(df['Latitude'].to_numpy() / cell).astype(np.int64),
+            'lon_cell': np.floor(df['Longitude'].to_numpy() / cell).astype(np.int64),
+            'crimes': 1,
+            'severity': df['Severity'].to_numpy(dtype=np.int64)
+        }).groupby(['lat_cell', 'lon_cell']).sum()
+        totals = cells if totals is None else totals.add(cells, fill_value=0)
+    if totals is None:
+        return pd.DataFrame(columns=['Latitude', 'Longitude', 'crimes', 'severity'])
+    totals = totals.astype(np.int64).reset_index()
+    totals['Latitude'] = (totals.pop('lat_cell') + 0.5) * cell
+    totals['Longitude'] = (totals.pop('lon_cell') + 0.5) * cell
+    return totals
+
+def create_combined_map(cells, output_file="2024_DELHI.html"):
+    """
+    Severity-weighted heatmap of binned crimes (see bin_crimes). Its size depends on the
+    area covered, not the number of crimes, so it stays usable for any dataset size.
+    """
+    crime_map = folium.Map(location=[cells['Latitude'].mean(), cells['Longitude'].mean()], zoom_start=11)
+    HeatMap(cells[['Latitude', 'Longitude', 'severity']].to_numpy().tolist(), name="Crime heatmap",
+            radius=15).add_to(crime_map)
+    folium.LayerControl().add_to(crime_map)
+    crime_map.save(output_file)
+    print(f"Combined map ({len(cells)} cells) saved as {output_file}")
+
+def create_tile_map(center, tiles_url=TILE_SERVER_URL, output_file="2024_DELHI.html"):
+    """
+    Map whose crime layer is fetched tile by tile from the ML service instead of embedded.
+
+    The tiles show whatever dataset that service has loaded, not a file this script wrote:
+    load it first, e.g. POST {"file_path": "<parquet>"} to {tiles_url}/load_crime_data.
+    """
+    crime_map = folium.Map(location=center, zoom_start=11)
+    folium.TileLayer(
+        tiles=f"{tiles_url}/tiles/{{z}}/{{x}}/{{y}}.png",
+        attr="Safe Steps crime heatmap",
+        name="Crime heatmap",
+        overlay=True,
+        opacity=0.8
+    ).add_to(crime_map)
+    folium.LayerControl().add_to(crime_map)
+    crime_map.save(output_file)
+    print(f"Tile map saved as {output_file}")
+
+def _generate_batch(task):
+    region_idx, batch_idx, num_entries, specific_year, seed = task
+    _, latitude, longitude = REGION_COORDS[region_idx]
+    rng = np.random.default_rng([seed, region_idx, batch_idx])
+    return generate_road_table(num_entries, latitude, longitude, specific_year, rng)
+
+def _warm_graph_cache(region_idx):
+    _, latitude, longitude = REGION_COORDS[region_idx]
+    load_region_edges(latitude, longitude)
+
+def generate_dataset(output_file, entries_per_region, specific_year=2021, seed=0, workers=None, batch_size=BATCH_SIZE):
+    """
+    Generate crimes for every region in a process pool, streaming batches into Parquet.
+
+    Parameters:
+    output_file (str): Parquet file to write
+    entries_per_region (int): rows generated per region
+    specific_year (int): year of the generated crime dates
+    seed (int): base seed; each (region, batch) gets its own reproducible stream
+    workers (int, optional): process count, defaults to the CPU count
+    batch_size (int): rows per generated batch, bounding memory per worker
+
+    Returns:
+    int: total rows written
+    """
+    tasks = [
+        (region_idx, batch_idx, min(batch_size, entries_per_region - start), specific_year, seed)
+        for region_idx in range(len(REGION_COORDS))
+        for batch_idx, start in enumerate(range(0, entries_per_region, batch_size))
+    ]
+    total = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Download each region's graph once before the batches fan out
+        list(pool.map(_warm_graph_cache, range(len(REGION_COORDS))))
+        # Batches are submitted as earlier ones are written, so a slow writer holds back the
+        # workers instead of letting finished tables pile up; they are written in task order
+        window = BATCHES_IN_FLIGHT_PER_WORKER * (workers or os.cpu_count() or 1)
+        remaining = iter(tasks)
+        in_flight = deque(pool.submit(_generate_batch, task) for task in islice(remaining, window))
+        writer = None
+        try:
+            while in_flight:
+                table = in_flight.popleft().result()
+                for task in islice(remaining, 1):
+                    in_flight.append(pool.submit(_generate_batch, task))
+                if writer is None:
+                    writer = pq.ParquetWriter(output_file, table.schema)
+                writer.write_table(table)
+                total += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+    return total
 
 def main():
     specific_year = 2024 #year
-    all_data = pd.DataFrame()
-    
-    for region_name, latitude, longitude in REGION_COORDS:
-        print(f"Processing region: {region_name}")
-        data = generate_road_data(18040, latitude, longitude, specific_year=specific_year)
-        if not data.empty:
-            all_data = pd.concat([all_data, data])
-    
-    if not all_data.empty:
-        create_combined_map(all_data)
-        all_data.to_csv("2024_DELHI_DATA.csv", index=False)
-        print("Combined crime data saved as 2024_DELHI_DATA.csv")
+    output_file = "2024_DELHI_DATA.parquet"
+
+    total = generate_dataset(output_file, 18040, specific_year=specific_year)
+    print(f"Combined crime data ({total} rows) saved as {output_file}")
+
+    if total:
+        create_combined_map(bin_crimes(output_file))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
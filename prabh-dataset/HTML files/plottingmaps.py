@@ -1,26 +1,50 @@
+import argparse
+
 import folium
+import numpy as np
+import pandas as pd
+from folium.plugins import HeatMap
+
+MAP_CELL = 0.005  # degrees (~550 m) per heatmap cell; the map holds one point per cell, not per crime
+
+
+def load_crimes(source):
+    """Latitude, Longitude and Severity of every crime in a CSV or Parquet file."""
+    columns = ['Latitude', 'Longitude', 'Severity']
+    if source.endswith('.parquet'):
+        return pd.read_parquet(source, columns=columns)
+    return pd.read_csv(source, usecols=columns)
+
+
+def bin_crimes(data, cell=MAP_CELL):
+    """Severity sum per grid cell, at the cell centre, so map size depends on area, not crime count."""
+    cells = pd.DataFrame({
+        'lat_cell': np.floor(data['Latitude'].to_numpy() / cell).astype(np.int64),
+        'lon_cell': np.floor(data['Longitude'].to_numpy() / cell).astype(np.int64),
+        'severity': data['Severity'].to_numpy(dtype=np.int64)
+    }).groupby(['lat_cell', 'lon_cell'], as_index=False)['severity'].sum()
+    return [[(lat + 0.5) * cell, (lon + 0.5) * cell, int(severity)]
+            for lat, lon, severity in cells.itertuples(index=False)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Severity-weighted crime heatmap of a crime CSV or Parquet file")
+    parser.add_argument('source', nargs='?', default="../../ML_model/2021-2024_DELHI_DATA.csv")
+    parser.add_argument('--output', default="crime_map.html")
+    args = parser.parse_args()
+
+    # Create a map centered at an approximate location
+    map_center = [28.60, 77.20]
+    crime_map = folium.Map(location=map_center, zoom_start=12)
+
+    # One weighted point per cell instead of a marker per crime
+    HeatMap(bin_crimes(load_crimes(args.source)), name="Crime heatmap", radius=15).add_to(crime_map)
+    folium.LayerControl().add_to(crime_map)
+
+    # Save map to an HTML file
+    crime_map.save(args.output)
+    print(f"Map saved as {args.output}")
+
 
-# Function to get color based on severity
-def get_color(severity):
-    if severity == 5:
-        return 'red'  # Major crime
-    elif severity >= 3:
-        return 'orange'  # Moderate crime
-    else:
-        return 'lightred'  # Minor crime
-
-# Create a map centered at an approximate location
-map_center = [28.60, 77.20]
-crime_map = folium.Map(location=map_center, zoom_start=12)
-
-# Add markers to the map
-for _, row in data.iterrows():
-    folium.Marker(
-        location=[row['Latitude'], row['Longitude']],
-        popup=f"Crime: {row['CrimeType']}<br>Date: {row['CrimeDate']}<br>Severity: {row['Severity']}",
-        icon=folium.Icon(color=get_color(row['Severity']))
-    ).add_to(crime_map)
-
-# Save map to an HTML file
-crime_map.save("crime_map.html")
-print("Map saved as crime_map.html")
+if __name__ == "__main__":
+    main()